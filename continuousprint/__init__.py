@@ -5,8 +5,6 @@ import octoprint.plugin
 from octoprint.util import RepeatedTimer
 
 from .data import (
-    PRINTER_PROFILES,
-    GCODE_SCRIPTS,
     Keys,
     CustomEvents,
     ASSETS,
@@ -110,6 +108,8 @@ class ContinuousprintPlugin(
         except Exception:
             # Local IP details are used for display only
             local_ip = "<ip_address>"
+        from .data import PRINTER_PROFILES, GCODE_SCRIPTS
+
         return dict(
             exceptions=self._plugin.get_exceptions(),
             printer_profiles=list(PRINTER_PROFILES.values()),
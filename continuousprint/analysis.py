@@ -1,71 +1,187 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED
+from concurrent.futures import wait as wait_futures
+from multiprocessing.connection import wait
 from octoprint.filemanager.analysis import AbstractAnalysisQueue, AnalysisAborted
-from octoprint.util.platform import CLOSE_FDS
 from octoprint.util import dict_merge
 
 
 class CPQProfileAnalysisQueue(AbstractAnalysisQueue):
-    """This queue attempts to resolve the profiles for which a gcode has been created."""
+    """This queue attempts to resolve the profiles for which a gcode has been created.
+
+    Analysis is done by a long-lived worker process (see extract_profile.serve)
+    which is started on first use and restarted if it is aborted or dies.
+    """
 
     META_KEY = "continuousprint"
     PROFILE_KEY = "profile"
+    SLICER_KEY = "slicer"
+    METADATA_KEY = "metadata"
 
-    def __init__(self, finished_callback):
+    def __init__(self, finished_callback, ctx=None):
+        # Spawn (rather than fork) the worker; OctoPrint is heavily threaded
+        # and forking it is not safe.
+        self._ctx = ctx if ctx is not None else multiprocessing.get_context("spawn")
+        self._proc = None
+        self._conn = None
+        self._abort_recv, self._abort_send = self._ctx.Pipe(duplex=False)
         AbstractAnalysisQueue.__init__(self, finished_callback)
 
-        self._aborted = False
-        self._reenqueue = False
+    def _start_worker(self):
+        from .scripts.extract_profile import serve
 
-    def _do_analysis(self, high_priority=False):
-        import sys
-        import sarge
+        self._conn, child_conn = self._ctx.Pipe()
+        self._proc = self._ctx.Process(target=serve, args=(child_conn,), daemon=True)
+        self._proc.start()
+        child_conn.close()
+        self._logger.info(f"Started profile analysis worker (pid {self._proc.pid})")
+
+    def _stop_worker(self):
+        if self._proc is not None:
+            self._proc.terminate()
+            self._proc.join()
+        if self._conn is not None:
+            self._conn.close()
+        self._proc = None
+        self._conn = None
 
+    def _do_analysis(self, high_priority=False):
         if self._current.analysis and self._current.analysis.get(self.PROFILE_KEY):
             return self._current.analysis
 
+        # Discard any aborts that arrived while we weren't analyzing
+        while self._abort_recv.poll():
+            self._abort_recv.recv()
+
+        if self._proc is None or not self._proc.is_alive():
+            self._stop_worker()
+            self._start_worker()
+
+        path = self._current.absolute_path
+        self._logger.info(f"Requesting profile analysis of {path}")
+        self._conn.send(path)
+
+        # Block until either the worker replies or we're told to abort
+        if self._abort_recv in wait([self._conn, self._abort_recv]):
+            reenqueue = self._abort_recv.recv()
+            # The worker may be partway through the file; it's simplest to
+            # kill it and start fresh on the next analysis.
+            self._stop_worker()
+            raise AnalysisAborted(reenqueue=reenqueue)
+
         try:
-            command = [
-                sys.executable,
-                "-m",
-                "continuousprint.scripts.extract_profile",
-            ]
-            command.append(self._current.absolute_path)
-            self._logger.info("Invoking analysis command: {}".format(" ".join(command)))
-            self._aborted = False
-            p = sarge.run(
-                command, close_fds=CLOSE_FDS, async_=True, stdout=sarge.Capture()
-            )
-
-            while len(p.commands) == 0:
-                time.sleep(0.01)
-            p.commands[0].process_ready.wait()
-
-            if not p.commands[0].process:
-                raise RuntimeError(
-                    "Error while trying to run command {}".format(" ".join(command))
-                )
-
-            try:
-                while p.returncode is None:
-                    if self._aborted:
-                        p.commands[0].terminate()
-                        raise AnalysisAborted(reenqueue=self._reenqueue)
-                    p.commands[0].poll()
-            finally:
-                p.close()
-
-            output = p.stdout.text
-            self._logger.info(f"Got output: {output!r}")
-
-            result = {}
-            result[self.PROFILE_KEY] = output.strip()
-
-            if self._current.analysis and isinstance(self._current.analysis, dict):
-                return dict_merge(result, self._current.analysis)
-            else:
-                return result
-        finally:
-            self._gcode = None
+            ok, output = self._conn.recv()
+        except EOFError:
+            self._stop_worker()
+            raise RuntimeError(f"Profile analysis worker exited while analyzing {path}")
+        if not ok:
+            raise RuntimeError(f"Profile analysis of {path} failed: {output}")
+        self._logger.info(f"Got output: {output!r}")
+        result = _to_result(output)
+
+        if self._current.analysis and isinstance(self._current.analysis, dict):
+            return dict_merge(result, self._current.analysis)
+        else:
+            return result
 
     def _do_abort(self, reenqueue=True):
-        self._aborted = True
-        self._reenqueue = reenqueue
+        self._abort_send.send(reenqueue)
+
+
+def _to_result(extracted):
+    # Converts extract_profile.extract() output into the format stored in file
+    # metadata under CPQProfileAnalysisQueue.META_KEY
+    return {
+        CPQProfileAnalysisQueue.PROFILE_KEY: extracted["profile"].strip(),
+        CPQProfileAnalysisQueue.SLICER_KEY: extracted["slicer"],
+        CPQProfileAnalysisQueue.METADATA_KEY: extracted["metadata"],
+    }
+
+
+GCODE_EXTENSIONS = ("gcode", "gco", "g")
+
+
+def scan_files(basedir, exclude=()):
+    """Yields (path, mtime, size) for all gcode files under `basedir`, where
+    `path` is relative to `basedir` as in OctoPrint's file manager. Hidden
+    files and the `exclude` folders are skipped."""
+    stack = [""]
+    while len(stack) > 0:
+        rel = stack.pop()
+        try:
+            it = os.scandir(os.path.join(basedir, rel))
+        except OSError:
+            continue
+        with it:
+            for e in it:
+                if e.name.startswith("."):
+                    continue
+                path = f"{rel}/{e.name}" if rel != "" else e.name
+                try:
+                    if e.is_dir(follow_symlinks=False):
+                        if path not in exclude:
+                            stack.append(path)
+                    elif e.name.split(".")[-1].lower() in GCODE_EXTENSIONS:
+                        st = e.stat()
+                        yield (path, st.st_mtime, st.st_size)
+                except OSError:
+                    continue
+
+
+def analyze_files(
+    items,
+    workers,
+    on_result,
+    logger,
+    paused=lambda: False,
+    ctx=None,
+    report_interval=30.0,
+    pause_interval=5.0,
+):
+    """Analyzes (path, absolute_path) items in a pool of `workers` processes,
+    calling on_result(path, result) as each finishes (result is None on error).
+
+    Only a few items are in flight at once so that new work stops being
+    handed out while `paused()` returns True, e.g. while printing.
+    """
+    from .scripts.extract_profile import extract
+
+    ctx = ctx if ctx is not None else multiprocessing.get_context("spawn")
+    total = len(items)
+    items = iter(items)
+    pending = dict()
+    exhausted = False
+    done = 0
+    last_report = time.monotonic()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as ex:
+        while True:
+            while not exhausted and len(pending) < 2 * workers and not paused():
+                nxt = next(items, None)
+                if nxt is None:
+                    exhausted = True
+                    break
+                pending[ex.submit(extract, nxt[1])] = nxt[0]
+
+            if len(pending) == 0:
+                if exhausted:
+                    break
+                time.sleep(pause_interval)
+                continue
+
+            finished, _ = wait_futures(pending.keys(), return_when=FIRST_COMPLETED)
+            for fut in finished:
+                path = pending.pop(fut)
+                done += 1
+                try:
+                    result = _to_result(fut.result())
+                except Exception as e:
+                    logger.warning(f"Analysis of {path} failed: {e}")
+                    result = None
+                on_result(path, result)
+
+            if time.monotonic() - last_report > report_interval:
+                logger.info(f"CPQ analysis backlog: {done}/{total} files processed")
+                last_report = time.monotonic()
+    logger.info(f"CPQ analysis backlog complete: {done}/{total} files processed")
@@ -0,0 +1,134 @@
+import unittest
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from unittest.mock import MagicMock, patch
+from octoprint.filemanager.analysis import AnalysisAborted
+from .analysis import CPQProfileAnalysisQueue, scan_files, analyze_files
+
+# logging.basicConfig(level=logging.DEBUG)
+
+WANT = dict(
+    profile="Prusa Mini",
+    slicer="KiriMotoProcessor",
+    metadata=dict(
+        estimatedPrintTime=None,
+        filamentLengths=[],
+        layerHeight=None,
+        nozzleDiameters=[],
+    ),
+)
+
+
+def hang(conn):
+    conn.recv()
+    time.sleep(60)
+
+
+def crash(conn):
+    conn.recv()
+    os._exit(1)
+
+
+class TestProfileAnalysisQueue(unittest.TestCase):
+    def setUp(self):
+        # Fork is much faster than spawn, and safe enough for tests
+        self.q = CPQProfileAnalysisQueue(
+            MagicMock(), ctx=multiprocessing.get_context("fork")
+        )
+        self.addCleanup(self.q._stop_worker)
+        tf = tempfile.NamedTemporaryFile(suffix=".gcode", mode="w", delete=False)
+        tf.write("; Generated by Kiri:Moto\n; Target: Mini Prusa\nG0 X1 Y1\n")
+        tf.close()
+        self.path = tf.name
+        self.addCleanup(os.unlink, self.path)
+
+    def analyze(self, analysis=None):
+        self.q._current = MagicMock(absolute_path=self.path, analysis=analysis)
+        return self.q._do_analysis()
+
+    def test_existing_analysis_skipped(self):
+        a = {CPQProfileAnalysisQueue.PROFILE_KEY: "foo"}
+        self.assertEqual(self.analyze(analysis=a), a)
+        self.assertEqual(self.q._proc, None)
+
+    def test_analysis_reuses_worker(self):
+        self.assertEqual(self.analyze(), WANT)
+        pid = self.q._proc.pid
+        self.assertEqual(self.analyze(), WANT)
+        self.assertEqual(self.q._proc.pid, pid)
+
+    def test_stale_abort_ignored(self):
+        self.q._do_abort()
+        self.assertEqual(self.analyze(), WANT)
+
+    def test_abort(self):
+        for reenqueue in (True, False):
+            with self.subTest(reenqueue=reenqueue):
+                with patch("continuousprint.scripts.extract_profile.serve", hang):
+                    threading.Timer(0.1, self.q._do_abort, args=(reenqueue,)).start()
+                    with self.assertRaises(AnalysisAborted) as cm:
+                        self.analyze()
+                self.assertEqual(cm.exception.reenqueue, reenqueue)
+                self.assertEqual(self.q._proc, None)
+
+    def test_worker_death_restarts(self):
+        with patch("continuousprint.scripts.extract_profile.serve", crash):
+            with self.assertRaises(RuntimeError):
+                self.analyze()
+        self.assertEqual(self.analyze(), WANT)
+
+
+class TestBacklog(unittest.TestCase):
+    def setUp(self):
+        td = tempfile.TemporaryDirectory()
+        self.addCleanup(td.cleanup)
+        self.d = td.name
+        for f in ["a.gcode", "b/c.GCO", "b/d.stl", ".e.gcode", "tmp/f.gcode"]:
+            os.makedirs(os.path.dirname(os.path.join(self.d, f)), exist_ok=True)
+            with open(os.path.join(self.d, f), "w") as fh:
+                fh.write("; Generated by Kiri:Moto\n; Target: Mini Prusa\nG0 X1\n")
+
+    def test_scan_files(self):
+        got = dict((p, sz) for p, _, sz in scan_files(self.d, exclude=("tmp",)))
+        self.assertEqual(got, {"a.gcode": 52, "b/c.GCO": 52})
+
+    def test_scan_missing_dir(self):
+        self.assertEqual(list(scan_files(os.path.join(self.d, "nope"))), [])
+
+    def test_analyze_files(self):
+        results = dict()
+        items = [(p, os.path.join(self.d, p)) for p in ("a.gcode", "b/c.GCO", "x")]
+        analyze_files(
+            items,
+            2,
+            lambda p, r: results.__setitem__(p, r),
+            logging.getLogger(),
+            ctx=multiprocessing.get_context("fork"),
+        )
+        self.assertEqual(
+            results,
+            {
+                "a.gcode": WANT,
+                "b/c.GCO": WANT,
+                "x": None,  # Missing file
+            },
+        )
+
+    def test_analyze_files_paused(self):
+        # Nothing is handed out while paused
+        paused = MagicMock(side_effect=[True, True, False, False, False])
+        on_result = MagicMock()
+        analyze_files(
+            [("a.gcode", os.path.join(self.d, "a.gcode"))],
+            1,
+            on_result,
+            logging.getLogger(),
+            paused=paused,
+            ctx=multiprocessing.get_context("fork"),
+            pause_interval=0,
+        )
+        on_result.assert_called_once_with("a.gcode", WANT)
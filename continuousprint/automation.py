@@ -1,9 +1,10 @@
 from io import StringIO
 import re
-from asteval import Interpreter
 
 
 def getInterpreter(symbols):
+    from asteval import Interpreter
+
     out = StringIO()
     err = StringIO()
     interp = Interpreter(writer=out, err_writer=err)
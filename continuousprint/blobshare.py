@@ -0,0 +1,218 @@
+import hashlib
+import os
+import re
+import shutil
+import threading
+import uuid
+from pathlib import Path
+from urllib.parse import quote
+
+import requests
+from peerprint.filesharing import Fileshare
+
+# Subdirectory of the fileshare directory holding content-addressed set files,
+# stored as blobs/<sha256>/<name> so printed files keep their original names.
+BLOB_DIR = "blobs"
+
+# Hashes and names come from peers and become path components, so anything
+# that could escape BLOB_DIR is rejected.
+SHA256_RE = re.compile("[0-9a-f]{64}")
+
+
+def is_sha256(s) -> bool:
+    return isinstance(s, str) and SHA256_RE.fullmatch(s) is not None
+
+
+def is_blob_name(name) -> bool:
+    return (
+        isinstance(name, str)
+        and name == Path(name).name
+        and name not in ("", ".", "..")
+    )
+
+
+def blob_key(sha):
+    # Name of a blob as tracked by FileshareCache
+    return f"{BLOB_DIR}/{sha}"
+
+
+def split_blob_path(relpath):
+    """Returns (sha, name) if `relpath` (relative to the fileshare directory)
+    names a blob file, otherwise None."""
+    parts = relpath.split("/")
+    if (
+        len(parts) == 3
+        and parts[0] == BLOB_DIR
+        and is_sha256(parts[1])
+        and is_blob_name(parts[2])
+    ):
+        return (parts[1], parts[2])
+    return None
+
+
+class BlobFileshare(Fileshare):
+    """Fileshare which publishes each set file of a LAN job separately, keyed
+    by its content hash, instead of packing the job into a .gjob.
+
+    Manifests reference files by hash, so editing a job's metadata publishes
+    only the manifest, and peers only download files they don't already
+    have. Blobs are served by the same HTTP server as .gjob files; jobs
+    posted by peers without blob support are still fetched via fetch().
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, addr, basedir, logger, http=requests):
+        super().__init__(addr, basedir, logger)
+        self._http = http
+        self._lock = threading.Lock()
+        self._hashes = dict()  # path -> (size, mtime_ns, sha256)
+
+    def blob_path(self, sha, name) -> Path:
+        if not is_sha256(sha):
+            raise ValueError(f"{sha} is not a blob hash")
+        if not is_blob_name(name):
+            raise ValueError(f"{name} is not a blob file name")
+        return Path(self.basedir) / BLOB_DIR / sha / name
+
+    def _hash(self, path) -> str:
+        p = Path(path)
+        if p.parent.parent == Path(self.basedir) / BLOB_DIR:
+            return p.parent.name  # Already a blob, e.g. when re-posting an edit
+        st = p.stat()
+        with self._lock:
+            cached = self._hashes.get(str(p))
+        if cached is not None and cached[:2] == (st.st_size, st.st_mtime_ns):
+            return cached[2]
+        h = hashlib.sha256()
+        with open(p, "rb") as f:
+            for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b""):
+                h.update(chunk)
+        with self._lock:
+            self._hashes[str(p)] = (st.st_size, st.st_mtime_ns, h.hexdigest())
+        return h.hexdigest()
+
+    def _part_path(self, dest):
+        # Unique per call, as the same blob may be fetched concurrently (e.g.
+        # by the prefetcher and a print that's starting)
+        return dest.with_name(f"{dest.name}.{uuid.uuid4().hex}.part")
+
+    def _open_part(self, tmp):
+        # A failed fetch of the same blob may remove the (empty) blob
+        # directory between our mkdir and open, so retry once
+        for retry in (True, False):
+            tmp.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                return open(tmp, "wb")
+            except FileNotFoundError:
+                if not retry:
+                    raise
+
+    def _place(self, dest, src, link):
+        # Atomically places a copy of `src` at `dest`. Blobs are never
+        # modified, so they may be hard linked rather than copied.
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self._part_path(dest)
+        try:
+            if link:
+                try:
+                    os.link(src, tmp)
+                except OSError:
+                    shutil.copyfile(src, tmp)
+            else:
+                shutil.copyfile(src, tmp)
+            os.replace(tmp, dest)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+    def _local_copy(self, sha):
+        # Returns the path of a blob with content `sha` under any name, or None
+        d = Path(self.basedir) / BLOB_DIR / sha
+        if not d.is_dir():
+            return None
+        for p in d.iterdir():
+            if p.is_file() and not p.name.endswith(".part"):
+                return p
+        return None
+
+    def post_blob(self, path, name) -> str:
+        """Stores the file at `path` as a blob named `name`, returning its
+        content hash. Files already stored aren't copied again."""
+        if not is_blob_name(name):
+            raise ValueError(f"{name} is not a blob file name")
+        sha = self._hash(path)
+        dest = self.blob_path(sha, name)
+        if not dest.exists():
+            src = self._local_copy(sha)
+            if src is not None:
+                self._place(dest, src, link=True)
+            else:
+                self._place(dest, path, link=False)
+            self._logger.info(f"Posted {name} as blob {sha}")
+        return sha
+
+    def post_blobs(self, manifest: dict, filepaths: dict) -> list:
+        """Publishes the set files of `manifest` as blobs; the counterpart of
+        post() for content-addressed jobs. Like post(), it mutates the
+        manifest: set paths become short names with a "blob" hash, and
+        local state fields are stripped. Returns the hashes of the blobs."""
+        hashes = []
+        for s in manifest["sets"]:
+            name = s["path"].split("/")[-1]
+            s["blob"] = self.post_blob(filepaths[s["path"]], name)
+            s["path"] = name
+            s.pop("sd", None)
+            hashes.append(s["blob"])
+        for k in ("acquired", "id", "queue", "hash"):
+            manifest.pop(k, None)
+        return hashes
+
+    def fetch_blob(self, peer, sha, name, consume=None, room=None) -> Path:
+        """Returns the local path of blob `sha` named `name`, downloading it
+        from `peer` if we don't already have it.
+
+        `consume(nbytes)` is called for each chunk downloaded (e.g. to rate
+        limit), and if `room(nbytes)` returns False the download is skipped
+        and None is returned. Raises ValueError if `sha` or `name` isn't
+        valid, as they're supplied by peers.
+        """
+        dest = self.blob_path(sha, name)
+        if dest.exists():
+            return dest
+        src = self._local_copy(sha)
+        if src is not None:
+            self._place(dest, src, link=True)
+            return dest
+
+        url = f"http://{peer}/{BLOB_DIR}/{sha}/{quote(name)}"
+        self._logger.debug(f"HTTP GET {url} -> {dest}")
+        tmp = self._part_path(dest)
+        h = hashlib.sha256()
+        try:
+            with self._http.get(url, stream=True) as r:
+                r.raise_for_status()
+                if room is not None and not room(
+                    int(r.headers.get("Content-Length", 0))
+                ):
+                    return None
+                with self._open_part(tmp) as f:
+                    for chunk in r.iter_content(chunk_size=self.CHUNK_SIZE):
+                        if consume is not None:
+                            consume(len(chunk))
+                        h.update(chunk)
+                        f.write(chunk)
+            if h.hexdigest() != sha:
+                raise ValueError(
+                    f"Blob {sha} from {peer} has mismatched hash {h.hexdigest()}"
+                )
+            os.replace(tmp, dest)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+            if not dest.exists():
+                try:
+                    dest.parent.rmdir()
+                except OSError:
+                    pass  # Not empty, or already removed
+        return dest
@@ -0,0 +1,165 @@
+import unittest
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+from unittest.mock import MagicMock
+from .blobshare import BlobFileshare, blob_key, split_blob_path
+from .prefetcher_test import FakeResponse
+
+# logging.basicConfig(level=logging.DEBUG)
+
+
+def sha(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class TestBlobPaths(unittest.TestCase):
+    def test_blob_key(self):
+        self.assertEqual(blob_key("abc"), "blobs/abc")
+
+    def test_split_blob_path(self):
+        h = sha(b"")
+        self.assertEqual(split_blob_path(f"blobs/{h}/a.gcode"), (h, "a.gcode"))
+        self.assertEqual(split_blob_path("abc"), None)
+        self.assertEqual(split_blob_path("abc/a.gcode"), None)
+
+    def test_split_blob_path_rejects_traversal(self):
+        h = sha(b"")
+        for p in (
+            "blobs/abc/a.gcode",
+            f"blobs/{h.upper()}/a.gcode",
+            "blobs/../a.gcode",
+            f"blobs/{h}/..",
+            f"blobs/{h}/",
+        ):
+            self.assertEqual(split_blob_path(p), None, msg=p)
+
+
+class TestBlobFileshare(unittest.TestCase):
+    def setUp(self):
+        td = tempfile.TemporaryDirectory()
+        self.addCleanup(td.cleanup)
+        self.d = Path(td.name)
+        self.http = MagicMock()
+        self.fs = BlobFileshare(
+            "localhost:0", str(self.d / "fs"), logging.getLogger(), http=self.http
+        )
+        self.src = self.d / "a.gcode"
+        self.src.write_bytes(b"G1 X1")
+
+    def test_post_blobs(self):
+        m = dict(
+            name="job",
+            id="j1",
+            acquired=False,
+            queue="q",
+            hash="old",
+            sets=[dict(path="dir/a.gcode", sd=False, count=1)],
+        )
+        self.assertEqual(
+            self.fs.post_blobs(m, {"dir/a.gcode": str(self.src)}), [sha(b"G1 X1")]
+        )
+        self.assertEqual(
+            m,
+            dict(
+                name="job",
+                sets=[dict(path="a.gcode", count=1, blob=sha(b"G1 X1"))],
+            ),
+        )
+        self.assertEqual(
+            self.fs.blob_path(sha(b"G1 X1"), "a.gcode").read_bytes(), b"G1 X1"
+        )
+
+    def test_post_blob_hash_cached(self):
+        self.fs.post_blob(self.src, "a.gcode")
+        x = sha(b"x")
+        self.fs._hashes[str(self.src)] = self.fs._hashes[str(self.src)][:2] + (x,)
+        self.assertEqual(self.fs.post_blob(self.src, "a.gcode"), x)
+
+        self.src.write_bytes(b"G1 X2")  # Changed files are hashed again
+        self.assertEqual(self.fs.post_blob(self.src, "a.gcode"), sha(b"G1 X2"))
+
+    def test_post_existing_blob_not_rehashed(self):
+        h = self.fs.post_blob(self.src, "a.gcode")
+        p = self.fs.blob_path(h, "a.gcode")
+        self.assertEqual(self.fs.post_blob(p, "a.gcode"), h)
+        self.assertEqual(self.fs._hashes.get(str(p)), None)
+
+    def test_fetch_blob_already_present(self):
+        h = self.fs.post_blob(self.src, "a.gcode")
+        self.assertEqual(
+            self.fs.fetch_blob("peer:1", h, "a.gcode"),
+            self.fs.blob_path(h, "a.gcode"),
+        )
+        self.http.get.assert_not_called()
+
+    def test_fetch_blob_same_content_other_name(self):
+        h = self.fs.post_blob(self.src, "a.gcode")
+        p = self.fs.fetch_blob("peer:1", h, "b.gcode")
+        self.assertEqual(p.read_bytes(), b"G1 X1")
+        self.http.get.assert_not_called()
+
+    def test_fetch_blob(self):
+        data = b"G1 X3"
+        self.http.get.return_value = FakeResponse(data)
+        consume = MagicMock()
+        p = self.fs.fetch_blob("peer:1", sha(data), "my part.gcode", consume=consume)
+        self.http.get.assert_called_with(
+            f"http://peer:1/blobs/{sha(data)}/my%20part.gcode", stream=True
+        )
+        self.assertEqual(p.read_bytes(), data)
+        consume.assert_called_with(len(data))
+
+    def test_fetch_blob_concurrently(self):
+        # e.g. a print resolving a set while the prefetcher fetches it
+        data = b"G1 X3" * 10
+        self.fs.CHUNK_SIZE = 5
+        self.http.get.side_effect = lambda url, stream: FakeResponse(data)
+        results = []
+
+        def consume(n):
+            if not results:
+                results.append(self.fs.fetch_blob("peer:1", sha(data), "a.gcode"))
+
+        p = self.fs.fetch_blob("peer:1", sha(data), "a.gcode", consume=consume)
+        self.assertEqual(results, [p])
+        self.assertEqual(p.read_bytes(), data)
+        self.assertEqual([f.name for f in p.parent.iterdir()], ["a.gcode"])
+
+    def test_fetch_blob_bad_hash(self):
+        self.http.get.return_value = FakeResponse(b"corrupt")
+        with self.assertRaises(ValueError):
+            self.fs.fetch_blob("peer:1", sha(b"G1 X3"), "a.gcode")
+        self.assertFalse((self.d / "fs/blobs" / sha(b"G1 X3")).exists())
+
+    def test_fetch_blob_rejects_bad_paths(self):
+        h = sha(b"G1 X3")
+        for (bad_sha, name) in (
+            ("../../etc", "a.gcode"),
+            (h + "\n", "a.gcode"),
+            (h, "../a.gcode"),
+            (h, "sub/a.gcode"),
+            (h, ".."),
+            (h, ""),
+        ):
+            with self.assertRaises(ValueError, msg=(bad_sha, name)):
+                self.fs.fetch_blob("peer:1", bad_sha, name)
+        self.http.get.assert_not_called()
+        self.assertFalse((self.d / "fs/blobs").exists())
+
+    def test_post_blob_rejects_bad_names(self):
+        for name in ("../a.gcode", "sub/a.gcode", "..", ""):
+            with self.assertRaises(ValueError, msg=name):
+                self.fs.post_blob(self.src, name)
+        self.assertFalse((self.d / "fs/blobs").exists())
+
+    def test_fetch_blob_no_room(self):
+        self.http.get.return_value = FakeResponse(b"G1 X3")
+        self.assertEqual(
+            self.fs.fetch_blob(
+                "peer:1", sha(b"G1 X3"), "a.gcode", room=lambda n: False
+            ),
+            None,
+        )
+        self.assertFalse((self.d / "fs/blobs" / sha(b"G1 X3")).exists())
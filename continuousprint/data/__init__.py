@@ -1,20 +1,73 @@
-import yaml
+import hashlib
+import json
 import os
 from enum import Enum
 
-# Import YAML data
 base = os.path.dirname(__file__)
-with open(os.path.join(base, "printer_profiles.yaml"), "r") as f:
-    PRINTER_PROFILES = dict(
-        (d["name"], d) for d in yaml.safe_load(f.read())["PrinterProfile"]
+
+# YAML data, as (file, top level key). These are exposed as module attributes
+# (e.g. PRINTER_PROFILES) but only parsed on first access, as this module is
+# imported while OctoPrint is starting up.
+DATA_FILES = dict(
+    PRINTER_PROFILES=("printer_profiles.yaml", "PrinterProfile"),
+    GCODE_SCRIPTS=("gcode_scripts.yaml", "GScript"),
+    PREPROCESSORS=("preprocessors.yaml", "Preprocessors"),
+)
+
+# Parsing YAML is slow on e.g. a Raspberry Pi, so parsed data is cached as JSON
+# along with the hash of the YAML it came from. This is in the user's cache
+# directory, as the installed package may not be writable.
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "continuousprint",
+)
+
+
+def load_yaml_cached(path, cache_dir=CACHE_DIR):
+    """Returns the parsed contents of the YAML file at `path`, using a JSON
+    cache if it was created from the same file contents. The cache is
+    (re)written if stale; failure to do so is ignored."""
+    with open(path, "rb") as f:
+        src = f.read()
+    digest = hashlib.sha1(src).hexdigest()
+    cache_path = os.path.join(
+        cache_dir, os.path.splitext(os.path.basename(path))[0] + ".json"
     )
-with open(os.path.join(base, "gcode_scripts.yaml"), "r") as f:
-    GCODE_SCRIPTS = dict((d["name"], d) for d in yaml.safe_load(f.read())["GScript"])
+    try:
+        with open(cache_path, "r") as f:
+            cached = json.load(f)
+        if cached.get("sha1") == digest:
+            return cached["data"]
+    except (OSError, ValueError, AttributeError, KeyError, TypeError):
+        pass  # Missing, truncated or foreign cache file
+
+    import yaml
+
+    data = yaml.safe_load(src)
+    try:
+        dumped = json.dumps(dict(sha1=digest, data=data))
+        # Only cache data that JSON represents faithfully (e.g. no dates or
+        # non-string keys)
+        if json.loads(dumped)["data"] == data:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                f.write(dumped)
+            os.replace(tmp, cache_path)
+    except (OSError, TypeError, ValueError):
+        pass
+    return data
 
-with open(os.path.join(base, "preprocessors.yaml"), "r") as f:
-    PREPROCESSORS = dict(
-        (d["name"], d) for d in yaml.safe_load(f.read())["Preprocessors"]
+
+def __getattr__(name):
+    if name not in DATA_FILES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    (fname, key) = DATA_FILES[name]
+    value = dict(
+        (d["name"], d) for d in load_yaml_cached(os.path.join(base, fname))[key]
     )
+    globals()[name] = value
+    return value
 
 
 # This is used for running the preprocessor simulator in the settings page.
@@ -146,6 +199,7 @@ class Keys(Enum):
     BED_COOLDOWN_THRESHOLD = ("bed_cooldown_threshold", 30)
     BED_COOLDOWN_TIMEOUT = ("bed_cooldown_timeout", 60)
     MATERIAL_SELECTION = ("cp_material_selection_enabled", False)
+    QUEUE_STRATEGY = ("cp_queue_strategy", "IN_ORDER")
     NETWORK_NAME = ("cp_network_name", "Generic")
     AUTOMATION_TIMELAPSE_ACTION = (
         "cp_automation_timelapse_action",
@@ -156,6 +210,10 @@ class Keys(Enum):
         "do_nothing",
     )  # One of "do_nothing", "add_draft", "add_printable"
     INFER_PROFILE = ("cp_infer_profile", True)
+    ANALYSIS_WORKERS = ("cp_analysis_workers", 2)
+    FILESHARE_BUDGET_MB = ("cp_fileshare_budget_mb", 1024)
+    PREFETCH_JOBS = ("cp_lan_prefetch_jobs", 2)
+    PREFETCH_RATE_KBPS = ("cp_lan_prefetch_rate_kbps", 0)
     AUTO_RECONNECT = ("cp_auto_reconnect", False)
     SKIP_GCODE_COMMANDS = ("cp_skip_gcode_commands", "")
     SLICER = ("cp_slicer", "")
@@ -163,10 +221,13 @@ class Keys(Enum):
 
     def __init__(self, setting, default):
         self.setting = setting
-        if setting.endswith("_script") and not default.startswith(";"):
-            self.default = GCODE_SCRIPTS[default]["gcode"]
-        else:
-            self.default = default
+        self._default = default
+
+    @property
+    def default(self):
+        if self.setting.endswith("_script") and not self._default.startswith(";"):
+            return __getattr__("GCODE_SCRIPTS")[self._default]["gcode"]
+        return self._default
 
 
 PRINT_FILE_DIR = "ContinuousPrint"
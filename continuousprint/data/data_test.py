@@ -1,9 +1,86 @@
 import unittest
+import os
+import tempfile
+import hashlib
+import json
 from io import StringIO
-from ..data import GCODE_SCRIPTS, PRINTER_PROFILES, PREPROCESSORS
+from unittest.mock import patch
+from .. import data
+from ..data import (
+    GCODE_SCRIPTS,
+    PRINTER_PROFILES,
+    PREPROCESSORS,
+    CACHE_DIR,
+    load_yaml_cached,
+)
 from asteval import Interpreter
 
 
+class TestLoadYAMLCached(unittest.TestCase):
+    def setUp(self):
+        td = tempfile.TemporaryDirectory()
+        self.addCleanup(td.cleanup)
+        self.cache_dir = os.path.join(td.name, "cache")
+        self.path = os.path.join(td.name, "test.yaml")
+        self.write("A:\n- name: a\n")
+
+    def write(self, content):
+        with open(self.path, "w") as f:
+            f.write(content)
+
+    def test_cache_written_and_used(self):
+        want = {"A": [{"name": "a"}]}
+        self.assertEqual(load_yaml_cached(self.path, self.cache_dir), want)
+        self.assertTrue(os.path.exists(os.path.join(self.cache_dir, "test.json")))
+        with patch("yaml.safe_load") as sl:
+            self.assertEqual(load_yaml_cached(self.path, self.cache_dir), want)
+            sl.assert_not_called()
+
+    def test_stale_cache(self):
+        load_yaml_cached(self.path, self.cache_dir)
+        self.write("A:\n- name: b\n")
+        self.assertEqual(
+            load_yaml_cached(self.path, self.cache_dir), {"A": [{"name": "b"}]}
+        )
+
+    def test_corrupt_cache(self):
+        os.makedirs(self.cache_dir)
+        with open(os.path.join(self.cache_dir, "test.json"), "w") as f:
+            f.write("not json")
+        self.assertEqual(
+            load_yaml_cached(self.path, self.cache_dir), {"A": [{"name": "a"}]}
+        )
+
+    def test_foreign_cache(self):
+        os.makedirs(self.cache_dir)
+        with open(self.path, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        for content in (dict(sha1=digest), [digest]):
+            with self.subTest(content=content):
+                with open(os.path.join(self.cache_dir, "test.json"), "w") as f:
+                    json.dump(content, f)
+                self.assertEqual(
+                    load_yaml_cached(self.path, self.cache_dir),
+                    {"A": [{"name": "a"}]},
+                )
+
+    def test_default_cache_outside_package(self):
+        self.assertFalse(
+            os.path.abspath(CACHE_DIR).startswith(os.path.abspath(data.base))
+        )
+
+    def test_unwritable_cache(self):
+        with open(os.path.join(os.path.dirname(self.path), "file"), "w") as f:
+            f.write("")
+        cache_dir = os.path.join(os.path.dirname(self.path), "file", "cache")
+        self.assertEqual(load_yaml_cached(self.path, cache_dir), {"A": [{"name": "a"}]})
+
+    def test_non_json_data_not_cached(self):
+        self.write("A:\n  1: a\n")  # Integer keys don't survive JSON
+        self.assertEqual(load_yaml_cached(self.path, self.cache_dir), {"A": {1: "a"}})
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, "test.json")))
+
+
 class TestGCODEScripts(unittest.TestCase):
     def test_has_all_fields(self):
         for k, v in GCODE_SCRIPTS.items():
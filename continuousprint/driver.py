@@ -2,6 +2,7 @@ import time
 from multiprocessing import Lock
 from enum import Enum, auto
 from .data import CustomEvents
+from .storage.keymask import material_mask, materials_satisfied
 
 
 class Action(Enum):
@@ -87,6 +88,7 @@ class Driver:
         self._update_ui = False
         self._cur_path = None
         self._cur_materials = []
+        self._cur_material_mask = 0
         self._bed_temp = 0
         self._timelapse_start_ts = None
 
@@ -120,8 +122,9 @@ class Driver:
 
             if path is not None:
                 self._cur_path = path
-            if len(materials) > 0:
+            if len(materials) > 0 and materials != self._cur_materials:
                 self._cur_materials = materials
+                self._cur_material_mask = material_mask(materials)
             if bed_temp is not None:
                 self._bed_temp = bed_temp
             self._timelapse_start_ts = timelapse_start_ts
@@ -224,13 +227,17 @@ class Driver:
             return mk
 
     def _materials_match(self, item):
+        return materials_satisfied(item.material_mask(), self._cur_material_mask)
+
+    def _material_mismatch(self, item):
+        # Slow path, only used to explain a failed _materials_match() to the user
         for i, im in enumerate(item.materials()):
-            if im is None:  # No constraint
+            if im is None or im == "":  # No constraint
                 continue
             cur = self._cur_materials[i] if i < len(self._cur_materials) else None
             if im != cur:
-                return False
-        return True
+                return (i, im, cur)
+        return None
 
     def _verify_active_status_msg(self, rep):
         if rep["misconfig"]:
@@ -262,6 +269,7 @@ class Driver:
         if self._materials_match(item):
             return self._enter_start_print(a, p)
         else:
+            (i, im, cur) = self._material_mismatch(item)
             self._set_status(
                 f"Need {self._fmt_material_key(im)} in tool {i}, but {self._fmt_material_key(cur)} is loaded",
                 StatusType.NEEDS_ACTION,
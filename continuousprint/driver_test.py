@@ -4,12 +4,19 @@ import time
 from unittest.mock import MagicMock, ANY
 from .driver import Driver, Action as DA, Printer as DP
 from .data import CustomEvents
+from .storage.keymask import material_mask
 import logging
 import traceback
 
 # logging.basicConfig(level=logging.DEBUG)
 
 
+def mockSet(path):
+    s = MagicMock(path=path)
+    s.material_mask.return_value = 0  # No material constraints
+    return s
+
+
 class TestFromInactive(unittest.TestCase):
     def setUp(self):
         self.d = Driver(
@@ -22,7 +29,7 @@ class TestFromInactive(unittest.TestCase):
         self.d.action(DA.DEACTIVATE, DP.IDLE)
         self.d._runner.run_script_for_event.reset_mock()
         self.d._runner.start_print.return_value = True
-        item = MagicMock(path="asdf")  # return same item by default every time
+        item = mockSet("asdf")  # return same item by default every time
         item.resolve.return_value = "asdf"
         self.d.q.get_set_or_acquire.return_value = item
         self.d.q.get_set.return_value = item
@@ -145,7 +152,7 @@ class TestFromInactive(unittest.TestCase):
     def test_completed_stl(self):
         # In the case of STLs, the item path is not the print path
         # But we should still complete the currently active print item
-        item = MagicMock(path="asdf.stl")
+        item = mockSet("asdf.stl")
         item.resolve.return_value = "asdf.stl.gcode"
         self.d.q.get_set_or_acquire.return_value = item
         self.d.q.get_set.return_value = item
@@ -273,7 +280,7 @@ class TestFromStartPrint(unittest.TestCase):
         )
         self.d._runner.verify_active.return_value = (True, None)
         self.d.set_retry_on_pause(True)
-        item = MagicMock(path="asdf")  # return same item by default every time
+        item = mockSet("asdf")  # return same item by default every time
         item.resolve.return_value = "asdf"
         self.d.q.get_set_or_acquire.return_value = item
         self.d.q.get_set.return_value = item
@@ -292,7 +299,7 @@ class TestFromStartPrint(unittest.TestCase):
         )  # -> success
         self.d.action(DA.TICK, DP.IDLE)  # -> start_clearing
         self.d.q.end_run.assert_called_once()
-        item2 = MagicMock(path="basdf")
+        item2 = mockSet("basdf")
         item2.resolve.return_value = "basdf"
         self.d.q.get_set_or_acquire.return_value = (
             item2  # manually move the supervisor forward in the queue
@@ -318,7 +325,7 @@ class TestFromStartPrint(unittest.TestCase):
         self.d.action(DA.TICK, DP.IDLE, timelapse_start_ts=now)  # -> still success
         self.assertEqual(self.d.state.__name__, self.d._state_success.__name__)
 
-        item2 = MagicMock(path="basdf")
+        item2 = mockSet("basdf")
         self.d.q.get_set_or_acquire.return_value = (
             item2  # manually move the supervisor forward in the queue
         )
@@ -418,6 +425,7 @@ class MaterialTest(unittest.TestCase):
     def _setItemMaterials(self, m):
         item = MagicMock()
         item.materials.return_value = m
+        item.material_mask.return_value = material_mask(m)
         self.d.q.get_set.return_value = item
         self.d.q.get_set_or_acquire.return_value = item
 
@@ -476,6 +484,7 @@ class TestMaterialConstraints(MaterialTest):
     def _setItemMaterials(self, m):
         item = MagicMock()
         item.materials.return_value = m
+        item.material_mask.return_value = material_mask(m)
         self.d.q.get_set.return_value = item
         self.d.q.get_set_or_acquire.return_value = item
 
@@ -542,6 +551,22 @@ class TestMaterialConstraints(MaterialTest):
             self.d.state.__name__, self.d._state_awaiting_material.__name__
         )
 
+    def test_any_material_tool_ok(self):
+        # The UI stores "any material" as an empty string
+        self._setItemMaterials(["", "tool2mat"])
+        self.d.action(DA.ACTIVATE, DP.IDLE, materials=[None, "tool2mat"])
+        self.d._runner.start_print.assert_called()
+        self.assertEqual(self.d.state.__name__, self.d._state_printing.__name__)
+
+    def test_awaiting_material_status(self):
+        self._setItemMaterials(["tool0mat"])
+        self.d.action(DA.ACTIVATE, DP.IDLE, materials=["tool0bad"])
+        self.d.action(DA.TICK, DP.IDLE, materials=["tool0bad"])
+        self.assertEqual(
+            self.d.state.__name__, self.d._state_awaiting_material.__name__
+        )
+        self.assertRegex(self.d.status, "Need tool0mat in tool 0")
+
     def test_recovery(self):
         self._setItemMaterials(["tool0mat"])
         self.d.action(DA.ACTIVATE, DP.IDLE, materials=["tool0bad"])
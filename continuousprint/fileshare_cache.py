@@ -0,0 +1,164 @@
+import os
+import shutil
+import threading
+import traceback
+from collections import OrderedDict
+from pathlib import Path
+from .blobshare import BLOB_DIR, blob_key
+
+# Entries in the fileshare directory that belong to a job hash: the packed
+# .gjob, its unpacked directory, and bare gcode files.
+SUFFIXES = ("", ".gjob", ".gcode", ".gco")
+
+
+def _disk_usage(path):
+    if not path.is_dir():
+        return path.stat().st_size
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return total
+
+
+class FileshareCache:
+    """Keeps the LAN fileshare directory under a disk budget by evicting the
+    least recently used job hashes in a background thread. Content-addressed
+    set files (see BlobFileshare) are tracked individually, as "blobs/<sha>".
+
+    The directory is scanned once at startup to build an index of hash ->
+    size; after that the index is kept up to date by touch() whenever a job is
+    fetched or posted, so the directory is never listed again.
+
+    `pinned` is a callable returning the set of hashes that must never be
+    evicted (e.g. jobs hosted or acquired by this printer). It's only called
+    when eviction is actually needed.
+    """
+
+    def __init__(self, basedir, budget_bytes, pinned, logger):
+        self.basedir = Path(basedir)
+        self.budget_bytes = budget_bytes
+        self._pinned = pinned
+        self._logger = logger
+        self._index = OrderedDict()  # hash -> bytes, least recently used first
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        self._build_index()
+        while True:
+            try:
+                self.evict()
+            except Exception:
+                self._logger.error(traceback.format_exc())
+            self._wake.wait()
+            self._wake.clear()
+
+    def _scan(self):
+        # Yields (name, DirEntry) of everything in the fileshare directory
+        with os.scandir(self.basedir) as it:
+            for e in it:
+                if e.name != BLOB_DIR:
+                    yield (e.name, e)
+        blobdir = self.basedir / BLOB_DIR
+        if blobdir.is_dir():
+            with os.scandir(blobdir) as it:
+                for e in it:
+                    yield (blob_key(e.name), e)
+
+    def _build_index(self):
+        if not self.basedir.exists():
+            return
+        found = dict()
+        for (entry, e) in self._scan():
+            name, suffix = os.path.splitext(entry)
+            if suffix not in SUFFIXES:
+                continue
+            try:
+                size = _disk_usage(Path(e.path))
+                mtime = e.stat(follow_symlinks=False).st_mtime
+            except OSError:
+                continue
+            prev = found.get(name, (0, 0))
+            found[name] = (prev[0] + size, max(prev[1], mtime))
+
+        with self._lock:
+            # Files touched while we were scanning are more recent than
+            # anything found on disk, so keep them at the end.
+            touched = list(self._index.items())
+            self._index.clear()
+            for name, (size, _) in sorted(found.items(), key=lambda kv: kv[1][1]):
+                self._index[name] = size
+            for name, size in touched:
+                self._index.pop(name, None)
+                self._index[name] = size
+        self._logger.info(
+            f"Fileshare cache: {len(self._index)} hashes, {self.total_bytes()}B of {self.budget_bytes}B budget"
+        )
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(self._index.values())
+
+    def touch(self, hash_):
+        """Marks `hash_` as most recently used and updates its size, waking the
+        eviction thread if the cache is now over budget."""
+        size = 0
+        for suffix in SUFFIXES:
+            try:
+                size += _disk_usage(self.basedir / f"{hash_}{suffix}")
+            except OSError:
+                pass
+        with self._lock:
+            self._index.pop(hash_, None)
+            self._index[hash_] = size
+            over = sum(self._index.values()) > self.budget_bytes
+        if over:
+            self._wake.set()
+
+    def check(self):
+        """Requests a (non-blocking) eviction pass, e.g. after jobs were
+        released and may no longer be pinned."""
+        self._wake.set()
+
+    def evict(self):
+        """Deletes least recently used, unpinned hashes until the cache is
+        within budget. Returns the number of bytes freed."""
+        if self.total_bytes() <= self.budget_bytes:
+            return 0
+        pinned = self._pinned()
+
+        victims = []
+        with self._lock:
+            total = sum(self._index.values())
+            for name, size in list(self._index.items()):
+                if total <= self.budget_bytes:
+                    break
+                if name in pinned:
+                    continue
+                victims.append((name, size))
+                total -= size
+                del self._index[name]
+
+        freed = 0
+        for name, size in victims:
+            for suffix in SUFFIXES:
+                p = self.basedir / f"{name}{suffix}"
+                if p.is_dir():
+                    shutil.rmtree(p, ignore_errors=True)
+                elif p.exists():
+                    p.unlink()
+            freed += size
+        if len(victims) > 0:
+            self._logger.info(
+                f"Fileshare cache evicted {len(victims)} hashes, freeing {freed}B ({total}B remaining of {self.budget_bytes}B budget)"
+            )
+        return freed
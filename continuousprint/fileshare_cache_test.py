@@ -0,0 +1,89 @@
+import unittest
+import logging
+import os
+import tempfile
+from pathlib import Path
+from unittest.mock import MagicMock
+from .fileshare_cache import FileshareCache
+
+# logging.basicConfig(level=logging.DEBUG)
+
+
+class TestFileshareCache(unittest.TestCase):
+    def setUp(self):
+        td = tempfile.TemporaryDirectory()
+        self.addCleanup(td.cleanup)
+        self.d = Path(td.name)
+        self.pinned = MagicMock(return_value=set())
+        self.c = FileshareCache(self.d, 250, self.pinned, logging.getLogger())
+
+    def write(self, name, size, mtime=None):
+        p = self.d / name
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_bytes(b"x" * size)
+        if mtime is not None:
+            os.utime(p, (mtime, mtime))
+
+    def test_build_index(self):
+        self.write("a.gjob", 100, mtime=2)
+        self.write("a/a.gcode", 50, mtime=2)
+        self.write("b.gjob", 10, mtime=1)
+        self.write("c.txt", 1000)  # Not a job file
+        self.c._build_index()
+        self.assertEqual(list(self.c._index.items()), [("b", 10), ("a", 150)])
+
+    def test_build_index_blobs(self):
+        self.write("blobs/s1/a.gcode", 100, mtime=2)
+        self.write("blobs/s1/b.gcode", 100, mtime=2)  # Same content, other name
+        self.write("blobs/s2/c.gcode", 10, mtime=1)
+        for (name, mtime) in (("s1", 2), ("s2", 1)):
+            os.utime(self.d / "blobs" / name, (mtime, mtime))
+        self.c._build_index()
+        self.assertEqual(
+            list(self.c._index.items()), [("blobs/s2", 10), ("blobs/s1", 200)]
+        )
+
+    def test_evicts_blobs(self):
+        self.write("blobs/s1/a.gcode", 200)
+        self.c.touch("blobs/s1")
+        self.write("blobs/s2/b.gcode", 100)
+        self.c.touch("blobs/s2")
+        self.assertEqual(self.c.evict(), 200)
+        self.assertFalse((self.d / "blobs/s1").exists())
+        self.assertTrue((self.d / "blobs/s2/b.gcode").exists())
+
+    def test_under_budget_no_eviction(self):
+        self.write("a.gjob", 100)
+        self.c.touch("a")
+        self.assertEqual(self.c.evict(), 0)
+        self.pinned.assert_not_called()
+        self.assertTrue((self.d / "a.gjob").exists())
+
+    def test_evicts_least_recently_used(self):
+        for n in ("a", "b", "c"):
+            self.write(f"{n}.gjob", 100)
+            self.write(f"{n}/{n}.gcode", 10)
+            self.c.touch(n)
+        self.c.touch("a")  # Now b is least recently used
+        self.assertTrue(self.c._wake.is_set())
+
+        self.assertEqual(self.c.evict(), 110)
+        self.assertFalse((self.d / "b.gjob").exists())
+        self.assertFalse((self.d / "b").exists())
+        for n in ("a", "c"):
+            self.assertTrue((self.d / f"{n}.gjob").exists())
+        self.assertEqual(self.c.total_bytes(), 220)
+
+    def test_pinned_never_evicted(self):
+        for n in ("a", "b", "c"):
+            self.write(f"{n}.gjob", 100)
+            self.c.touch(n)
+        self.pinned.return_value = set(["a", "b"])
+        self.assertEqual(self.c.evict(), 100)
+        self.assertFalse((self.d / "c.gjob").exists())
+
+        # Still over budget, but everything left is pinned
+        self.write("a.gjob", 200)
+        self.c.touch("a")
+        self.assertEqual(self.c.evict(), 0)
+        self.assertEqual(self.c.total_bytes(), 300)
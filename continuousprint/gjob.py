@@ -0,0 +1,69 @@
+import json
+import os
+import shutil
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Files are extracted from .gjob archives one member at a time, located via
+# the zip's central directory, so sets that are never printed are never
+# written to disk.
+
+MANIFEST = "manifest.json"
+CHUNK_SIZE = 64 * 1024
+
+
+def _member(zf, name):
+    # Set paths in a packed manifest are bare file names; refuse anything
+    # that could be written outside the destination directory.
+    if name != Path(name).name or name in ("", ".", "..", MANIFEST):
+        raise ValueError(f"{name} is not a set file name")
+    return zf.getinfo(name)
+
+
+def read_manifest(gjob_path) -> dict:
+    with zipfile.ZipFile(gjob_path) as zf:
+        with zf.open(MANIFEST) as f:
+            return json.load(f)
+
+
+def extract_member(gjob_path, name, dest_dir, zf=None) -> Path:
+    """Extracts the single file `name` from the .gjob at `gjob_path` into
+    `dest_dir`, returning its path. Files already extracted are reused."""
+    dest = Path(dest_dir) / name
+    if dest.exists():
+        return dest
+    if zf is None:
+        with zipfile.ZipFile(gjob_path) as zf:
+            return extract_member(gjob_path, name, dest_dir, zf)
+
+    info = _member(zf, name)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(dest.name + ".part")
+    try:
+        with zf.open(info) as src, open(tmp, "wb") as f:
+            shutil.copyfileobj(src, f, CHUNK_SIZE)
+        # Only complete files appear under their real name
+        os.replace(tmp, dest)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return dest
+
+
+def extract_members(gjob_path, names, dest_dir, workers=1) -> list:
+    """Extracts each of `names` from the .gjob into `dest_dir`, returning
+    their paths in order. With `workers` > 1, files are decompressed in
+    parallel, each worker reading the archive through its own handle."""
+    names = list(names)
+    unique = list(dict.fromkeys(names))  # Sets may share a file
+    if workers <= 1 or len(unique) <= 1:
+        with zipfile.ZipFile(gjob_path) as zf:
+            paths = [extract_member(gjob_path, n, dest_dir, zf) for n in unique]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(unique))) as pool:
+            paths = list(
+                pool.map(lambda n: extract_member(gjob_path, n, dest_dir), unique)
+            )
+    extracted = dict(zip(unique, paths))
+    return [extracted[n] for n in names]
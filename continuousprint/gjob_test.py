@@ -0,0 +1,58 @@
+import json
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+from unittest.mock import patch
+from .gjob import extract_member, extract_members, read_manifest
+
+
+class TestGjob(unittest.TestCase):
+    def setUp(self):
+        td = tempfile.TemporaryDirectory()
+        self.addCleanup(td.cleanup)
+        self.d = Path(td.name)
+        self.gjob = self.d / "job.gjob"
+        self.manifest = dict(name="job", sets=[dict(path="a.gcode")])
+        with zipfile.ZipFile(self.gjob, "w") as zf:
+            zf.writestr("manifest.json", json.dumps(self.manifest))
+            for n in ("a", "b", "c"):
+                zf.writestr(f"{n}.gcode", n * 10)
+        self.out = self.d / "out"
+
+    def test_read_manifest(self):
+        self.assertEqual(read_manifest(self.gjob), self.manifest)
+
+    def test_extract_member(self):
+        p = extract_member(self.gjob, "a.gcode", self.out)
+        self.assertEqual(p, self.out / "a.gcode")
+        self.assertEqual(p.read_text(), "a" * 10)
+        self.assertEqual([f.name for f in self.out.iterdir()], ["a.gcode"])
+
+    def test_extract_member_reuses_existing(self):
+        self.out.mkdir()
+        (self.out / "a.gcode").write_text("existing")
+        with patch.object(zipfile, "ZipFile") as zf:
+            p = extract_member(self.gjob, "a.gcode", self.out)
+            zf.assert_not_called()
+        self.assertEqual(p.read_text(), "existing")
+
+    def test_extract_member_rejects_bad_names(self):
+        for name in ("../a.gcode", "sub/a.gcode", "manifest.json", ""):
+            with self.assertRaises(ValueError, msg=name):
+                extract_member(self.gjob, name, self.out)
+
+    def test_extract_member_missing(self):
+        with self.assertRaises(KeyError):
+            extract_member(self.gjob, "d.gcode", self.out)
+        self.assertEqual(list(self.out.glob("*")), [])
+
+    def test_extract_members(self):
+        names = ["b.gcode", "a.gcode", "b.gcode"]
+        for workers in (1, 2):
+            with self.subTest(workers=workers):
+                out = self.out / str(workers)
+                paths = extract_members(self.gjob, names, out, workers=workers)
+                self.assertEqual(paths, [out / n for n in names])
+                self.assertFalse((out / "c.gcode").exists())
+                self.assertEqual((out / "b.gcode").read_text(), "b" * 10)
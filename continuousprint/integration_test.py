@@ -305,7 +305,9 @@ class TestLANQueue(IntegrationTest):
         self.lq.lan.q.jobs = TestReplDict(lambda a, b: None)
         self.lq.lan.q.peers = {}
         self.lq.lan.q.peers[self.lq.addr] = (time.time(), dict(fs_addr="mock"))
-        self.lq._fileshare.fetch.return_value = "from_fileshare.gcode"
+        self.lq._fileshare.fetch_blob.side_effect = (
+            lambda peer, sha, name: f"from_fileshare/{name}"
+        )
 
     def test_completes_job_in_order(self):
         self.lq.lan.q.setJob(
@@ -315,8 +317,8 @@ class TestLANQueue(IntegrationTest):
                 name="j1",
                 created=0,
                 sets=[
-                    dict(path="a.gcode", count=1, remaining=1),
-                    dict(path="b.gcode", count=1, remaining=1),
+                    dict(path="a.gcode", count=1, remaining=1, blob="sha"),
+                    dict(path="b.gcode", count=1, remaining=1, blob="sha"),
                 ],
                 count=1,
                 remaining=1,
@@ -334,7 +336,7 @@ class TestLANQueue(IntegrationTest):
                     id=f"{name}_id",
                     name=name,
                     created=0,
-                    sets=[dict(path=f"{name}.gcode", count=1, remaining=1)],
+                    sets=[dict(path=f"{name}.gcode", count=1, remaining=1, blob="sha")],
                     count=1,
                     remaining=1,
                 ),
@@ -358,7 +360,9 @@ class TestMultiDriverLANQueue(unittest.TestCase):
             with db.bind_ctx(MODELS):
                 populate_queues()
             fsm = MagicMock(host="fsaddr", port=0)
-            fsm.fetch.return_value = "from_fileshare.gcode"
+            fsm.fetch_blob.side_effect = (
+                lambda peer, sha, name: f"from_fileshare/{name}"
+            )
             profile = dict(name="profile")
             lq = LANQueue(
                 "LAN",
@@ -413,7 +417,7 @@ class TestMultiDriverLANQueue(unittest.TestCase):
                     name=name,
                     created=0,
                     sets=[
-                        dict(path=f"{name}.gcode", count=1, remaining=1),
+                        dict(path=f"{name}.gcode", count=1, remaining=1, blob="sha"),
                     ],
                     count=1,
                     remaining=1,
@@ -469,6 +473,7 @@ class TestMultiDriverLANQueue(unittest.TestCase):
                             count=1,
                             remaining=1,
                             profiles=["profile"],
+                            blob="sha",
                         ),
                     ],
                     count=1,
@@ -479,20 +484,21 @@ class TestMultiDriverLANQueue(unittest.TestCase):
             )
             lq1._path_on_disk = lambda p, sd: str(Path(tdir) / p)
             lq1.import_job_from_view(j, j.id)
-            lq2._fileshare.post.assert_not_called()
+            lq2._fileshare.post_blobs.assert_not_called()
 
             # LQ2 edits the job
-            lq2._fileshare.fetch.return_value = str(Path(tdir) / "unpack/")
-            (Path(tdir) / "unpack").mkdir()
-            lq2dest = Path(tdir) / "unpack/test.gcode"
+            lq2dest = Path(tdir) / "blobs/sha/test.gcode"
+            lq2dest.parent.mkdir(parents=True)
             lq2dest.touch()
+            lq2._fileshare.fetch_blob.side_effect = None
+            lq2._fileshare.fetch_blob.return_value = str(lq2dest)
             lq2.edit_job("jobhash", dict(draft=True))
 
-            lq2._fileshare.post.assert_called_once()
+            lq2._fileshare.post_blobs.assert_called_once()
             # Job posts with lan 2 address, from pov of lq1
             self.assertEqual(list(lq1.lan.q.jobs.values())[0][0], lq2.addr)
             # Uses resolved file path
-            c = lq2._fileshare.post.call_args[0]
+            c = lq2._fileshare.post_blobs.call_args[0]
             self.assertEqual(c[1], {str(lq2dest): str(lq2dest)})
 
 
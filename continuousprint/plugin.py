@@ -2,11 +2,13 @@
 
 import os
 import socket
+import hashlib
 import json
+import dataclasses
 import time
-import shutil
 import traceback
 import random
+import threading
 from pathlib import Path
 from octoprint.events import Events
 from octoprint.filemanager import NoSuchStorage
@@ -14,14 +16,13 @@ from octoprint.filemanager.analysis import AnalysisQueue, QueueEntry
 from octoprint.filemanager.destinations import FileDestinations
 import octoprint.timelapse
 
-from peerprint.filesharing import Fileshare
-from .analysis import CPQProfileAnalysisQueue
+from .analysis import CPQProfileAnalysisQueue, scan_files, analyze_files
 from .thirdparty.spoolmanager import SpoolManagerIntegration
 from .driver import Driver, Action as DA, Printer as DP, shouldBlockCoreEvents
 from .queues.lan import LANQueue
 from .queues.multi import MultiQueue
 from .queues.local import LocalQueue
-from .queues.abstract import Strategy
+from .queues.abstract import Strategy, QueueData
 from .storage.database import (
     migrateFromSettings,
     migrateScriptsFromSettings,
@@ -30,14 +31,17 @@ from .storage.database import (
     ARCHIVE_QUEUE,
 )
 from .data import (
-    PRINTER_PROFILES,
-    GCODE_SCRIPTS,
     Keys,
     TEMP_FILE_DIR,
     PRINT_FILE_DIR,
 )
 from .api import ContinuousPrintAPI
 from .script_runner import ScriptRunner
+from .skip_matcher import SkipMatcher
+from .blobshare import BlobFileshare
+from .fileshare_cache import FileshareCache
+from .prefetcher import JobPrefetcher
+from .upload_batcher import UploadBatcher
 
 
 class CPQPlugin(ContinuousPrintAPI):
@@ -78,25 +82,53 @@ class CPQPlugin(ContinuousPrintAPI):
         self._data_folder = data_folder
         self._logger = logger
         self._identifier = identifier
-        self._set_add_awaiting_metadata = dict()
+        self._uploads = UploadBatcher(
+            self._upload_needs_analysis,
+            self._add_sets,
+            self._logger,
+            on_error=self._exception_msg,
+        )
         self._reconnect_attempts = 0
         self._next_reconnect = 0
         self._fire_event = fire_event
         self._exceptions = []
         self._timelapse_start_ts = None
+        self._local_ip = None
+        self._local_ip_lock = threading.Lock()
+        self._connecting = dict()  # LAN queue name -> addr, while connecting
+        # LAN queue name -> (generation, configured addr) of its latest
+        # connection; a connection that's no longer the latest is discarded.
+        self._lan_conns = dict()
+        self._lan_generation = 0
+        self._connect_lock = threading.Lock()
+        self._prefetcher = None
 
     def start(self):
         self._setup_thirdparty_plugin_integration()
         self._init_db()
         self._init_fileshare()
         self._init_queues()
+        self._fileshare_cache.start()
+        if self._prefetcher is not None:
+            self._prefetcher.start()
         self._init_driver()
         self._init_analysis_queue()
 
     def _on_queue_update(self, q, now=time.time()):
         self._sync_state()
+        if self._prefetcher is not None:
+            self._prefetcher.check()
+
+    def _prefetch_targets(self):
+        n = int(self._get_key(Keys.PREFETCH_JOBS, Keys.PREFETCH_JOBS.default))
+        targets = []
+        for q in self.q.queues.values():
+            if hasattr(q, "prefetch_targets"):
+                targets += q.prefetch_targets(n)
+        return targets
 
     def _on_settings_updated(self):
+        self.q.strategy = self._queue_strategy()
         self.d.set_retry_on_pause(
             self._get_key(Keys.RESTART_ON_PAUSE, False),
             int(self._get_key(Keys.RESTART_MAX_RETRIES, 0)),
@@ -107,6 +139,14 @@ class CPQPlugin(ContinuousPrintAPI):
             int(self._get_key(Keys.BED_COOLDOWN_THRESHOLD, 0)),
             int(self._get_key(Keys.BED_COOLDOWN_TIMEOUT, 0)),
         )
+        if self._prefetcher is not None:
+            self._prefetcher.set_max_rate(self._prefetch_rate())
+
+    def _prefetch_rate(self):
+        return (
+            int(self._get_key(Keys.PREFETCH_RATE_KBPS, Keys.PREFETCH_RATE_KBPS.default))
+            * 1024
+        )
 
     def _set_key(self, k, v):
         return self._settings.set([k.setting], v)
@@ -135,6 +175,16 @@ class CPQPlugin(ContinuousPrintAPI):
         return True
 
     def get_local_addr(self):
+        # Resolving the local IP may take several seconds, so it's cached and
+        # later calls only need to find an open port.
+        with self._local_ip_lock:
+            if self._local_ip is not None:
+                return f"{self._local_ip}:{self._open_port(self._local_ip)}"
+            addr = self._resolve_local_addr()
+            self._local_ip = addr.split(":")[0]
+            return addr
+
+    def _resolve_local_addr(self):
         # https://stackoverflow.com/a/2838309
         # Note that this is vulnerable to race conditions in that
         # the port is open when it's assigned, but could be reassigned
@@ -169,6 +219,9 @@ class CPQPlugin(ContinuousPrintAPI):
         except socket.gaierror:
             local_ip = socket.gethostbyname(hostname)
 
+        return f"{local_ip}:{self._open_port(local_ip)}"
+
+    def _open_port(self, local_ip):
         # Find open port: https://stackoverflow.com/a/2838309
         # This will raise OSError if it cannot bind to that address either
         try:
@@ -178,56 +231,74 @@ class CPQPlugin(ContinuousPrintAPI):
             port = s.getsockname()[1]
         finally:
             s.close()
-        return f"{local_ip}:{port}"
+        return port
 
     def _add_set(self, path, sd, draft=True, profiles=[]):
-        # We may need to delay adding a file if it hasn't yet finished analysis
+        # Uploads are batched, and may be delayed until analysis completes
+        # (see UploadBatcher)
+        self._uploads.add(path, sd, draft, profiles)
+
+    def _upload_needs_analysis(self, path, sd):
+        if not self._get_key(Keys.INFER_PROFILE):
+            return False
         meta = self._file_manager.get_additional_metadata(
             FileDestinations.SDCARD if sd else FileDestinations.LOCAL,
             path,
             CPQProfileAnalysisQueue.META_KEY,
         )
-        prof = (
-            meta.get(CPQProfileAnalysisQueue.PROFILE_KEY) if meta is not None else None
+        return meta is None or meta.get(CPQProfileAnalysisQueue.PROFILE_KEY) is None
+
+    def _add_sets(self, items):
+        self._get_queue(DEFAULT_QUEUE).add_sets(
+            [
+                (
+                    "",
+                    self._preprocess_set(
+                        dict(
+                            path=i["path"],
+                            sd="true" if i["sd"] else "false",
+                            count=1,
+                            jobDraft=i["draft"],
+                            profiles=i["profiles"],
+                        )
+                    ),
+                )
+                for i in items
+            ]
         )
-        if (
-            self._get_key(Keys.INFER_PROFILE)
-            and prof is None
-            and self._set_add_awaiting_metadata.get(path) is None
-        ):
-            self._logger.debug(f"Delaying add_set() of {path} until analysis completes")
-            self._set_add_awaiting_metadata[path] = (path, sd, draft, profiles)
-        else:
-            self._get_queue(DEFAULT_QUEUE).add_set(
-                "",
-                self._preprocess_set(
-                    dict(
-                        path=path,
-                        sd="true" if sd else "false",
-                        count=1,
-                        jobDraft=draft,
-                        profiles=profiles,
-                    )
-                ),
-            )
-            self._sync_state()
+        self._logger.info(f"Added {len(items)} uploaded file(s) to the queue")
+        self._sync_state()
 
     def _preprocess_set(self, data):
-        if not self._get_key(Keys.INFER_PROFILE) or len(data.get("profiles", [])) > 0:
-            return data
-
+        # "sd" is a form value, i.e. the string "true" or "false"
+        sd = data.get("sd") in (True, "true")
         try:
             meta = self._file_manager.get_additional_metadata(
-                FileDestinations.SDCARD if data.get("sd") else FileDestinations.LOCAL,
+                FileDestinations.SDCARD if sd else FileDestinations.LOCAL,
                 data["path"],
                 CPQProfileAnalysisQueue.META_KEY,
             )
         except NoSuchStorage:
             return data
+        if meta is None:
+            return data
 
-        prof = (
-            meta.get(CPQProfileAnalysisQueue.PROFILE_KEY) if meta is not None else None
-        )
+        # Fill any print time / filament estimates not already provided (e.g.
+        # by OctoPrint's own, slower, gcode analysis) with those from CPQ analysis
+        extracted = meta.get(CPQProfileAnalysisQueue.METADATA_KEY)
+        if extracted is not None:
+            try:
+                setmeta = json.loads(data.get("metadata") or "{}")
+            except json.JSONDecodeError:
+                setmeta = dict()
+            for k, v in extracted.items():
+                if setmeta.get(k) in (None, []):
+                    setmeta[k] = v
+            data["metadata"] = json.dumps(setmeta)
+
+        if not self._get_key(Keys.INFER_PROFILE) or len(data.get("profiles", [])) > 0:
+            return data
+        prof = meta.get(CPQProfileAnalysisQueue.PROFILE_KEY)
         self._logger.debug(f"Path {data['path']} profile: {prof}")
         if prof is not None and prof != "":
             data["profiles"] = [prof]
@@ -307,17 +378,14 @@ class CPQPlugin(ContinuousPrintAPI):
                     "Skipping patch of comm._get_next_from_job; no commands configured to skip"
                 )
                 return
-            self._ignore_cmd_list = set(
-                [
-                    c.split(";", 1)[0].strip().upper()
-                    for c in self._get_key(Keys.SKIP_GCODE_COMMANDS).split("\n")
-                ]
+            self._skip_matcher = SkipMatcher(
+                self._get_key(Keys.SKIP_GCODE_COMMANDS).split("\n")
             )
 
             self._jobCommReaderOrig = self._printer._comm._get_next_from_job
             self._printer._comm._get_next_from_job = self.gatedCommJobReader
             self._logger.info(
-                f"Patched comm._get_next_from_job; will ignore commands: {self._ignore_cmd_list}"
+                f"Patched comm._get_next_from_job; will ignore commands: {set(self._skip_matcher.cmds)}"
             )
         except Exception:
             self._logger.error(traceback.format_exc())
@@ -325,35 +393,58 @@ class CPQPlugin(ContinuousPrintAPI):
     def gatedCommJobReader(self, *args, **kwargs):
         # As this patches core OctoPrint functionality, we wrap *everything*
         # in try/catch to ensure it continues to execute if CPQ raises an exception.
+        # This runs for every line of every print, so keep it lean.
         result = self._jobCommReaderOrig(*args, **kwargs)
         try:
             # Only mess with gcode commands of printed files, not events
             if self.d.state != self.d._state_printing:
                 return result
 
-            while result[0] is not None:
-                if type(result[0]) != str:
-                    return result
-                line = result[0].strip()
-                if line == "":
-                    return result
-
-                # Normalize command, without uppercase
-                cmd = result[0].split(";", 1)[0].strip().upper()
-                if cmd not in self._ignore_cmd_list:
-                    break
-                self._logger.warning(f"Skip GCODE: {result}")
+            m = self._skip_matcher
+            # Non-str lines are e.g. SendQueueMarker objects, or None at EOF.
+            # Checking the first char here saves a call for most lines.
+            while (
+                type(result[0]) is str
+                and result[0][:1] in m.firsts
+                and m.match(result[0]) is not None
+            ):
+                self._logger.debug(f"Skip GCODE: {result}")
                 result = self._jobCommReaderOrig(*args, **kwargs)
         except Exception:
             self._logger.error(traceback.format_exc())
         finally:
             return result
 
-    def _init_fileshare(self, fs_cls=Fileshare):
-        # Note: fileshare_dir referenced when cleaning up old files
+    def _log_skipped_gcode(self):
+        m = getattr(self, "_skip_matcher", None)
+        if m is None or len(m.counts) == 0:
+            return
+        self._logger.info(f"Skipped GCODE commands during print: {dict(m.counts)}")
+        m.counts.clear()
+
+    def _init_fileshare(
+        self,
+        fs_cls=BlobFileshare,
+        cache_cls=FileshareCache,
+        prefetch_cls=JobPrefetcher,
+    ):
         self.fileshare_dir = self._path_on_disk(
             f"{PRINT_FILE_DIR}/fileshare/", sd=False
         )
+        # Started once queues are initialized, as it relies on them to know
+        # which files must be kept
+        self._fileshare_cache = cache_cls(
+            self.fileshare_dir,
+            int(
+                self._get_key(
+                    Keys.FILESHARE_BUDGET_MB, Keys.FILESHARE_BUDGET_MB.default
+                )
+            )
+            * 1024
+            * 1024,
+            self._pinned_fileshare_hashes,
+            self._logger,
+        )
         try:
             fileshare_addr = self.get_local_addr()
         except OSError:
@@ -374,11 +465,19 @@ class CPQPlugin(ContinuousPrintAPI):
             self._exception_msg(
                 "Failed to bind Fileshare HTTP server; hosting LAN jobs will fail, but fetching jobs may still work."
             )
+        self._prefetcher = prefetch_cls(
+            self._fileshare,
+            self._fileshare_cache,
+            self._prefetch_targets,
+            self._logger,
+            max_rate=self._prefetch_rate(),
+        )
 
     def _init_db(self):
         init_db(
             queues_db=Path(self._data_folder) / "queue.sqlite3",
             automation_db=Path(self._data_folder) / "automation.sqlite3",
+            analysis_db=Path(self._data_folder) / "analysis.sqlite3",
             logger=self._logger,
         )
 
@@ -415,33 +514,33 @@ class CPQPlugin(ContinuousPrintAPI):
 
         self._queries.clearOldState()
 
-    def _init_queues(self, lancls=LANQueue, localcls=LocalQueue):
+    def _init_queues(self, lancls=LANQueue, localcls=LocalQueue, async_connect=True):
+        from .data import PRINTER_PROFILES
+
         self._printer_profile = PRINTER_PROFILES.get(
             self._get_key(Keys.PRINTER_PROFILE)
         )
         self.q = MultiQueue(
-            self._queries, Strategy.IN_ORDER, self._sync_history
-        )  # TODO set strategy for this and all other queue creations
-        for q in self._queries.getQueues():
+            self._queries,
+            self._queue_strategy(),
+            self._sync_history,
+            profile=self._printer_profile,
+            materials_fn=self._loaded_materials,
+        )  # TODO set strategy for all other queue creations
+        qs = self._queries.getQueues()
+        order = [q.name for q in qs]
+        for q in qs:
             if q.addr is not None:
-                try:
-                    lq = lancls(
-                        q.name,
-                        q.addr if q.addr.lower() != "auto" else self.get_local_addr(),
-                        self._logger,
-                        Strategy.IN_ORDER,
-                        self._on_queue_update,
-                        self._fileshare,
-                        self._printer_profile,
-                        self._path_on_disk,
-                    )
-                    lq.connect()
-                    self.q.add(q.name, lq)
-                except Exception:
-                    self._exception_msg(
-                        f'Unable to join network queue "{q.name}" with address {q.addr}'
-                    )
-
+                # LAN queues may take a while to connect, so they're connected
+                # in the background while local queues are usable immediately.
+                self._connect_lan_queue(
+                    q.name,
+                    q.addr,
+                    order,
+                    lancls,
+                    async_connect,
+                    strategy=self._strategy(q.strategy),
+                )
             elif q.name != ARCHIVE_QUEUE:
                 self.q.add(
                     q.name,
@@ -455,6 +554,93 @@ class CPQPlugin(ContinuousPrintAPI):
                     ),
                 )
 
+    def _queue_strategy(self):
+        # Strategy for choosing between all queues; see MultiQueue.acquire()
+        return self._strategy(
+            self._get_key(Keys.QUEUE_STRATEGY, Keys.QUEUE_STRATEGY.default)
+        )
+
+    def _strategy(self, name):
+        # Queues created by older versions have strategy "LINEAR" or "In-Order"
+        if name in ("LINEAR", "In-Order"):
+            return Strategy.IN_ORDER
+        if name not in Strategy.__members__:
+            self._logger.warning(f"Unknown queue strategy {name}; using IN_ORDER")
+            return Strategy.IN_ORDER
+        return Strategy[name]
+
+    def _loaded_materials(self):
+        if self._spool_manager is None:
+            return []
+        return self._spool_manager.get_materials()
+
+    def _connect_lan_queue(
+        self,
+        name,
+        addr,
+        order,
+        lancls=LANQueue,
+        async_=True,
+        strategy=Strategy.IN_ORDER,
+    ):
+        with self._connect_lock:
+            self._lan_generation += 1
+            gen = self._lan_generation
+            self._lan_conns[name] = (gen, addr)
+            self._connecting[name] = addr
+        args = (name, addr, order, lancls, strategy, gen)
+        if async_:
+            thread = threading.Thread(target=self._connect_lan_queue_sync, args=args)
+            thread.daemon = True
+            thread.start()
+        else:
+            self._connect_lan_queue_sync(*args)
+
+    def _is_latest_conn(self, name, gen):
+        # Caller must hold self._connect_lock
+        return self._lan_conns.get(name, (None, None))[0] == gen
+
+    def _connect_lan_queue_sync(self, name, addr, order, lancls, strategy, gen):
+        try:
+            lq = lancls(
+                name,
+                addr if addr.lower() != "auto" else self.get_local_addr(),
+                self._logger,
+                strategy,
+                self._on_queue_update,
+                self._fileshare,
+                self._printer_profile,
+                self._path_on_disk,
+                fileshare_cache=self._fileshare_cache,
+                prefetcher=self._prefetcher,
+                state_path=self._lan_state_path(name),
+            )
+            lq.connect()
+            # The queue may have been removed or re-addressed while connecting
+            with self._connect_lock:
+                latest = self._is_latest_conn(name, gen)
+                if latest:
+                    self.q.add(name, lq, order=order)
+            if not latest:
+                self._logger.info(f"Discarding superseded connection to {name}")
+                lq.destroy()
+        except Exception:
+            self._exception_msg(
+                f'Unable to join network queue "{name}" with address {addr}'
+            )
+        finally:
+            with self._connect_lock:
+                if self._is_latest_conn(name, gen):
+                    self._connecting.pop(name, None)
+        self._sync_state()
+
+    def _remove_queue(self, name):
+        # Also cancels any connection still in progress for the queue
+        with self._connect_lock:
+            self._lan_conns.pop(name, None)
+            self._connecting.pop(name, None)
+        self.q.remove(name)
+
     def _init_driver(self, srcls=ScriptRunner, dcls=Driver):
         self._runner = srcls(
             self.popup,
@@ -501,7 +687,9 @@ class CPQPlugin(ContinuousPrintAPI):
             self._msg(dict(msg=msg, type="popup"))
             self._printer.connect()  # No arguments --> all auto-detected
 
-    def _init_analysis_queue(self, cls=AnalysisQueue, async_backlog=True):
+    def _init_analysis_queue(
+        self, cls=AnalysisQueue, async_backlog=True, analyze=analyze_files
+    ):
         self._logger.debug("Creating CPQ analysis queue and checking for backlog")
         self._analysis_queue = cls(dict(gcode=CPQProfileAnalysisQueue))
         self._analysis_queue.register_finish_callback(self._on_analysis_finished)
@@ -509,11 +697,13 @@ class CPQPlugin(ContinuousPrintAPI):
         if async_backlog:
             import threading
 
-            thread = threading.Thread(target=self._enqueue_analysis_backlog)
+            thread = threading.Thread(
+                target=self._enqueue_analysis_backlog, args=(analyze,)
+            )
             thread.daemon = True
             thread.start()
         else:
-            self._enqueue_analysis_backlog()
+            self._enqueue_analysis_backlog(analyze)
 
     def _profile_from_path(self, path):
         self._logger.info(f"_profile_from_path {path}")
@@ -525,40 +715,98 @@ class CPQPlugin(ContinuousPrintAPI):
         if meta is not None:
             return meta.get(CPQProfileAnalysisQueue.PROFILE_KEY)
 
-    def _backlog_from_file_list(self, data):
-        # Recursively walks the output of FileManager.list_files() and selects
-        # files which have no CPQ analysis provided
-        # See https://docs.octoprint.org/en/master/modules/filemanager.html?highlight=get_additional_metadata#octoprint.filemanager.storage.LocalFileStorage.list_files
-        backlog = []
-        for k, v in data.items():
-            if v["type"] == "folder":
-                backlog += self._backlog_from_file_list(v["children"])
-            elif v.get(CPQProfileAnalysisQueue.META_KEY) is None and v["path"].split(
-                "."
-            )[-1] in ("gcode", "g", "gco"):
-                self._logger.debug(f"File \"{v['path']}\" needs analysis")
-                backlog.append(v["path"])
-            else:
-                self._logger.debug(f"File \"{v['path']}\" already analyzed")
-        return backlog
-
-    def _enqueue_analysis_backlog(self):
-        # This loosely follows FileManager._determine_analysis_backlog to push un-analyzed files onto our custom AnalysisQueue - see
-        # https://github.com/OctoPrint/OctoPrint/blob/f430257d7072a83692fc2392c683ed8c97ae47b6/src/octoprint/filemanager/__init__.py#L301
-        self._logger.debug("Searching files for backlogged CPQ analysis")
-        counter = 0
-        file_list = self._file_manager.list_files(destinations=FileDestinations.LOCAL)[
-            FileDestinations.LOCAL
-        ]
-        for path in self._backlog_from_file_list(file_list):
-            if self._enqueue(path):
-                counter += 1
-        if counter > 0:
-            self._logger.info(f"Enqueued {counter} files for CPQ analysis")
+    def _scan_analysis_backlog(self, basedir):
+        # Compares files on disk against the scan index persisted from prior
+        # runs, returning paths of new or changed files.
+        index = self._queries.getScanIndex()
+        seen = set()
+        changed = []
+        for path, mtime, size in scan_files(basedir, exclude=(TEMP_FILE_DIR,)):
+            seen.add(path)
+            if index.get(path) != (mtime, size, True):
+                changed.append((path, mtime, size))
+        removed = [p for p in index.keys() if p not in seen]
+        self._queries.updateScanIndex(changed, removed)
+        self._logger.info(
+            f"Scanned {len(seen)} files for CPQ analysis; {len(changed)} new or changed, {len(removed)} removed"
+        )
+        return [c[0] for c in changed]
+
+    def _enqueue_analysis_backlog(self, analyze=analyze_files):
+        # Unlike OctoPrint's FileManager._determine_analysis_backlog, we only
+        # look at files that are new or changed since the last scan, and
+        # analyze them in parallel rather than via the (serial) analysis queue.
+        basedir = self._file_manager.path_on_disk(FileDestinations.LOCAL, "")
+        todo = []
+        for path in self._scan_analysis_backlog(basedir):
+            meta = self._file_manager.get_additional_metadata(
+                FileDestinations.LOCAL, path, CPQProfileAnalysisQueue.META_KEY
+            )
+            if (
+                meta is not None
+                and meta.get(CPQProfileAnalysisQueue.PROFILE_KEY) is not None
+            ):
+                self._queries.markAnalyzed(path)
+                continue
+            h = self._content_hash(path)
+            cached = self._queries.getAnalysis(h) if h is not None else None
+            if cached is not None:
+                self._apply_analysis(path, cached)
+                self._queries.markAnalyzed(path)
+                continue
+            todo.append((path, os.path.join(basedir, path)))
+
+        if len(todo) == 0:
+            return
+        workers = max(1, int(self._get_key(Keys.ANALYSIS_WORKERS, 1)))
+        self._logger.info(
+            f"Analyzing {len(todo)} backlogged files with {workers} worker(s)"
+        )
+        analyze(
+            todo,
+            workers,
+            self._on_backlog_analyzed,
+            self._logger,
+            paused=self._printer.is_printing,
+        )
+
+    def _on_backlog_analyzed(self, path, result):
+        if result is None:
+            return  # Retried on next startup
+        self._store_analysis(path, result)
+        self._queries.markAnalyzed(path)
+
+    def _content_hash(self, path):
+        # OctoPrint already sha1-hashes files when they're added; only hash
+        # them ourselves if that's missing for some reason.
+        try:
+            meta = self._file_manager.get_metadata(FileDestinations.LOCAL, path)
+            h = meta.get("hash") if meta is not None else None
+            if h is not None:
+                return h
+            sha1 = hashlib.sha1()
+            with open(
+                self._file_manager.path_on_disk(FileDestinations.LOCAL, path), "rb"
+            ) as f:
+                for chunk in iter(lambda: f.read(65536), b""):
+                    sha1.update(chunk)
+            return sha1.hexdigest()
+        except (NoSuchStorage, OSError):
+            return None
 
     def _enqueue(self, path, high_priority=False):
         if path.startswith(TEMP_FILE_DIR):
             return False  # Exclude temp files from analysis
+
+        # Identical files (re-uploads, copies, imported/fetched jobs) only need
+        # to be analyzed once.
+        h = self._content_hash(path)
+        cached = self._queries.getAnalysis(h) if h is not None else None
+        if cached is not None:
+            self._logger.debug(f"Using cached analysis for {path} ({h})")
+            self._apply_analysis(path, cached)
+            return True
+
         queue_entry = QueueEntry(
             name=path.split("/")[-1],
             path=path,
@@ -571,48 +819,33 @@ class CPQPlugin(ContinuousPrintAPI):
         return self._analysis_queue.enqueue(queue_entry, high_priority=high_priority)
 
     def _on_analysis_finished(self, entry, result):
+        self._store_analysis(entry.path, result)
+
+    def _store_analysis(self, path, result):
+        h = self._content_hash(path)
+        if h is not None:
+            self._queries.setAnalysis(h, result)
+        self._apply_analysis(path, result)
+
+    def _apply_analysis(self, path, result):
         self._file_manager.set_additional_metadata(
             FileDestinations.LOCAL,
-            entry.path,
+            path,
             CPQProfileAnalysisQueue.META_KEY,
             result,
             overwrite=True,
         )
-        self.on_event(self.CPQ_ANALYSIS_FINISHED, dict(path=entry.path, result=result))
-
-    def _cleanup_fileshare(self):
-        if not os.path.exists(self.fileshare_dir):
-            return n
+        self.on_event(self.CPQ_ANALYSIS_FINISHED, dict(path=path, result=result))
 
-        # This cleans up all non-useful fileshare files across all network queues, so they aren't just taking up space.
-        # First we collect all non-local queue items hosted by us - these are excluded from cleanup as someone may need to fetch them.
+    def _pinned_fileshare_hashes(self):
+        # Files hosted or acquired by us are excluded from fileshare eviction,
+        # as someone may need to fetch them.
         keep_hashes = set()
         for name, q in self.q.queues.items():
             if name == ARCHIVE_QUEUE or name == DEFAULT_QUEUE:
                 continue
-            for j in q.as_dict()["jobs"]:
-                if j["peer_"] == q.addr or j["acquired_by_"] == q.addr:
-                    keep_hashes.add(j["hash"])
-
-        # Loop through all .gjob and .gcode files in base directory and delete them if they aren't referenced or acquired by us
-        n = 0
-
-        for d in os.listdir(self.fileshare_dir):
-            name, suffix = os.path.splitext(d)
-            if suffix not in ("", ".gjob", ".gcode", ".gco"):
-                self._logger.debug(
-                    f"Fileshare cleanup ignoring non-printable file: {os.path.join(self.fileshare_dir, name)}"
-                )
-                continue
-            if name not in keep_hashes:
-                p = Path(self.fileshare_dir) / d
-                if p.is_dir():
-                    # Have to use shutil instead of p.rmdir() as the directory will likely not be empty
-                    shutil.rmtree(p, ignore_errors=True)
-                else:
-                    p.unlink()
-                n += 1
-        return n
+            keep_hashes.update(q.pinned_hashes())
+        return keep_hashes
 
     def tick(self):
         # Catch/pass all exceptions to prevent errors from stopping the repeated timer.
@@ -648,23 +881,13 @@ class CPQPlugin(ContinuousPrintAPI):
 
         if event == self.CPQ_ANALYSIS_FINISHED:
             # If we auto-added a file to the queue before analysis finished,
-            # it's placed in a pending queue (see self._add_set). Now that
-            # the processing is done, we actually add the set.
-            path = payload["path"]
-            pend = self._set_add_awaiting_metadata.get(path)
-            self._logger.debug(
-                f"Handling completed analysis for {path} - pending: {pend}"
+            # it's held by self._uploads. Now that the processing is done, it
+            # can be added with the inferred profile.
+            self._logger.debug(f"Handling completed analysis for {payload['path']}")
+            self._uploads.on_analyzed(
+                payload["path"],
+                payload["result"][CPQProfileAnalysisQueue.PROFILE_KEY],
             )
-            if pend is not None:
-                (path, sd, draft, profiles) = pend
-                prof = payload["result"][CPQProfileAnalysisQueue.PROFILE_KEY]
-                if (profiles is None or profiles == []) and prof != "":
-                    profiles = [prof]
-                self._logger.debug(
-                    f"Handling pending add_set() for {path} with profiles={profiles}"
-                )
-                self._add_set(path, sd, draft, profiles)
-                del self._set_add_awaiting_metadata[path]
             return
 
         if event == Events.FILE_ADDED:
@@ -723,12 +946,15 @@ class CPQPlugin(ContinuousPrintAPI):
             self._timelapse_start_ts = time.time()
 
             self._update(DA.SUCCESS)
-            n = self._cleanup_fileshare()
-            if n > 0:
-                self._logger.info(f"Deleted {n} unreferenced fileshare files/dirs")
+            self._log_skipped_gcode()
+            # Finished jobs may no longer be pinned; evict in the background
+            self._fileshare_cache.check()
+            if self._prefetcher is not None:
+                self._prefetcher.check()
         elif event == Events.PRINT_FAILED:
             # Note that cancelled events are already handled directly with Events.PRINT_CANCELLED
             self._update(DA.FAILURE)
+            self._log_skipped_gcode()
         elif event == Events.PRINT_CANCELLED:
             if payload.get("user") is not None:
                 self._update(DA.DEACTIVATE)
@@ -741,9 +967,9 @@ class CPQPlugin(ContinuousPrintAPI):
             and payload.get("initiator") == "system"
         ):
             self._update(DA.SPAGHETTI)
-        elif event == self.EVENT_SPOOL_SELECTED:
-            self._update(DA.TICK)
-        elif event == self.EVENT_SPOOL_DESELECTED:
+        elif event in (self.EVENT_SPOOL_SELECTED, self.EVENT_SPOOL_DESELECTED):
+            if self._spool_manager is not None:
+                self._spool_manager.invalidate()
             self._update(DA.TICK)
         elif is_current_path and event == Events.PRINT_PAUSED:
             self._update(DA.TICK)
@@ -799,7 +1025,13 @@ class CPQPlugin(ContinuousPrintAPI):
         if run is not None:
             run = run.as_dict()
         netname = self._get_key(Keys.NETWORK_NAME)
-        self.q.update_peer_state(netname, p.name, run, self._printer_profile)
+        self.q.update_peer_state(
+            netname,
+            p.name,
+            run,
+            self._printer_profile,
+            active=self.d.state != self.d._state_inactive,
+        )
 
     def _state_json(self):
         # IMPORTANT: Non-additive changes to this response string must be released in a MAJOR version bump
@@ -810,6 +1042,23 @@ class CPQPlugin(ContinuousPrintAPI):
             for name, q in self.q.queues.items()
             if name != ARCHIVE_QUEUE
         ]
+        for name, addr in dict(self._connecting).items():
+            qs.append(
+                dict(
+                    dataclasses.asdict(
+                        QueueData(
+                            name=name,
+                            addr=addr,
+                            strategy=Strategy.IN_ORDER.name,
+                            jobs=[],
+                            peers=dict(),
+                            active_set=None,
+                        )
+                    ),
+                    rank=db_qs.get(name, len(db_qs)),
+                    connecting=True,
+                )
+            )
         qs.sort(key=lambda q: q["rank"])
 
         active = self.d.state != self.d._state_inactive if hasattr(self, "d") else False
@@ -835,27 +1084,49 @@ class CPQPlugin(ContinuousPrintAPI):
     def _get_queue(self, name):
         return self.q.get(name)
 
-    def _commit_queues(self, added, removed):
+    def _lan_state_path(self, name):
+        # Where the last known state of a LAN queue is kept across restarts
+        digest = hashlib.sha1(name.encode()).hexdigest()[:16]
+        return str(Path(self._data_folder) / f"lan_state_{digest}.json")
+
+    def _commit_queues(self, added, removed, lancls=LANQueue):
         for name in removed:
-            self.q.remove(name)
-        for a in added:
+            self._remove_queue(name)
             try:
-                lq = LANQueue(
-                    a["name"],
-                    a["addr"] if a["addr"].lower() != "auto" else self.get_local_addr(),
-                    self._logger,
-                    Strategy.IN_ORDER,
-                    self._on_queue_update,
-                    self._fileshare,
-                    self._printer_profile,
-                    self._path_on_disk,
-                )  # TODO specify strategy
-                lq.connect()
-                self.q.add(a["name"], lq)
-            except ValueError:
-                self._logger.error(
-                    f"Unable to join network queue (name {qdata['name']}, addr {qdata['addr']}) due to ValueError"
+                os.remove(self._lan_state_path(name))
+            except OSError:
+                pass
+        qs = self._queries.getQueues()
+        order = [q.name for q in qs]
+        added_names = set(a["name"] for a in added)
+        for q in qs:
+            lq = self.q.get(q.name)
+            if lq is not None and q.addr is not None:
+                lq.strategy = self._strategy(q.strategy)
+            conn = self._lan_conns.get(q.name)
+            if (
+                q.addr is not None
+                and q.name not in added_names
+                and conn is not None
+                and conn[1] != q.addr
+            ):
+                # Address changed; replace the queue (connected or not)
+                self._remove_queue(q.name)
+                self._connect_lan_queue(
+                    q.name,
+                    q.addr,
+                    order,
+                    lancls,
+                    strategy=self._strategy(q.strategy),
                 )
+        for a in added:
+            self._connect_lan_queue(
+                a["name"],
+                a["addr"],
+                order,
+                lancls,
+                strategy=self._strategy(a["strategy"]),
+            )
 
         # We trigger state update rather than returning it here, because this is called by the settings viewmodel
         # (not the main viewmodel that displays the queues)
@@ -8,11 +8,19 @@ from unittest.mock import MagicMock, patch, ANY, call, PropertyMock
 from octoprint.filemanager.analysis import QueueEntry
 from .driver import Driver, Action as DA
 from octoprint.events import Events
+from octoprint.filemanager.destinations import FileDestinations
+from octoprint.filemanager import NoSuchStorage
 import logging
 import tempfile
+import os
 import json
+import threading
+import time
 from .data import Keys, TEMP_FILE_DIR
 from .plugin import CPQPlugin
+from .queues.abstract import Strategy
+from .queues.multi import MultiQueue
+from .upload_batcher import UploadBatcher
 
 # logging.basicConfig(level=logging.DEBUG)
 
@@ -38,6 +46,8 @@ class MockSettings:
 
 
 def setupPlugin():
+    queries = MagicMock()
+    queries.getAnalysis.return_value = None
     return CPQPlugin(
         printer=MagicMock(),
         settings=MockSettings(),
@@ -45,8 +55,8 @@ def setupPlugin():
         slicing_manager=MagicMock(),
         plugin_manager=MagicMock(),
         fire_event=MagicMock(),
-        queries=MagicMock(),
-        data_folder=None,
+        queries=queries,
+        data_folder=tempfile.gettempdir(),
         logger=logging.getLogger(),
         identifier=None,
         basefolder=None,
@@ -126,6 +136,25 @@ class TestStartup(unittest.TestCase):
         gnfj.side_effect = [("foo 1", None, None)]
         self.assertEqual(p._printer._comm._get_next_from_job(), ("foo 1", ANY, ANY))
 
+    def testSkippedGcodeLogged(self):
+        p = setupPlugin()
+        p._logger = MagicMock()
+        p._log_skipped_gcode()  # No-op if never patched
+        p._logger.info.assert_not_called()
+
+        p.d = MagicMock(_state_printing="foo", state="foo")
+        p._set_key(Keys.SKIP_GCODE_COMMANDS, "FOO 1")
+        p.patchCommJobReader()
+        p._jobCommReaderOrig = MagicMock(
+            side_effect=[("FOO 1", None, None), ("G0 X0", None, None)]
+        )
+        p.gatedCommJobReader()
+        p._log_skipped_gcode()
+        p._logger.info.assert_called_with(
+            "Skipped GCODE commands during print: {'FOO 1': 1}"
+        )
+        self.assertEqual(len(p._skip_matcher.counts), 0)
+
     def testPatchComms(self):
         p = setupPlugin()
         sgs = p._printer._comm.sendGcodeScript
@@ -204,12 +233,57 @@ class TestStartup(unittest.TestCase):
 
         fs.assert_called_with("111.111.111.111:0", "/testpath", logging.getLogger())
 
+    def testFileshareCacheBudget(self):
+        p = setupPlugin()
+        cc = MagicMock()
+        p.get_local_addr = lambda: ("111.111.111.111:0")
+        p._file_manager.path_on_disk.return_value = "/testpath"
+        p._set_key(Keys.FILESHARE_BUDGET_MB, 3)
+
+        p._init_fileshare(fs_cls=MagicMock(), cache_cls=cc)
+
+        cc.assert_called_with(
+            "/testpath", 3 * 1024 * 1024, p._pinned_fileshare_hashes, ANY
+        )
+
+    def testPrefetcher(self):
+        p = setupPlugin()
+        pc = MagicMock()
+        p.get_local_addr = lambda: ("111.111.111.111:0")
+        p._set_key(Keys.PREFETCH_RATE_KBPS, 2)
+        p._init_fileshare(fs_cls=MagicMock(), cache_cls=MagicMock(), prefetch_cls=pc)
+        pc.assert_called_with(
+            p._fileshare,
+            p._fileshare_cache,
+            p._prefetch_targets,
+            ANY,
+            max_rate=2 * 1024,
+        )
+        self.assertEqual(p._prefetcher, pc())
+
+        p.q = MagicMock()
+        p.d = MagicMock()
+        p._set_key(Keys.PREFETCH_RATE_KBPS, 5)
+        p._on_settings_updated()
+        p._prefetcher.set_max_rate.assert_called_with(5 * 1024)
+
+    def testPrefetchTargets(self):
+        p = setupPlugin()
+        p.q = MagicMock()
+        lq = MagicMock()
+        lq.prefetch_targets.return_value = [("addr", "hash")]
+        p.q.queues = dict(local=MagicMock(spec=[]), lan=lq)
+        p._set_key(Keys.PREFETCH_JOBS, 3)
+        self.assertEqual(p._prefetch_targets(), [("addr", "hash")])
+        lq.prefetch_targets.assert_called_with(3)
+
     def testFileshareAddrFailure(self):
         p = setupPlugin()
         fs = MagicMock()
         p.get_local_addr = MagicMock(side_effect=[OSError("testing")])
         p._init_fileshare(fs_cls=fs)  # Does not raise exception
         self.assertEqual(p._fileshare, None)
+        self.assertEqual(p._prefetcher, None)
 
     def testFileshareConnectFailure(self):
         p = setupPlugin()
@@ -221,15 +295,204 @@ class TestStartup(unittest.TestCase):
 
     def testQueues(self):
         p = setupPlugin()
-        QT = namedtuple("MockQueue", ["name", "addr"])
+        QT = namedtuple("MockQueue", ["name", "addr", "strategy"])
         p._queries.getQueues.return_value = [
-            QT(name="LAN", addr="0.0.0.0:0"),
-            QT(name=DEFAULT_QUEUE, addr=None),
-            QT(name=ARCHIVE_QUEUE, addr=None),
+            QT(name="LAN", addr="0.0.0.0:0", strategy="MIN_MAKESPAN"),
+            QT(name=DEFAULT_QUEUE, addr=None, strategy="LINEAR"),
+            QT(name=ARCHIVE_QUEUE, addr=None, strategy="LINEAR"),
         ]
         p._fileshare = None
-        p._init_queues(lancls=MagicMock(), localcls=MagicMock())
+        p._fileshare_cache = None
+        p._sync_state = MagicMock()
+        lancls = MagicMock()
+        p._init_queues(lancls=lancls, localcls=MagicMock(), async_connect=False)
         self.assertEqual(len(p.q.queues), 2)  # 2 queues created, archive skipped
+        self.assertEqual(list(p.q.queues.keys()), ["LAN", DEFAULT_QUEUE])
+        self.assertEqual(lancls.call_args[0][3], Strategy.MIN_MAKESPAN)
+
+    def testQueueStrategy(self):
+        p = setupPlugin()
+        self.assertEqual(p._queue_strategy(), Strategy.IN_ORDER)
+        p._set_key(Keys.QUEUE_STRATEGY, "LEAST_MANUAL")
+        self.assertEqual(p._queue_strategy(), Strategy.LEAST_MANUAL)
+        p._set_key(Keys.QUEUE_STRATEGY, "BOGUS")
+        self.assertEqual(p._queue_strategy(), Strategy.IN_ORDER)
+        for legacy in ("LINEAR", "In-Order"):
+            self.assertEqual(p._strategy(legacy), Strategy.IN_ORDER)
+
+    def testQueuesConnectInBackground(self):
+        p = setupPlugin()
+        QT = namedtuple("MockQueue", ["name", "addr", "rank", "strategy"])
+        p._queries.getQueues.return_value = [
+            QT(name="LAN", addr="0.0.0.0:0", rank=0, strategy="In-Order"),
+            QT(name=DEFAULT_QUEUE, addr=None, rank=1, strategy="In-Order"),
+        ]
+        p._fileshare = None
+        p._fileshare_cache = None
+        p._sync_state = MagicMock()
+        connecting = threading.Event()
+        proceed = threading.Event()
+
+        def connect():
+            connecting.set()
+            proceed.wait()
+
+        lancls = MagicMock()
+        lancls().connect.side_effect = connect
+        localcls = MagicMock()
+        localcls().as_dict.return_value = dict(name=DEFAULT_QUEUE)
+        p._init_queues(lancls=lancls, localcls=localcls)
+
+        # Local queue is usable while the LAN queue is still connecting
+        connecting.wait()
+        self.assertEqual(list(p.q.queues.keys()), [DEFAULT_QUEUE])
+        got = json.loads(p._state_json())["queues"]
+        self.assertEqual(
+            [(q["name"], q.get("connecting")) for q in got],
+            [("LAN", True), (DEFAULT_QUEUE, None)],
+        )
+
+        proceed.set()
+        for _ in range(100):
+            if len(p._connecting) == 0:
+                break
+            time.sleep(0.01)
+        self.assertEqual(list(p.q.queues.keys()), ["LAN", DEFAULT_QUEUE])
+        p._sync_state.assert_called()
+
+    def _blockingLANQueues(self, p):
+        # Returns (lancls, queues created, release fn); connect() blocks until
+        # released for the first queue created
+        p.q = MultiQueue(MagicMock(), Strategy.IN_ORDER, MagicMock())
+        p._fileshare = None
+        p._fileshare_cache = None
+        p._printer_profile = None
+        p._sync_state = MagicMock()
+        connecting = threading.Event()
+        proceed = threading.Event()
+        created = []
+
+        def make(*args, **kwargs):
+            lq = MagicMock(name=f"lq{len(created)}")
+            if len(created) == 0:
+                lq.connect.side_effect = lambda: (connecting.set(), proceed.wait())
+            created.append(lq)
+            return lq
+
+        lancls = MagicMock(side_effect=make)
+        return lancls, created, connecting, proceed
+
+    def _waitConnected(self, p):
+        for _ in range(100):
+            if len(p._connecting) == 0:
+                break
+            time.sleep(0.01)
+
+    def testRemoveQueueWhileConnecting(self):
+        p = setupPlugin()
+        lancls, created, connecting, proceed = self._blockingLANQueues(p)
+        p._queries.getQueues.return_value = []
+        p._connect_lan_queue("LAN", "0.0.0.0:0", [], lancls)
+        connecting.wait()
+        p._commit_queues([], ["LAN"])
+        self.assertEqual(p._connecting, dict())
+        proceed.set()
+        for _ in range(100):
+            if created[0].destroy.called:
+                break
+            time.sleep(0.01)
+
+        self.assertNotIn("LAN", p.q.queues)
+        created[0].destroy.assert_called()
+
+    def testEditQueueAddrWhileConnecting(self):
+        p = setupPlugin()
+        lancls, created, connecting, proceed = self._blockingLANQueues(p)
+        p._connect_lan_queue("LAN", "0.0.0.0:0", ["LAN"], lancls)
+        connecting.wait()
+
+        QT = namedtuple("MockQueue", ["name", "addr", "strategy"])
+        p._queries.getQueues.return_value = [
+            QT(name="LAN", addr="0.0.0.0:1", strategy="IN_ORDER")
+        ]
+        p._commit_queues([], [], lancls=lancls)
+        self._waitConnected(p)
+        self.assertIs(p.q.get("LAN"), created[1])
+        self.assertEqual(lancls.call_args[0][1], "0.0.0.0:1")
+
+        # The superseded connection finishes later and is discarded
+        proceed.set()
+        for _ in range(100):
+            if created[0].destroy.called:
+                break
+            time.sleep(0.01)
+        created[0].destroy.assert_called()
+        self.assertIs(p.q.get("LAN"), created[1])
+
+    def testCommitQueuesUnchangedAddrKeepsQueue(self):
+        p = setupPlugin()
+        lancls, created, connecting, proceed = self._blockingLANQueues(p)
+        proceed.set()
+        p._connect_lan_queue("LAN", "0.0.0.0:0", ["LAN"], lancls, async_=False)
+        QT = namedtuple("MockQueue", ["name", "addr", "strategy"])
+        p._queries.getQueues.return_value = [
+            QT(name="LAN", addr="0.0.0.0:0", strategy="IN_ORDER")
+        ]
+        p._commit_queues([], [])
+        self.assertEqual(len(created), 1)
+        self.assertIs(p.q.get("LAN"), created[0])
+
+    def testCommitQueuesUpdatesStrategy(self):
+        p = setupPlugin()
+        QT = namedtuple("MockQueue", ["name", "addr", "strategy"])
+        p._queries.getQueues.return_value = [
+            QT(name="LAN", addr="0.0.0.0:0", strategy="MIN_MAKESPAN"),
+            QT(name=DEFAULT_QUEUE, addr=None, strategy="In-Order"),
+        ]
+        p.q = MagicMock()
+        lq = MagicMock(strategy=Strategy.IN_ORDER)
+        p.q.get.side_effect = lambda name: lq if name == "LAN" else MagicMock()
+        p._sync_state = MagicMock()
+        p._commit_queues([], [])
+        self.assertEqual(lq.strategy, Strategy.MIN_MAKESPAN)
+
+    def testLANStatePath(self):
+        p = setupPlugin()
+        p.q = MagicMock()
+        p._fileshare = None
+        p._fileshare_cache = None
+        p._printer_profile = None
+        p._sync_state = MagicMock()
+        lancls = MagicMock()
+        p._connect_lan_queue("LAN", "0.0.0.0:0", [], lancls, async_=False)
+        path = lancls.call_args[1]["state_path"]
+        self.assertEqual(path, p._lan_state_path("LAN"))
+        self.assertNotEqual(path, p._lan_state_path("LAN2"))
+
+    def testCommitQueuesRemovesLANState(self):
+        p = setupPlugin()
+        p._queries.getQueues.return_value = []
+        p.q = MagicMock()
+        p._sync_state = MagicMock()
+        with tempfile.TemporaryDirectory() as td:
+            p._data_folder = td
+            Path(p._lan_state_path("LAN")).write_text("{}")
+            p._commit_queues([], ["LAN"])
+            self.assertFalse(Path(p._lan_state_path("LAN")).exists())
+        p.q.remove.assert_called_with("LAN")
+
+    def testQueueConnectFailure(self):
+        p = setupPlugin()
+        p.q = MagicMock()
+        p._fileshare = None
+        p._fileshare_cache = None
+        p._printer_profile = None
+        p._sync_state = MagicMock()
+        lancls = MagicMock(side_effect=ValueError("testing"))
+        p._connect_lan_queue("LAN", "0.0.0.0:0", [], lancls, async_=False)
+        p.q.add.assert_not_called()
+        self.assertEqual(p._connecting, dict())
+        self.assertEqual(len(p._exceptions), 1)
 
     def testDriver(self):
         p = setupPlugin()
@@ -272,41 +535,95 @@ class TestEventHandling(unittest.TestCase):
         )
         self.p._get_queue(DEFAULT_QUEUE).add_set.assert_not_called()
 
+    def _batchUploads(self):
+        self.p._uploads = UploadBatcher(
+            self.p._upload_needs_analysis,
+            self.p._add_sets,
+            logging.getLogger(),
+            timer_cls=MagicMock(),
+        )
+
     def testMetadataAnalysisFinishedWithPending(self):
+        self._batchUploads()
         self.p._set_key(Keys.INFER_PROFILE, True)
         self.p._file_manager.get_additional_metadata.return_value = dict()
         self.p._add_set(path="a.gcode", sd=False)  # Gets queued, no metadata
-        self.p._get_queue(DEFAULT_QUEUE).add_set.assert_not_called()
+        self.p._uploads.flush()
+        self.p._get_queue(DEFAULT_QUEUE).add_sets.assert_not_called()
         self.p.on_event(
             CPQPlugin.CPQ_ANALYSIS_FINISHED,
             dict(result={CPQProfileAnalysisQueue.PROFILE_KEY: "asdf"}, path="a.gcode"),
         )
-        self.p._get_queue(DEFAULT_QUEUE).add_set.assert_called_with(
-            "",
-            {
-                "path": "a.gcode",
-                "sd": "false",
-                "count": 1,
-                "jobDraft": True,
-                "profiles": ["asdf"],
-            },
+        self.p._uploads.flush()
+        self.p._get_queue(DEFAULT_QUEUE).add_sets.assert_called_with(
+            [
+                (
+                    "",
+                    {
+                        "path": "a.gcode",
+                        "sd": "false",
+                        "count": 1,
+                        "jobDraft": True,
+                        "profiles": ["asdf"],
+                    },
+                )
+            ]
         )
 
-    def testAddSetWithPending(self):
+    def testAddSetsBatched(self):
+        self._batchUploads()
         self.p._set_key(Keys.INFER_PROFILE, True)
-        self.p._file_manager.get_additional_metadata.return_value = dict()
-        self.p._add_set(path="a.gcode", sd=False)  # Gets queued, no metadata
-        self.p._get_queue(DEFAULT_QUEUE).add_set.assert_not_called()
-        self.p._add_set(path="a.gcode", sd=False)  # Second attempt passes through
-        self.p._get_queue(DEFAULT_QUEUE).add_set.assert_called_with(
-            "",
-            {
-                "path": "a.gcode",
-                "sd": "false",
-                "count": 1,
-                "jobDraft": True,
-                "profiles": [],
-            },
+        self.p._file_manager.get_additional_metadata.return_value = dict(profile="p")
+        for path in ("a.gcode", "b.gcode"):
+            self.p._add_set(path=path, sd=False, draft=False)
+        self.p._get_queue(DEFAULT_QUEUE).add_sets.assert_not_called()
+        self.p._uploads.flush()
+        ((items,), _) = self.p._get_queue(DEFAULT_QUEUE).add_sets.call_args
+        self.assertEqual(
+            [(i[1]["path"], i[1]["jobDraft"], i[1]["profiles"]) for i in items],
+            [("a.gcode", False, ["p"]), ("b.gcode", False, ["p"])],
+        )
+        self.p._sync_state.assert_called_once()
+
+    def testAddSetsLocalMetadata(self):
+        self._batchUploads()
+        self.p._set_key(Keys.INFER_PROFILE, True)
+        meta = dict(profile="p", metadata=dict(estimatedPrintTime=60))
+
+        def get_meta(dest, path, key):
+            if dest != FileDestinations.LOCAL:
+                raise NoSuchStorage(dest)
+            return meta
+
+        self.p._file_manager.get_additional_metadata.side_effect = get_meta
+        self.p._add_sets([dict(path="a.gcode", sd=False, draft=False, profiles=[])])
+        ((items,), _) = self.p._get_queue(DEFAULT_QUEUE).add_sets.call_args
+        self.assertEqual(items[0][1]["profiles"], ["p"])
+        self.assertEqual(
+            json.loads(items[0][1]["metadata"]), dict(estimatedPrintTime=60)
+        )
+
+    def testPreprocessSetFillsMetadata(self):
+        self.p._set_key(Keys.INFER_PROFILE, True)
+        self.p._file_manager.get_additional_metadata.return_value = dict(
+            profile="asdf",
+            metadata=dict(
+                estimatedPrintTime=60, filamentLengths=[100], layerHeight=0.2
+            ),
+        )
+        data = self.p._preprocess_set(
+            dict(
+                path="a.gcode",
+                metadata=json.dumps(
+                    dict(estimatedPrintTime=None, filamentLengths=[], layerHeight=0.3)
+                ),
+            )
+        )
+        self.assertEqual(data["profiles"], ["asdf"])
+        # Provided values take precedence over CPQ analysis
+        self.assertEqual(
+            json.loads(data["metadata"]),
+            dict(estimatedPrintTime=60, filamentLengths=[100], layerHeight=0.3),
         )
 
     def testUploadNoAction(self):
@@ -354,9 +671,10 @@ class TestEventHandling(unittest.TestCase):
         self.p._queries.annotateLastRun.assert_called_with("a.gcode", "a.mp4", ANY)
 
     def testPrintDone(self):
-        self.p._cleanup_fileshare = lambda: 0
+        self.p._fileshare_cache = MagicMock()
         self.p.on_event(Events.PRINT_DONE, dict())
         self.p.d.action.assert_called_with(DA.SUCCESS, ANY, ANY, ANY, ANY, ANY)
+        self.p._fileshare_cache.check.assert_called_once()
 
     def testPrintFailed(self):
         self.p.on_event(Events.PRINT_FAILED, dict())
@@ -396,6 +714,12 @@ class TestEventHandling(unittest.TestCase):
         self.p.on_event("spool_selected", dict())
         self.p.d.action.assert_called_with(DA.TICK, ANY, ANY, ANY, ANY, ANY)
 
+    def testSpoolSelectedInvalidatesSpoolManagerCache(self):
+        self.p._spool_manager = MagicMock()
+        self.p.EVENT_SPOOL_SELECTED = "spool_selected"
+        self.p.on_event("spool_selected", dict())
+        self.p._spool_manager.invalidate.assert_called()
+
     def testSpoolDeselected(self):
         self.p.EVENT_SPOOL_DESELECTED = "spool_desel"
         self.p.on_event("spool_desel", dict())
@@ -542,77 +866,93 @@ class TestAnalysis(unittest.TestCase):
     def setUp(self):
         self.p = setupPlugin()
 
-    def testInitAnalysisNoFiles(self):
-        self.p._file_manager.list_files.return_value = dict(local=dict())
-        self.p._init_analysis_queue(cls=MagicMock(), async_backlog=False)
+    def initBacklog(self, files, index=dict(), meta=None):
+        td = tempfile.TemporaryDirectory()
+        self.addCleanup(td.cleanup)
+        for f in files:
+            os.makedirs(os.path.dirname(os.path.join(td.name, f)), exist_ok=True)
+            with open(os.path.join(td.name, f), "w") as fh:
+                fh.write("G0 X1\n")
+        self.p._file_manager.path_on_disk.return_value = td.name
+        self.p._file_manager.get_additional_metadata.return_value = meta
+        self.p._queries.getScanIndex.return_value = index
+        self.analyze = MagicMock()
+        self.p._init_analysis_queue(
+            cls=MagicMock(), async_backlog=False, analyze=self.analyze
+        )
         self.p._analysis_queue.register_finish_callback.assert_called()
-        self.p._analysis_queue.enqueue.assert_not_called()
+        return td.name
+
+    def testInitAnalysisNoFiles(self):
+        self.initBacklog([])
+        self.p._queries.updateScanIndex.assert_called_with([], [])
+        self.analyze.assert_not_called()
 
     def testInitAnalysisNoBacklog(self):
-        self.p._file_manager.list_files.return_value = dict(
-            local=dict(
-                file1=dict(
-                    type="machinecode",
-                    path="a.gcode",
-                    continuousprint=dict(profile="TestProfile"),
-                )
-            )
+        self.initBacklog(["a.gcode"], meta=dict(profile="TestProfile"))
+        self.p._queries.markAnalyzed.assert_called_with("a.gcode")
+        self.analyze.assert_not_called()
+
+    def testInitAnalysisUnchangedSkipped(self):
+        td = tempfile.TemporaryDirectory()
+        self.addCleanup(td.cleanup)
+        path = os.path.join(td.name, "a.gcode")
+        with open(path, "w") as f:
+            f.write("G0 X1\n")
+        st = os.stat(path)
+        self.p._file_manager.path_on_disk.return_value = td.name
+        self.p._queries.getScanIndex.return_value = {
+            "a.gcode": (st.st_mtime, st.st_size, True),
+            "gone.gcode": (0, 0, True),
+        }
+        analyze = MagicMock()
+        self.p._init_analysis_queue(
+            cls=MagicMock(), async_backlog=False, analyze=analyze
         )
-        self.p._init_analysis_queue(cls=MagicMock(), async_backlog=False)
-        self.p._analysis_queue.register_finish_callback.assert_called()
-        self.p._analysis_queue.enqueue.assert_not_called()
+        self.p._queries.updateScanIndex.assert_called_with([], ["gone.gcode"])
+        self.p._file_manager.get_additional_metadata.assert_not_called()
+        analyze.assert_not_called()
+
+    def testInitAnalysisCached(self):
+        self.p._queries.getAnalysis.return_value = dict(profile="TestProfile")
+        self.initBacklog(["a.gcode"])
+        self.p._file_manager.set_additional_metadata.assert_called_with(
+            ANY, "a.gcode", ANY, dict(profile="TestProfile"), overwrite=True
+        )
+        self.p._queries.markAnalyzed.assert_called_with("a.gcode")
+        self.analyze.assert_not_called()
 
     def testInitAnalysisWithBacklog(self):
-        self.p._file_manager.list_files.return_value = dict(
-            local=dict(
-                file1=dict(
-                    type="machinecode",
-                    path="a.gcode",
-                ),
-                folder1=dict(
-                    type="folder",
-                    children=dict(
-                        file2=dict(
-                            type="machinecode",
-                            path="b.gcode",
-                        )
-                    ),
-                ),
-            )
+        self.p._settings.set([Keys.ANALYSIS_WORKERS.setting], 3)
+        d = self.initBacklog(
+            [
+                "a.gcode",
+                "folder1/b.gcode",
+                "c.stl",
+                ".hidden.gcode",
+                TEMP_FILE_DIR + "/t.gcode",
+            ]
         )
-        self.p._init_analysis_queue(cls=MagicMock(), async_backlog=False)
-        self.p._analysis_queue.register_finish_callback.assert_called()
-        # Note that python injects some __bool__() calls which is apparently due to threading checks
-        # https://gist.github.com/adamf/aaeb8971b8304a24fe034d5ac4710f09
-        self.p._analysis_queue.enqueue.assert_has_calls(
+        self.analyze.assert_called_once()
+        args = self.analyze.call_args[0]
+        self.assertEqual(
+            sorted(args[0]),
             [
-                call(
-                    QueueEntry(
-                        name="a.gcode",
-                        path=ANY,
-                        type="gcode",
-                        location="local",
-                        absolute_path=ANY,
-                        printer_profile=ANY,
-                        analysis=ANY,
-                    ),
-                    high_priority=False,
-                ),
-                call(
-                    QueueEntry(
-                        name="b.gcode",
-                        path=ANY,
-                        type="gcode",
-                        location="local",
-                        absolute_path=ANY,
-                        printer_profile=ANY,
-                        analysis=ANY,
-                    ),
-                    high_priority=False,
-                ),
+                ("a.gcode", os.path.join(d, "a.gcode")),
+                ("folder1/b.gcode", os.path.join(d, "folder1/b.gcode")),
             ],
-            any_order=True,
         )
+        self.assertEqual(args[1], 3)
+
+    def testBacklogAnalyzed(self):
+        self.p._on_backlog_analyzed("a.gcode", dict(profile="TestProfile"))
+        self.p._queries.setAnalysis.assert_called()
+        self.p._queries.markAnalyzed.assert_called_with("a.gcode")
+
+        # Failed analyses are retried later
+        self.p._queries.reset_mock()
+        self.p._on_backlog_analyzed("a.gcode", None)
+        self.p._queries.markAnalyzed.assert_not_called()
 
     def testAnalysisCompleted(self):
         entry = MagicMock()
@@ -621,42 +961,45 @@ class TestAnalysis(unittest.TestCase):
         self.p._file_manager.set_additional_metadata.assert_called_with(
             ANY, "a.gcode", ANY, ANY, overwrite=True
         )
-
-
-class TestCleanupFileshare(unittest.TestCase):
-    def setUp(self):
-        self.td = tempfile.TemporaryDirectory()
-        q = MagicMock()
-        q.as_dict.return_value = dict(
-            jobs=[
-                {"hash": "a", "peer_": q.addr, "acquired_by_": None},
-                {"hash": "b", "peer_": "peer2", "acquired_by_": q.addr},
-                {"hash": "c", "peer_": "peer2", "acquired_by_": None},
-                {"hash": "d", "peer_": "peer2", "acquired_by_": None},
-            ]
+        self.p._queries.setAnalysis.assert_called_with(
+            self.p._file_manager.get_metadata().get(), dict(profile="TestProfile")
         )
-        self.p = setupPlugin()
-        self.p.fileshare_dir = self.td.name
-        self.p.q = MagicMock()
-        self.p.q.queues.items.return_value = [("q", q)]
 
-    def tearDown(self):
-        self.td.cleanup()
+    def testEnqueueCachedAnalysis(self):
+        self.p._init_analysis_queue(cls=MagicMock(), async_backlog=False)
+        self.p._file_manager.get_metadata.return_value = dict(hash="abc")
+        self.p._queries.getAnalysis.return_value = dict(profile="TestProfile")
+        self.assertTrue(self.p._enqueue("a.gcode"))
+        self.p._queries.getAnalysis.assert_called_with("abc")
+        self.p._analysis_queue.enqueue.assert_not_called()
+        self.p._file_manager.set_additional_metadata.assert_called_with(
+            ANY, "a.gcode", ANY, dict(profile="TestProfile"), overwrite=True
+        )
 
-    def testCleanupNoFiles(self):
-        self.assertEqual(self.p._cleanup_fileshare(), 0)
+    def testContentHashFallback(self):
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b"G0 X1\n")
+            f.flush()
+            self.p._file_manager.get_metadata.return_value = dict()
+            self.p._file_manager.path_on_disk.return_value = f.name
+            self.assertEqual(
+                self.p._content_hash("a.gcode"),
+                "a675d667540bbcc88c872521affd4998c49c6cc7",
+            )
 
-    def testCleanupWithFiles(self):
-        p = Path(self.p.fileshare_dir)
-        (p / "d").mkdir()
-        for n in ("a", "b", "c"):
-            (p / f"{n}.gcode").touch()
-        self.assertEqual(self.p._cleanup_fileshare(), 2)
 
-        for n in ("a", "b"):
-            self.assertTrue((p / f"{n}.gcode").exists())
-        self.assertFalse((p / "c.gcode").exists())
-        self.assertFalse((p / "d").exists())
+class TestPinnedFileshareHashes(unittest.TestCase):
+    def testPinnedFromLANQueues(self):
+        p = setupPlugin()
+        lq = MagicMock()
+        lq.pinned_hashes.return_value = set(["a", "b"])
+        p.q = MagicMock()
+        p.q.queues.items.return_value = [
+            ("q", lq),
+            (DEFAULT_QUEUE, MagicMock()),
+            (ARCHIVE_QUEUE, MagicMock()),
+        ]
+        self.assertEqual(p._pinned_fileshare_hashes(), set(["a", "b"]))
 
 
 class TestLocalAddressResolution(unittest.TestCase):
@@ -672,6 +1015,15 @@ class TestLocalAddressResolution(unittest.TestCase):
         self.assertEqual(self.p.get_local_addr(), "1.2.3.4:1234")
         s.connect.assert_called_with(("checkhost", 5678))
 
+    @patch("continuousprint.plugin.socket")
+    def testResolutionCached(self, msock):
+        s = msock.socket()
+        s.getsockname.side_effect = [("1.2.3.4", "1234"), ("ignored", "5678")]
+        self.assertEqual(self.p.get_local_addr(), "1.2.3.4:1234")
+        self.assertEqual(self.p.get_local_addr(), "1.2.3.4:5678")
+        s.connect.assert_called_once()
+        s.bind.assert_called_with(("1.2.3.4", 0))
+
     @patch("continuousprint.plugin.socket")
     def testResolutionFailoverToMDNS(self, msock):
         self.p._can_bind_addr = lambda a: False
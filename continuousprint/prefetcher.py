@@ -0,0 +1,201 @@
+import os
+import requests
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from .blobshare import blob_key, is_sha256, split_blob_path
+
+
+class Throttle:
+    """Limits the combined rate of bytes consumed by any number of threads.
+    A rate of 0 means unlimited."""
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def consume(self, nbytes):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = self._clock()
+            self._next = max(self._next, now) + nbytes / self.rate
+            delay = self._next - now
+        if delay > 0:
+            self._sleep(delay)
+
+
+class JobPrefetcher:
+    """Downloads the .gjob files of LAN jobs we're likely to print next in the
+    background, so that resolving their sets when printing
+    starts doesn't wait on the network.
+
+    `targets` is a callable returning [(fs_addr, hash)] of jobs to prefetch,
+    most likely first (see LANQueue.prefetch_targets). Content-addressed set
+    files are given as "blobs/<sha>/<name>" in place of a hash. Downloads share
+    `max_rate` bytes/sec (0 for unlimited) across at most `workers`
+    concurrent downloads, and are skipped if they would push the fileshare
+    cache over its budget, so prefetching never causes eviction. A download
+    that someone is waiting on (see wait()) is no longer rate limited.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(
+        self,
+        fileshare,
+        cache,
+        targets,
+        logger,
+        max_rate=0,
+        workers=1,
+        http=requests,
+    ):
+        self._fileshare = fileshare
+        self._cache = cache
+        self._targets = targets
+        self._logger = logger
+        self._throttle = Throttle(max_rate)
+        self._workers = workers
+        self._http = http
+        self._lock = threading.Lock()
+        self._inflight = dict()  # hash -> threading.Event, set when done
+        self._urgent = set()  # In-flight hashes that wait() is blocked on
+        self._skip = set()  # Hashes not to try again (until restart)
+        self._wake = threading.Event()
+        self._thread = None
+        self._pool = None
+
+    def start(self):
+        self._pool = ThreadPoolExecutor(
+            max_workers=self._workers, thread_name_prefix="prefetch"
+        )
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def check(self):
+        """Requests a (non-blocking) look for new jobs to prefetch"""
+        self._wake.set()
+
+    def set_max_rate(self, max_rate):
+        """Changes the rate limit, including for downloads already in progress"""
+        self._throttle.rate = max_rate
+
+    def wait(self, hash_, timeout=None):
+        """Blocks until any in-progress prefetch of `hash_` completes, so it
+        isn't fetched twice at once. The rest of that download is unthrottled,
+        as the caller needs the file now."""
+        with self._lock:
+            done = self._inflight.get(hash_)
+            if done is not None:
+                self._urgent.add(hash_)
+        if done is not None:
+            done.wait(timeout)
+
+    def _consumer(self, hash_):
+        def consume(nbytes):
+            if hash_ not in self._urgent:
+                self._throttle.consume(nbytes)
+
+        return consume
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self.schedule()
+            except Exception:
+                self._logger.error(traceback.format_exc())
+
+    def _basedir(self):
+        return Path(self._fileshare.basedir)
+
+    def _local_path(self, hash_):
+        if split_blob_path(hash_) is not None:
+            return self._basedir() / hash_
+        # Set files are extracted from the .gjob only when they're printed
+        return self._basedir() / f"{hash_}.gjob"
+
+    def schedule(self):
+        for (fs_addr, hash_) in self._targets():
+            if split_blob_path(hash_) is None and not is_sha256(hash_):
+                continue  # Malformed target from a peer; never a local path
+            if self._local_path(hash_).exists():
+                continue  # Already fetched
+            with self._lock:
+                if hash_ in self._inflight or hash_ in self._skip:
+                    continue
+                self._inflight[hash_] = threading.Event()
+            self._pool.submit(self._prefetch, fs_addr, hash_)
+
+    def _prefetch(self, fs_addr, hash_):
+        try:
+            blob = split_blob_path(hash_)
+            if blob is not None:
+                fetched = self._fileshare.fetch_blob(
+                    fs_addr,
+                    *blob,
+                    consume=self._consumer(hash_),
+                    room=self._room,
+                )
+                if fetched is not None:
+                    if self._cache is not None:
+                        self._cache.touch(blob_key(blob[0]))
+                    self._logger.info(f"Prefetched LAN file {hash_} from {fs_addr}")
+                else:
+                    with self._lock:
+                        self._skip.add(hash_)
+            elif self._download(fs_addr, hash_):
+                if self._cache is not None:
+                    self._cache.touch(hash_)
+                self._logger.info(f"Prefetched LAN job {hash_} from {fs_addr}")
+            else:
+                with self._lock:
+                    self._skip.add(hash_)
+        except Exception:
+            # The job will still be fetched normally when it's printed.
+            self._logger.warning(
+                f"Failed to prefetch LAN job {hash_} from {fs_addr}:\n{traceback.format_exc()}"
+            )
+            with self._lock:
+                self._skip.add(hash_)
+        finally:
+            with self._lock:
+                self._urgent.discard(hash_)
+                self._inflight.pop(hash_).set()
+
+    def _room(self, nbytes) -> bool:
+        if self._cache is None:
+            return True
+        return self._cache.total_bytes() + nbytes <= self._cache.budget_bytes
+
+    def _download(self, fs_addr, hash_) -> bool:
+        # Returns False if the job was skipped for lack of disk space.
+        dest = self._local_path(hash_)
+        tmp = self._basedir() / f"{hash_}.gjob.prefetch"
+        consume = self._consumer(hash_)
+        with self._http.get(f"http://{fs_addr}/{hash_}.gjob", stream=True) as r:
+            r.raise_for_status()
+            size = int(r.headers.get("Content-Length", 0))
+            if not self._room(size):
+                self._logger.debug(
+                    f"Not prefetching {hash_} ({size}B); fileshare cache is full"
+                )
+                return False
+            try:
+                with open(tmp, "wb") as f:
+                    for chunk in r.iter_content(chunk_size=self.CHUNK_SIZE):
+                        consume(len(chunk))
+                        f.write(chunk)
+                # Only complete files appear under the name fetch() checks
+                os.replace(tmp, dest)
+            finally:
+                if tmp.exists():
+                    tmp.unlink()
+        return True
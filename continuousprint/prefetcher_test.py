@@ -0,0 +1,210 @@
+import unittest
+import io
+import logging
+import tempfile
+import threading
+import time
+import zipfile
+from pathlib import Path
+from unittest.mock import MagicMock, ANY
+from .prefetcher import JobPrefetcher, Throttle
+
+# logging.basicConfig(level=logging.DEBUG)
+
+
+def gjob_bytes(size):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, mode="w") as zf:
+        zf.writestr("a.gcode", b"G1" * (size // 2))
+        zf.writestr("manifest.json", "{}")
+    return buf.getvalue()
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+        self.headers = {"Content-Length": str(len(data))}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.data), chunk_size):
+            yield self.data[i : i + chunk_size]
+
+
+class TestThrottle(unittest.TestCase):
+    def test_unlimited(self):
+        sleep = MagicMock()
+        Throttle(0, clock=lambda: 0, sleep=sleep).consume(10**9)
+        sleep.assert_not_called()
+
+    def test_paces_bytes(self):
+        sleep = MagicMock()
+        t = Throttle(100, clock=lambda: 0, sleep=sleep)
+        t.consume(50)
+        sleep.assert_called_with(0.5)
+        t.consume(100)  # Queued behind the first chunk
+        sleep.assert_called_with(1.5)
+
+
+H1 = "1" * 64
+S1 = "a" * 64
+
+
+class TestJobPrefetcher(unittest.TestCase):
+    def setUp(self):
+        td = tempfile.TemporaryDirectory()
+        self.addCleanup(td.cleanup)
+        self.d = Path(td.name)
+        self.fs = MagicMock(basedir=str(self.d))
+        self.cache = MagicMock(budget_bytes=10**6)
+        self.cache.total_bytes.return_value = 0
+        self.http = MagicMock()
+        self.data = gjob_bytes(1000)
+        self.http.get.side_effect = lambda url, stream: FakeResponse(self.data)
+        self.targets = [("peer:1", H1)]
+        self.p = JobPrefetcher(
+            self.fs,
+            self.cache,
+            lambda: self.targets,
+            logging.getLogger(),
+            http=self.http,
+        )
+        self.p._pool = MagicMock()
+        self.p._pool.submit.side_effect = lambda fn, *args: fn(*args)
+
+    def test_prefetch(self):
+        self.p.schedule()
+        self.http.get.assert_called_with(f"http://peer:1/{H1}.gjob", stream=True)
+        self.assertEqual((self.d / f"{H1}.gjob").read_bytes(), self.data)
+        self.assertFalse((self.d / f"{H1}.gjob.prefetch").exists())
+        # Set files are only extracted when printed
+        self.assertFalse((self.d / H1).exists())
+        self.fs.fetch.assert_not_called()
+        self.cache.touch.assert_called_with(H1)
+        self.assertEqual(self.p._inflight, dict())
+
+    def test_prefetch_blob(self):
+        self.targets = [("peer:1", f"blobs/{S1}/a.gcode")]
+        self.p.schedule()
+        self.fs.fetch_blob.assert_called_with(
+            "peer:1",
+            S1,
+            "a.gcode",
+            consume=ANY,
+            room=self.p._room,
+        )
+        self.http.get.assert_not_called()
+        self.cache.touch.assert_called_with(f"blobs/{S1}")
+
+    def test_prefetch_blob_no_room(self):
+        self.targets = [("peer:1", f"blobs/{S1}/a.gcode")]
+        self.fs.fetch_blob.return_value = None
+        self.p.schedule()
+        self.cache.touch.assert_not_called()
+        self.assertEqual(self.p._skip, set([f"blobs/{S1}/a.gcode"]))
+
+    def test_skips_fetched_blob(self):
+        self.targets = [("peer:1", f"blobs/{S1}/a.gcode")]
+        (self.d / f"blobs/{S1}").mkdir(parents=True)
+        (self.d / f"blobs/{S1}/a.gcode").touch()
+        self.p.schedule()
+        self.p._pool.submit.assert_not_called()
+
+    def test_skips_fetched(self):
+        (self.d / f"{H1}.gjob").touch()
+        self.p.schedule()
+        self.p._pool.submit.assert_not_called()
+
+    def test_skips_malformed(self):
+        self.targets = [("peer:1", "../h1"), ("peer:1", "blobs/../a.gcode")]
+        self.p.schedule()
+        self.p._pool.submit.assert_not_called()
+
+    def test_skips_inflight(self):
+        self.p._inflight[H1] = threading.Event()
+        self.p.schedule()
+        self.p._pool.submit.assert_not_called()
+
+    def test_no_room_to_download(self):
+        self.cache.total_bytes.return_value = 10**6 - 10
+        self.p.schedule()
+        self.assertFalse((self.d / f"{H1}.gjob").exists())
+        self.fs.fetch.assert_not_called()
+
+        # Not retried
+        self.http.get.reset_mock()
+        self.p.schedule()
+        self.http.get.assert_not_called()
+
+    def test_download_failure(self):
+        self.http.get.side_effect = Exception("testing")
+        self.p.schedule()
+        self.fs.fetch.assert_not_called()
+        self.assertFalse((self.d / f"{H1}.gjob").exists())
+        self.assertEqual(self.p._skip, set([H1]))
+
+    def test_wait_for_inflight(self):
+        self.p._pool.submit.side_effect = None  # Don't run
+        self.p.schedule()
+        (fn, *args) = self.p._pool.submit.call_args[0]
+        t = threading.Thread(target=fn, args=args)
+        waited = threading.Event()
+
+        def wait():
+            self.p.wait(H1)
+            self.assertTrue((self.d / f"{H1}.gjob").exists())
+            waited.set()
+
+        w = threading.Thread(target=wait)
+        w.start()
+        t.start()
+        t.join()
+        w.join(timeout=5)
+        self.assertTrue(waited.is_set())
+
+    def test_wait_lifts_throttle(self):
+        self.p._throttle = MagicMock()
+        consumed = []
+        started = threading.Event()
+        resume = threading.Event()
+
+        def fake_get(url, stream):
+            started.set()
+            resume.wait(timeout=5)
+            return FakeResponse(self.data)
+
+        self.http.get.side_effect = fake_get
+        self.p._throttle.consume.side_effect = consumed.append
+        self.p._pool.submit.side_effect = None  # Don't run
+        self.p.schedule()
+        (fn, *args) = self.p._pool.submit.call_args[0]
+        t = threading.Thread(target=fn, args=args)
+        t.start()
+        started.wait(timeout=5)
+        w = threading.Thread(target=self.p.wait, args=(H1,))
+        w.start()
+        for _ in range(500):
+            if H1 in self.p._urgent:
+                break
+            time.sleep(0.01)
+        resume.set()
+        t.join(timeout=5)
+        w.join(timeout=5)
+        self.assertEqual(consumed, [])
+        self.assertTrue((self.d / f"{H1}.gjob").exists())
+        self.assertEqual(self.p._urgent, set())
+
+    def test_set_max_rate(self):
+        self.p.set_max_rate(5)
+        self.assertEqual(self.p._throttle.rate, 5)
+
+    def test_wait_not_inflight(self):
+        self.p.wait(H1)  # Returns immediately
@@ -8,6 +8,7 @@ from abc import ABC, abstractmethod
 class Strategy(Enum):
     IN_ORDER = auto()  # Jobs and sets printed in lexRank order
     LEAST_MANUAL = auto()  # Choose the job which produces the least manual changes
+    MIN_MAKESPAN = auto()  # LAN queues: share jobs among printers to finish all soonest
 
 
 @dataclasses.dataclass
@@ -18,6 +19,8 @@ class QueueData:
     active_set: int
     addr: Optional[str] = None
     peers: list = dataclasses.field(default_factory=list)
+    # True if showing state saved before a restart, until the network is ready
+    provisional: bool = False
 
 
 class AbstractQueue(ABC):
@@ -44,6 +47,17 @@ class AbstractQueue(ABC):
     def acquire(self) -> bool:
         pass
 
+    @abstractmethod
+    def candidates(self) -> list:
+        """Returns [(job, set)] for each job that acquire() could choose, in
+        the queue's own order. Used to schedule across queues."""
+        pass
+
+    @abstractmethod
+    def acquire_candidate(self, job: JobView, s: SetView) -> bool:
+        """Acquires a (job, set) returned by candidates()"""
+        pass
+
     @abstractmethod
     def release(self) -> None:
         pass
@@ -72,6 +72,16 @@ class AbstractQueueTests(JobEqualityTests):
         self.assertEqual(self.q.get_job(), None)
         self.assertEqual(self.q.get_set(), None)
 
+    def test_candidates(self):
+        j = testJob(0)
+        got = self.q.candidates()
+        self.assertEqual(len(got), 1)
+        self.assertJobsEqual(got[0][0], j)
+        self.assertSetsEqual(got[0][1], j.sets[0])
+        self.assertEqual(self.q.acquire_candidate(*got[0]), True)
+        self.assertEqual(self.q.get_job().acquired, True)
+        self.assertSetsEqual(self.q.get_set(), j.sets[0])
+
     def test_decrement_and_reset(self):
         self.assertEqual(self.q.acquire(), True)
         self.assertEqual(self.q.decrement(), True)  # Work remains
@@ -1,9 +1,17 @@
+import copy
+import json
+import os
+import threading
+from collections import Counter
+import time
 import uuid
 from typing import Optional
 from bisect import bisect_left
-from peerprint.lan_queue import LANPrintQueue, ChangeType
 from ..storage.lan import LANJobView, LANSetView
 from ..storage.database import JobView, SetView
+from ..storage.keymask import profile_bit
+from ..blobshare import BLOB_DIR, blob_key
+from ..gjob import extract_member
 from pathlib import Path
 from .abstract import AbstractEditableQueue, QueueData, Strategy
 import dataclasses
@@ -13,7 +21,114 @@ class ValidationError(Exception):
     pass
 
 
+def _annotate_job(peer_and_manifest, acquired_by):
+    (peer, manifest) = peer_and_manifest
+    m = dict(**manifest)
+    m["peer_"] = peer
+    m["acquired"] = True if acquired_by is not None else False
+    m["acquired_by_"] = acquired_by
+    return m
+
+
+def plan_lpt(jobs, peers, compatible) -> dict:
+    """Assigns `jobs` (a list of (job, estimated seconds)) to `peers` (a dict
+    of peer -> time it's free to start printing) to finish all jobs as soon
+    as possible. Uses the longest processing time first heuristic: the
+    longest job goes to whichever compatible peer is free soonest, and so on.
+
+    `compatible(job, peer)` returns whether the peer can print the job.
+    Returns a dict of peer -> [job] in the order the peer should print them.
+    Ties are broken by job order and peer name, so every peer planning with
+    the same data arrives at the same plan.
+    """
+    free_at = dict(peers)
+    plan = dict([(p, []) for p in peers.keys()])
+    order = sorted(range(len(jobs)), key=lambda i: -jobs[i][1])
+    for i in order:
+        (job, duration) = jobs[i]
+        best = None
+        for p, t in free_at.items():
+            if compatible(job, p) and (best is None or (t, p) < (free_at[best], best)):
+                best = p
+        if best is not None:
+            plan[best].append(job)
+            free_at[best] += duration
+    return plan
+
+
+class LANSnapshot:
+    """Jobs, locks and peers of a LAN queue, read together and indexed for
+    the scheduler. Built only when the replicated state changes.
+
+    `candidates` are the views of jobs this printer could print next: not
+    draft, with work remaining, unlocked or locked by us, and with at least
+    one set printable with our profile. Peers are only fetched when first
+    needed, as peer state changes far more often than jobs do.
+    """
+
+    def __init__(self, jobs, locks, lanq, lq):
+        self._lanq = lanq
+        self._peers = None
+        self.locks = dict(locks)  # job id -> peer
+        self.peer_locks = {}  # peer -> [job id]
+        for jid, peer in self.locks.items():
+            self.peer_locks.setdefault(peer, []).append(jid)
+
+        self.jobs = []
+        self.views = {}  # job id -> LANJobView
+        self.sets = {}  # set id -> LANSetView
+        self.candidates = []
+        bit = profile_bit(lq._profile["name"])
+        for jid, v in jobs:
+            acq = self.locks.get(jid)
+            data = _annotate_job(v, acq)
+            self.jobs.append(data)
+            job = LANJobView(data, lq)
+            self.views[jid] = job
+            for s in job.sets:
+                self.sets[s.id] = s
+            if acq not in (None, lq.addr) or job.draft or job.remaining == 0:
+                continue
+            if any(s.matches_profile(bit) for s in job.sets):
+                self.candidates.append(job)
+
+    def without_peers(self):
+        snap = copy.copy(self)
+        snap._peers = None
+        return snap
+
+    @property
+    def peers(self) -> dict:
+        if self._peers is None:
+            self._peers = dict(
+                [
+                    (k, dict(**v, acquired=self.peer_locks.get(k, [])))
+                    for k, v in self._lanq.getPeers().items()
+                ]
+            )
+        return self._peers
+
+
+class _SavedPeers:
+    # Stands in for peerprint's queue in a LANSnapshot loaded from disk
+    def __init__(self, peers):
+        self._peers = peers
+
+    def getPeers(self):
+        return dict(self._peers)
+
+
 class LANQueue(AbstractEditableQueue):
+    # Peer state is republished at least this often (seconds) even if
+    # unchanged, as peerprint drops peers not heard from in PEER_TIMEOUT (60s).
+    PEER_HEARTBEAT = 30
+    # Changes in a peer's estimated free time smaller than this (seconds)
+    # aren't worth publishing before the next heartbeat.
+    FREE_AT_TOLERANCE = 60
+    # Seconds to wait after a change before saving state, so bursts of
+    # changes are written once; see _schedule_save()
+    SAVE_DELAY = 5.0
+
     def __init__(
         self,
         ns,
@@ -24,6 +139,11 @@ class LANQueue(AbstractEditableQueue):
         fileshare,
         profile,
         path_on_disk_fn,
+        fileshare_cache=None,
+        prefetcher=None,
+        clock=time.monotonic,
+        state_path=None,
+        timer_cls=threading.Timer,
     ):
         super().__init__()
         self._logger = logger
@@ -36,7 +156,37 @@ class LANQueue(AbstractEditableQueue):
         self.set_id = None
         self.update_cb = update_cb
         self._fileshare = fileshare
+        self._fileshare_cache = fileshare_cache
+        self._prefetcher = prefetcher
         self._path_on_disk = path_on_disk_fn
+        # Jobs, locks and peers as of the last change reported to
+        # _on_update; see _snapshot()
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_gen = 0
+        self._snap = None
+        # Last peer state sent to the network, and when; see update_peer_state()
+        self._clock = clock
+        self._published = None
+        self._published_at = None
+        self.peer_state_counts = Counter()  # "published" / "suppressed"
+        # Job id -> clock time it was first seen unlocked; see _plan(), which
+        # is called from both the driver and prefetcher threads
+        self._unlocked_since = dict()
+        self._unlocked_lock = threading.Lock()
+        # Replicated state is saved to `state_path` so that after a restart
+        # the last known jobs can be shown (read-only) until the network is
+        # ready; see _stored_snapshot()
+        self._state_path = state_path
+        self._timer_cls = timer_cls
+        self._save_lock = threading.Lock()
+        self._save_timer = None
+        self._provisional = None
+        if state_path is not None:
+            self._load_state()
+        # Deferred import; peerprint's networking stack is only needed once a
+        # LAN queue is actually created.
+        from peerprint.lan_queue import LANPrintQueue
+
         self.lan = LANPrintQueue(self.ns, self.addr, self._on_update, self._logger)
 
     # ---------- LAN queue methods ---------
@@ -45,6 +195,7 @@ class LANQueue(AbstractEditableQueue):
         return self.lan.q.is_ready()
 
     def connect(self):
+        self._published = None
         self.lan.connect()
 
     def _compare_peer(self, prev, nxt):
@@ -63,6 +214,14 @@ class LANQueue(AbstractEditableQueue):
         return True  # Always trigger callback - TODO make this more sophisticated
 
     def _on_update(self, changetype, prev, nxt):
+        from peerprint.lan_queue import ChangeType
+
+        if changetype == ChangeType.QUEUE and self._provisional is not None:
+            self._end_provisional()
+        self._invalidate_snapshot(peers_only=(changetype == ChangeType.PEER))
+        if changetype != ChangeType.PEER:
+            # Peer status changes every tick and is stale by the next restart
+            self._schedule_save()
         if changetype == ChangeType.PEER and not self._compare_peer(prev, nxt):
             return
         elif changetype == ChangeType.JOB and not self._compare_job(prev, nxt):
@@ -70,56 +229,252 @@ class LANQueue(AbstractEditableQueue):
         self.update_cb(self)
 
     def destroy(self):
+        with self._save_lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
         self.lan.destroy()
 
-    def update_peer_state(self, name, status, run, profile):
-        if self.lan is not None and self.lan.q is not None:
-            self.lan.q.syncPeer(
-                dict(
-                    active_set=self._active_set(),
-                    name=name,
-                    status=status,
-                    run=run,
-                    profile=profile,
-                    fs_addr=f"{self._fileshare.host}:{self._fileshare.port}",
-                )
+    # -------- Persistence across restarts ------
+
+    def _load_state(self):
+        try:
+            with open(self._state_path) as f:
+                data = json.load(f)
+            jobs = [(jid, tuple(pm)) for jid, pm in data["jobs"]]
+            self._provisional = LANSnapshot(
+                jobs, data["locks"], _SavedPeers(data["peers"]), self
+            )
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError, TypeError):
+            self._logger.warning(
+                f"{self.ns}: ignoring unreadable saved state {self._state_path}"
+            )
+            return
+        self._logger.info(
+            f"{self.ns}: showing {len(jobs)} jobs saved at {data.get('saved')} until the network is ready"
+        )
+
+    def _stored_snapshot(self):
+        # Returns the snapshot loaded from disk if the network isn't ready yet
+        p = self._provisional
+        if p is None:
+            return None
+        if self.lan.q is not None and self.lan.q.is_ready():
+            self._end_provisional()
+            return None
+        return p
+
+    def _end_provisional(self):
+        self._provisional = None
+        self._invalidate_snapshot()
+        self._logger.info(f"{self.ns}: network ready; replacing saved state")
+
+    def _schedule_save(self):
+        if self._state_path is None:
+            return
+        with self._save_lock:
+            if self._save_timer is not None:
+                return
+            self._save_timer = self._timer_cls(self.SAVE_DELAY, self._save_state)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _save_state(self):
+        with self._save_lock:
+            self._save_timer = None
+        # Saved state must not be overwritten before we've synced with the network
+        if (
+            self.lan.q is None
+            or not self.lan.q.is_ready()
+            or self._stored_snapshot() is not None
+        ):
+            return
+        data = dict(
+            saved=int(time.time()),
+            jobs=self.lan.q.getJobs(),
+            locks=self.lan.q.getLocks(),
+            peers=self.lan.q.getPeers(),
+        )
+        tmp = f"{self._state_path}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, self._state_path)
+        except (OSError, TypeError, ValueError):
+            self._logger.warning(
+                f"{self.ns}: failed to save state to {self._state_path}"
             )
 
+    def _has_state(self) -> bool:
+        return self._provisional is not None or (
+            self.lan is not None and self.lan.q is not None
+        )
+
+    def update_peer_state(self, name, status, run, profile, free_at=None):
+        # `free_at` is when this printer expects to be ready for another job
+        # (None if it isn't taking jobs); see Strategy.MIN_MAKESPAN
+        # This is called on every tick, so state is only sent to other peers
+        # when it changes, or as a heartbeat every PEER_HEARTBEAT seconds.
+        if self.lan is None or self.lan.q is None:
+            return
+        state = dict(
+            active_set=self._active_set(),
+            name=name,
+            status=status,
+            run=run,
+            profile=profile,
+            fs_addr=f"{self._fileshare.host}:{self._fileshare.port}",
+            free_at=free_at,
+        )
+        now = self._clock()
+        if (
+            self._published is not None
+            and now - self._published_at < self.PEER_HEARTBEAT
+            and not self._peer_state_changed(self._published, state)
+        ):
+            self.peer_state_counts["suppressed"] += 1
+            return
+        self.lan.q.syncPeer(state)
+        self._published = state
+        self._published_at = now
+        self.peer_state_counts["published"] += 1
+        self._logger.debug(
+            f"{self.ns}: published peer state ({dict(self.peer_state_counts)})"
+        )
+
+    def _peer_state_changed(self, prev, nxt) -> bool:
+        for k in nxt.keys():
+            if k == "free_at" and None not in (prev[k], nxt[k]):
+                if abs(prev[k] - nxt[k]) >= self.FREE_AT_TOLERANCE:
+                    return True
+            elif prev.get(k) != nxt[k]:
+                return True
+        return False
+
     def set_job(self, jid: str, manifest: dict):
         # Preserve peer address of job if present in the manifest
-        return self.lan.q.setJob(jid, manifest, addr=manifest.get("peer_", None))
+        result = self.lan.q.setJob(jid, manifest, addr=manifest.get("peer_", None))
+        self._invalidate_snapshot()
+        return result
 
-    def get_gjob_dirpath(self, peer, hash_):
+    def get_gjob_file(self, peer, hash_, name):
         # Get fileshare address from the peer
         peerstate = self._get_peers().get(peer)
         if peerstate is None:
             raise ValidationError(
-                "Cannot resolve set {path} within job hash {hash_}; peer state is None"
+                f"Cannot resolve set {name} within job hash {hash_}; peer state is None"
+            )
+
+        # fetch packed job from fileshare (may be cached), then extract only
+        # the requested file alongside it and return its real path
+        if self._prefetcher is not None:
+            self._prefetcher.wait(hash_)
+        gjob = self._fileshare.fetch(peerstate["fs_addr"], hash_)
+        path = extract_member(gjob, name, Path(gjob).with_suffix(""))
+        self._touch(hash_)
+        return path
+
+    def get_blob_path(self, peer, sha, name):
+        # As get_gjob_file, but for a single content-addressed set file
+        peerstate = self._get_peers().get(peer)
+        if peerstate is None:
+            raise ValidationError(
+                f"Cannot resolve set {name} with blob {sha}; peer state is None"
             )
+        if self._prefetcher is not None:
+            self._prefetcher.wait(f"{BLOB_DIR}/{sha}/{name}")
+        path = self._fileshare.fetch_blob(peerstate["fs_addr"], sha, name)
+        self._touch(blob_key(sha))
+        return path
+
+    def _touch(self, hash_):
+        if self._fileshare_cache is not None:
+            self._fileshare_cache.touch(hash_)
+
+    def prefetch_targets(self, n) -> list:
+        # (fs_addr, hash) of up to `n` jobs hosted by others that we're most
+        # likely to print next; see JobPrefetcher. Content-addressed jobs give
+        # one target per set file, as "blobs/<sha>/<name>".
+        if n <= 0 or self.lan is None or self.lan.q is None:
+            return []
+        if self.strategy == Strategy.MIN_MAKESPAN:
+            jobs = self._plan()
+        else:
+            jobs = self._snapshot().candidates
+        peers = self._get_peers()
+        result = []
+        for job in jobs[:n]:
+            fs_addr = peers.get(job.peer, dict()).get("fs_addr")
+            if job.peer == self.addr or fs_addr is None:
+                continue
+            if job.hash is not None:
+                result.append((fs_addr, job.hash))
+            for s in job.sets:
+                if s.blob is not None:
+                    result.append((fs_addr, f"{BLOB_DIR}/{s.blob}/{s.path}"))
+        return result
 
-        # fetch unpacked job from fileshare (may be cached) and return the real path
-        return self._fileshare.fetch(peerstate["fs_addr"], hash_, unpack=True)
+    def pinned_hashes(self) -> set:
+        # Hashes of jobs hosted or acquired by us, which others may still need
+        # to fetch (or which we're about to print).
+        if not self._has_state():
+            return set()
+        result = set()
+        for j in self._get_jobs():
+            if j["peer_"] != self.addr and j["acquired_by_"] != self.addr:
+                continue
+            if j.get("hash") is not None:
+                result.add(j["hash"])
+            for s in j["sets"]:
+                if s.get("blob") is not None:
+                    result.add(blob_key(s["blob"]))
+        return result
+
+    # -------- Snapshot of replicated state ------
+
+    def _invalidate_snapshot(self, peers_only=False):
+        with self._snapshot_lock:
+            if peers_only:
+                if self._snap is not None:
+                    self._snap = self._snap.without_peers()
+                return
+            self._snapshot_gen += 1
+            self._snap = None
+
+    def _snapshot(self) -> "LANSnapshot":
+        # Snapshots are shared, so callers must not modify their contents
+        # except via LANJobView.save() (which invalidates the snapshot).
+        stored = self._stored_snapshot()
+        if stored is not None:
+            return stored
+        with self._snapshot_lock:
+            snap = self._snap
+            gen = self._snapshot_gen
+        if snap is not None:
+            return snap
+        snap = LANSnapshot(
+            self.lan.q.getJobs(), self.lan.q.getLocks(), self.lan.q, self
+        )
+        with self._snapshot_lock:
+            # Don't store a snapshot of data that changed while we were
+            # building it.
+            if gen == self._snapshot_gen:
+                self._snap = snap
+        return snap
 
     # -------- Wrappers around LANQueue to add/remove metadata ------
 
     def _annotate_job(self, peer_and_manifest, acquired_by):
-        (peer, manifest) = peer_and_manifest
-        m = dict(**manifest)
-        m["peer_"] = peer
-        m["acquired"] = True if acquired_by is not None else False
-        m["acquired_by_"] = acquired_by
-        return m
+        return _annotate_job(peer_and_manifest, acquired_by)
 
     def _normalize_job(self, data):
         del m["peer_"]
         del m["acquired_by_"]
 
     def _get_jobs(self) -> list:
-        joblocks = self.lan.q.getLocks()
-        jobs = []
-        for jid, v in self.lan.q.getJobs():
-            jobs.append(self._annotate_job(v, joblocks.get(jid)))
-        return jobs
+        return [dict(j) for j in self._snapshot().jobs]
 
     def _get_job(self, jid) -> dict:
         j = self.lan.q.getJob(jid)
@@ -127,36 +482,92 @@ class LANQueue(AbstractEditableQueue):
             joblocks = self.lan.q.getLocks()
             return self._annotate_job(j, joblocks.get(jid))
 
-    def _get_peers(self) -> list:
-        result = {}
-        # Locks are given by job:peer, so reverse this
-        peerlocks = dict([(v, k) for k, v in self.lan.q.getLocks().items()])
-        for k, v in self.lan.q.getPeers().items():
-            result[k] = dict(**v, acquired=peerlocks.get(k, []))
-        return result
+    def _get_peers(self) -> dict:
+        return dict(self._snapshot().peers)
 
     # --------- begin AbstractQueue --------
 
     def get_job(self) -> Optional[JobView]:
-        # Override to ensure the latest data is received
-        return self.get_job_view(self.job_id)
+        if self.job_id is not None:
+            return self._snapshot().views.get(self.job_id)
 
     def get_set(self) -> Optional[SetView]:
         if self.job_id is not None and self.set_id is not None:
-            # Linear search through sets isn't efficient, but it works.
-            j = self.get_job_view(self.job_id)
-            for s in j.sets:
-                if s.id == self.set_id:
-                    return s
+            return self._snapshot().sets.get(self.set_id)
+
+    # Estimate used for jobs without print time metadata when planning
+    DEFAULT_PRINT_TIME = 60 * 60
+    # Seconds a job planned for another peer may stay unlocked before any
+    # idle peer takes it; see _plan()
+    PLAN_GRACE = 5 * 60
+
+    def _plan(self) -> list:
+        # Returns the jobs this printer should print in a plan shared with all
+        # other peers planning with Strategy.MIN_MAKESPAN, i.e. those
+        # publishing when they'll be free to print. Every peer plans from the
+        # same published state (including the free_at this printer last
+        # published, rather than the local clock) so they arrive at the same
+        # plan.
+        snap = self._snapshot()
+        profiles = {}
+        peers = {}
+        for addr, p in snap.peers.items():
+            if addr == self.addr or p.get("free_at") is None:
+                continue
+            profiles[addr] = p.get("profile") or dict(name="")
+            peers[addr] = p["free_at"]
+        own = (self._published or dict()).get("free_at")
+        if own is not None:
+            profiles[self.addr] = self._profile
+            peers[self.addr] = own
+
+        jobs = []
+        for data in snap.jobs:
+            if snap.locks.get(data["id"]) not in (None, self.addr):
+                continue
+            job = snap.views[data["id"]]
+            if job.draft or job.remaining == 0:
+                continue
+            est = job.remaining_print_time(default=self.DEFAULT_PRINT_TIME)
+            jobs.append((job, max(est, 1)))
+
+        bits = dict((peer, profile_bit(p["name"])) for peer, p in profiles.items())
+
+        def compatible(job, peer):
+            return any(s.matches_profile(bits[peer]) for s in job.sets)
+
+        mine = plan_lpt(jobs, peers, compatible).get(self.addr, [])
+
+        # A job planned for a peer that doesn't take it (e.g. it's paused or
+        # out of filament) is left to any idle peer once it's been unlocked
+        # for PLAN_GRACE seconds.
+        now = self._clock()
+        with self._unlocked_lock:
+            since = dict(
+                (job.id, self._unlocked_since.get(job.id, now)) for job, _ in jobs
+            )
+            self._unlocked_since = since
+        overdue = []
+        own_bit = profile_bit(self._profile["name"])
+        for job, _ in jobs:
+            if (
+                job not in mine
+                and now - since[job.id] >= self.PLAN_GRACE
+                and any(s.matches_profile(own_bit) for s in job.sets)
+            ):
+                overdue.append(job)
+        return mine + overdue
 
     def _peek(self):
-        if self.lan is None or self.lan.q is None:
+        if not self._has_state():
+            return (None, None)
+        if self.strategy == Strategy.MIN_MAKESPAN:
+            for job in self._plan():
+                s = job.next_set(self._profile)
+                if s is not None:
+                    return (job, s)
             return (None, None)
-        for data in self._get_jobs():
-            acq = data.get("acquired_by_")
-            if acq is not None and acq != self.addr:
-                continue  # Acquired by somebody else, so don't consider for scheduling
-            job = LANJobView(data, self)
+        for job in self._snapshot().candidates:
             s = job.next_set(self._profile)
             if s is not None:
                 return (job, s)
@@ -167,21 +578,54 @@ class LANQueue(AbstractEditableQueue):
             return False
         (job, s) = self._peek()
         if job is not None and s is not None:
-            if self.lan.q.acquireJob(job.id):
-                self._logger.debug(f"acquire() candidate:\n{job}\n{s}")
-                self.job_id = job.id
-                self.set_id = s.id
-                self._logger.debug("acquire() success")
-                return True
-            else:
-                self._logger.debug("acquire() failed")
+            return self.acquire_candidate(job, s)
+        else:
+            return False
+
+    def candidates(self) -> list:
+        if not self._has_state():
+            return []
+        if self.strategy == Strategy.MIN_MAKESPAN:
+            # Other jobs are planned for other printers
+            jobs = self._plan()
+        else:
+            jobs = self._snapshot().candidates
+        result = []
+        for job in jobs:
+            # Only the job that's acquired is decremented to get its next set
+            s = job.peek_set(self._profile)
+            if s is not None:
+                result.append((job, s))
+                if self.strategy == Strategy.MIN_MAKESPAN:
+                    break
+        return result
+
+    def acquire_candidate(self, job, s) -> bool:
+        if self.lan is None or self.lan.q is None:
+            return False
+        if self._stored_snapshot() is not None:
+            return False  # Saved state is read-only
+        if self.lan.q.acquireJob(job.id):
+            self._invalidate_snapshot()
+            s = job.next_set(self._profile)
+            self._logger.debug(f"acquire() candidate:\n{job}\n{s}")
+            if s is None:
+                self.lan.q.releaseJob(job.id)
+                self._invalidate_snapshot()
+                self._logger.debug("acquire() failed; no printable set")
                 return False
+            self.job_id = job.id
+            self.set_id = s.id
+            self._logger.debug("acquire() success")
+            return True
         else:
+            self._logger.debug("acquire() failed")
             return False
 
     def release(self) -> None:
         if self.job_id is not None:
             self.lan.q.releaseJob(self.job_id)
+            self._invalidate_snapshot()
             self.job_id = None
             self.set_id = None
 
@@ -208,7 +652,7 @@ class LANQueue(AbstractEditableQueue):
     def as_dict(self) -> dict:
         jobs = []
         peers = {}
-        if self.lan.q is not None:
+        if self._has_state():
             jobs = self._get_jobs()
             peers = self._get_peers()
             for j in jobs:
@@ -222,10 +666,13 @@ class LANQueue(AbstractEditableQueue):
                 jobs=jobs,
                 peers=peers,
                 active_set=self._active_set(),
+                provisional=self._provisional is not None,
             )
         )
 
     def reset_jobs(self, job_ids) -> dict:
+        if self._stored_snapshot() is not None:
+            return  # Saved state is read-only
         for jid in job_ids:
             j = self._get_job(jid)
             if j is None:
@@ -236,12 +683,16 @@ class LANQueue(AbstractEditableQueue):
                 s["remaining"] = s["count"]
                 s["completed"] = 0
             self.lan.q.setJob(jid, j, addr=j["peer_"])
+        self._invalidate_snapshot()
 
     def remove_jobs(self, job_ids) -> dict:
+        if self._stored_snapshot() is not None:
+            return dict(jobs_deleted=0)  # Saved state is read-only
         n = 0
         for jid in job_ids:
             if self.lan.q.removeJob(jid) is not None:
                 n += 1
+        self._invalidate_snapshot()
         return dict(jobs_deleted=n)
 
     # --------- end AbstractQueue ------
@@ -249,6 +700,9 @@ class LANQueue(AbstractEditableQueue):
     # --------- AbstractEditableQueue implementation ------
 
     def get_job_view(self, job_id):
+        if self._stored_snapshot() is not None:
+            # Views are for editing, and saved state is read-only
+            raise ValidationError(f"{self.ns} is still connecting; try again shortly")
         j = self._get_job(job_id)
         if j is not None:
             return LANJobView(j, self)
@@ -261,17 +715,23 @@ class LANQueue(AbstractEditableQueue):
         manifest = j.as_dict()
         if manifest.get("created") is None:
             manifest["created"] = int(time.time())
-        # Note: post mutates manifest by stripping fields
-        manifest["hash"] = self._fileshare.post(manifest, filepaths)
+        # Set files are published individually by content hash, so files
+        # unchanged by an edit aren't copied or fetched again.
+        # Note: post_blobs mutates manifest by stripping fields
+        for sha in self._fileshare.post_blobs(manifest, filepaths):
+            self._touch(blob_key(sha))
         manifest["id"] = jid if jid is not None else self._gen_uuid()
 
         # Propagate peer if importing from a LANJobView
         # But don't fail with AttributeError if it's just a JobView
         self.lan.q.setJob(manifest["id"], manifest, addr=getattr(j, "peer", None))
+        self._invalidate_snapshot()
         return manifest["id"]
 
     def mv_job(self, job_id, after_id):
         self.lan.q.jobs.mv(job_id, after_id)
+        self._invalidate_snapshot()  # Reordering doesn't trigger _on_update
+        self._schedule_save()
 
     def _path_exists(self, fullpath):
         return Path(fullpath).exists()
@@ -307,14 +767,17 @@ class LANQueue(AbstractEditableQueue):
         raise Exception("UUID generation failed - too many ID collisions")
 
     def edit_job(self, job_id, data) -> bool:
-        # For lan queues, "editing" a job is basically resubmission of the whole thing.
-        # This is because the backing .gjob format is a single file containing the full manifest.
+        # For lan queues, "editing" a job is resubmission of its manifest. Set
+        # files are content-addressed, so only changed files are re-published.
 
         j = self.get_job_view(job_id)
         for k, v in data.items():
             if k in ("id", "peer_", "queue"):
                 continue
             if k == "sets":
+                # Edits from the UI don't include each set's blob hash
+                blobs = dict([(s.id, s.blob) for s in j.sets])
+                v = [{"blob": blobs.get(s.get("id")), **s} for s in v]
                 j.updateSets(
                     v
                 )  # Set data must be translated into views, done by updateSets()
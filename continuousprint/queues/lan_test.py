@@ -1,7 +1,10 @@
 import unittest
 import logging
 import tempfile
+import threading
+import zipfile
 from datetime import datetime
+from pathlib import Path
 from unittest.mock import MagicMock
 from .abstract import Strategy
 from .abstract_test import (
@@ -9,8 +12,9 @@ from .abstract_test import (
     EditableQueueTests,
     testJob as makeAbstractTestJob,
 )
-from .lan import LANQueue, ValidationError
+from .lan import LANQueue, ValidationError, plan_lpt
 from ..storage.database import JobView, SetView
+from peerprint.lan_queue import ChangeType
 from peerprint.lan_queue_test import LANQueueLocalTest as PeerPrintLANTest
 
 # logging.basicConfig(level=logging.DEBUG)
@@ -54,12 +58,477 @@ class TestAbstractImpl(AbstractQueueTests, LANQueueTest):
 class TestEditableImpl(EditableQueueTests, LANQueueTest):
     def setUp(self):
         LANQueueTest.setUp(self)
+        td = tempfile.TemporaryDirectory()
+        self.addCleanup(td.cleanup)
+        gjob = Path(td.name) / "hash.gjob"
+        with zipfile.ZipFile(gjob, "w") as zf:
+            for i in [*range(EditableQueueTests.NUM_TEST_JOBS), 100]:
+                zf.writestr(f"set{i}.gcode", "")
+        self.fs.fetch.return_value = gjob
         self.jids = [
             self.q.import_job_from_view(makeAbstractTestJob(i))
             for i in range(EditableQueueTests.NUM_TEST_JOBS)
         ]
 
 
+class TestViewCache(LANQueueTest):
+    def setUp(self):
+        super().setUp()
+        self.jid = self.q.import_job_from_view(makeAbstractTestJob(0))
+        self.assertTrue(self.q.acquire())
+        self.q.lan.q.getJobs = MagicMock(wraps=self.q.lan.q.getJobs)
+
+    def test_get_set_cached(self):
+        s = self.q.get_set()
+        self.assertEqual(s.id, self.q.set_id)
+        self.assertIs(self.q.get_set(), s)
+        self.assertIs(self.q.get_job(), s.job)
+        self.assertEqual(self.q._active_set(), s.id)
+        self.q.lan.q.getJobs.assert_called_once()
+
+    def test_invalidated_on_update(self):
+        from peerprint.lan_queue import ChangeType
+
+        s = self.q.get_set()
+        for ct in (ChangeType.JOB, ChangeType.LOCK, ChangeType.QUEUE):
+            self.q._on_update(ct, None, None)
+            s2 = self.q.get_set()
+            self.assertIsNot(s2, s)
+            s = s2
+        self.q._on_update(ChangeType.PEER, None, None)
+        self.assertIs(self.q.get_set(), s)
+
+    def test_invalidated_on_decrement(self):
+        s = self.q.get_set()
+        self.q.decrement()
+        self.assertIsNot(self.q.get_set(), s)
+        self.assertEqual(self.q.get_set().completed, 1)
+
+    def test_get_job_view_not_shared(self):
+        self.assertIsNot(self.q.get_job_view(self.jid), self.q.get_job())
+
+
+class TestSnapshot(LANQueueTest):
+    def setUp(self):
+        super().setUp()
+        self.q.lan = MagicMock()
+
+        def job(jid, draft=False, remaining=1, profiles=["profile"]):
+            return (
+                jid,
+                (
+                    "peer",
+                    dict(
+                        id=jid,
+                        draft=draft,
+                        count=1,
+                        remaining=remaining,
+                        sets=[dict(path="a.gcode", count=1, profiles=profiles)],
+                    ),
+                ),
+            )
+
+        self.q.lan.q.getJobs.return_value = [
+            job("locked_other"),
+            job("locked_me"),
+            job("unlocked"),
+            job("draft", draft=True),
+            job("done", remaining=0),
+            job("other_profile", profiles=["other"]),
+        ]
+        self.q.lan.q.getLocks.return_value = {
+            "locked_other": "peer2",
+            "locked_me": self.q.addr,
+            "draft": "peer2",
+        }
+        self.q.lan.q.getPeers.return_value = {
+            "peer2": dict(name="p2"),
+            self.q.addr: dict(name="me"),
+        }
+
+    def test_candidates(self):
+        self.assertEqual(
+            [j.id for j in self.q._snapshot().candidates], ["locked_me", "unlocked"]
+        )
+        (job, s) = self.q._peek()
+        self.assertEqual((job.id, s.id), ("locked_me", "locked_me_0"))
+
+    def test_candidates_not_decremented(self):
+        m = self.q.lan.q.getJobs.return_value[2][1][1]
+        m["remaining"] = 2
+        m["sets"][0]["remaining"] = 0  # Job needs decrementing for its next set
+        got = self.q.candidates()
+        self.assertEqual([(j.id, s.id) for j, s in got][-1], ("unlocked", "unlocked_0"))
+        self.q.lan.q.setJob.assert_not_called()
+
+        # Only the acquired job is decremented
+        self.q.lan.q.acquireJob.return_value = True
+        self.assertTrue(self.q.acquire_candidate(*got[-1]))
+        self.assertEqual(
+            set(c[0][0] for c in self.q.lan.q.setJob.call_args_list), {"unlocked"}
+        )
+        self.assertEqual(self.q.lan.q.setJob.call_args[0][1]["remaining"], 1)
+        self.assertEqual(self.q.set_id, "unlocked_0")
+
+    def test_peers_keep_all_locks(self):
+        self.assertEqual(
+            self.q._get_peers()["peer2"]["acquired"], ["locked_other", "draft"]
+        )
+        self.assertEqual(self.q._get_peers()[self.q.addr]["acquired"], ["locked_me"])
+
+    def test_prefetch_targets(self):
+        for jid, (_, m) in self.q.lan.q.getJobs.return_value:
+            m["hash"] = f"hash_{jid}"
+        self.q.lan.q.getPeers.return_value["peer"] = dict(fs_addr="peer_fs")
+        self.assertEqual(
+            self.q.prefetch_targets(2),
+            [("peer_fs", "hash_locked_me"), ("peer_fs", "hash_unlocked")],
+        )
+        self.assertEqual(self.q.prefetch_targets(1), [("peer_fs", "hash_locked_me")])
+        self.assertEqual(self.q.prefetch_targets(0), [])
+
+    def test_prefetch_targets_blobs(self):
+        m = self.q.lan.q.getJobs.return_value[1][1][1]
+        m["sets"][0]["blob"] = "s1"
+        self.q.lan.q.getPeers.return_value["peer"] = dict(fs_addr="peer_fs")
+        self.assertEqual(self.q.prefetch_targets(1), [("peer_fs", "blobs/s1/a.gcode")])
+
+    def test_prefetch_targets_skips_own_jobs(self):
+        for jid, (_, m) in self.q.lan.q.getJobs.return_value:
+            m["hash"] = f"hash_{jid}"
+        self.q.lan.q.getPeers.return_value["peer"] = dict(fs_addr="peer_fs")
+        self.q.addr = "peer"
+        self.assertEqual(self.q.prefetch_targets(2), [])
+
+    def test_rebuilt_only_on_change(self):
+        from peerprint.lan_queue import ChangeType
+
+        snap = self.q._snapshot()
+        self.q._get_jobs()
+        self.q._peek()
+        self.assertIs(self.q._snapshot(), snap)
+        self.q.lan.q.getJobs.assert_called_once()
+
+        # Peer changes refresh peers without rebuilding jobs
+        self.q._get_peers()
+        self.q._on_update(ChangeType.PEER, None, dict(status="changed"))
+        self.assertIs(self.q._snapshot().views, snap.views)
+        self.q._get_peers()
+        self.assertEqual(self.q.lan.q.getPeers.call_count, 2)
+
+        self.q._on_update(ChangeType.LOCK, None, None)
+        self.assertIsNot(self.q._snapshot().views, snap.views)
+        self.assertEqual(self.q.lan.q.getJobs.call_count, 2)
+
+
+class TestPlanLPT(unittest.TestCase):
+    def test_longest_first_to_earliest_free(self):
+        jobs = [("short1", 1), ("long", 20), ("short2", 1), ("short3", 1)]
+        plan = plan_lpt(jobs, dict(a=0, b=0, c=5), lambda j, p: True)
+        self.assertEqual(plan, dict(a=["long"], b=["short1", "short2", "short3"], c=[]))
+
+    def test_busy_peer_gets_work_after_free(self):
+        jobs = [("j1", 10), ("j2", 10), ("j3", 10)]
+        plan = plan_lpt(jobs, dict(a=0, b=15), lambda j, p: True)
+        self.assertEqual(plan, dict(a=["j1", "j2"], b=["j3"]))
+
+    def test_compatibility(self):
+        jobs = [("j1", 10), ("j2", 5), ("j3", 1)]
+        plan = plan_lpt(jobs, dict(a=0, b=0), lambda j, p: j != "j1" or p == "b")
+        self.assertEqual(plan, dict(a=["j2", "j3"], b=["j1"]))
+
+    def test_incompatible_unassigned(self):
+        plan = plan_lpt([("j1", 10)], dict(a=0), lambda j, p: False)
+        self.assertEqual(plan, dict(a=[]))
+
+
+class TestMinMakespan(LANQueueTest):
+    def setUp(self):
+        super().setUp()
+        self.q.strategy = Strategy.MIN_MAKESPAN
+        self.q.lan = MagicMock()
+        self.now = 1000
+
+        def job(jid, est):
+            meta = '{"estimatedPrintTime": %d}' % est if est is not None else None
+            return (
+                jid,
+                (
+                    "peer",
+                    dict(
+                        id=jid,
+                        count=1,
+                        sets=[
+                            dict(
+                                path="a.gcode",
+                                count=1,
+                                profiles=["profile"],
+                                metadata=meta,
+                            )
+                        ],
+                    ),
+                ),
+            )
+
+        self.q.lan.q.getJobs.return_value = [
+            job("short", 60),
+            job("long", 20 * 60 * 60),
+            job("unknown", None),
+        ]
+        self.q.lan.q.getLocks.return_value = {}
+        self.q.lan.q.getPeers.return_value = {
+            "peer2": dict(profile=dict(name="profile"), free_at=self.now),
+            "peer3": dict(profile=dict(name="profile"), free_at=None),  # Not planning
+        }
+        self.q._published = dict(free_at=self.now)
+        self.q._published_at = 0
+        self.clock = 0
+        self.q._clock = lambda: self.clock
+
+    def test_idle_peer_takes_longest(self):
+        # Ties (both free now) go to the lowest address
+        self.q.addr = "a_first"
+        self.assertEqual([j.id for j in self.q._plan()], ["long"])
+        self.q._invalidate_snapshot()
+        self.q.addr = "z_last"
+        self.assertEqual([j.id for j in self.q._plan()], ["unknown", "short"])
+
+    def test_plans_from_published_free_at(self):
+        # Our own entry is what we last published (as other peers see it),
+        # not the current time, and peers' past free_at isn't clamped to now
+        self.q.addr = "z_last"
+        self.q._published = dict(free_at=self.now - 10)
+        self.assertEqual([j.id for j in self.q._plan()], ["long"])
+        self.q._invalidate_snapshot()
+        self.q.lan.q.getPeers.return_value["z_last"] = dict(
+            profile=dict(name="profile"), free_at=self.now + 10**6
+        )
+        self.assertEqual([j.id for j in self.q._plan()], ["long"])
+
+    def test_not_published_plans_nothing(self):
+        self.q._published = None
+        self.assertEqual(self.q._plan(), [])
+
+    def test_overdue_jobs_taken_by_anyone(self):
+        self.q.addr = "z_last"
+        self.assertEqual([j.id for j in self.q._plan()], ["unknown", "short"])
+        self.clock = self.q.PLAN_GRACE - 1
+        self.assertEqual([j.id for j in self.q._plan()], ["unknown", "short"])
+        self.clock = self.q.PLAN_GRACE
+        self.assertEqual([j.id for j in self.q._plan()], ["unknown", "short", "long"])
+
+        # Locking resets the grace period
+        self.q.lan.q.getLocks.return_value = {"long": "peer2"}
+        self.q._invalidate_snapshot()
+        self.q._plan()
+        self.q.lan.q.getLocks.return_value = {}
+        self.q._invalidate_snapshot()
+        self.assertEqual([j.id for j in self.q._plan()], ["unknown", "short"])
+
+    def test_plan_from_multiple_threads(self):
+        # The driver and prefetcher both plan
+        errors = []
+
+        def plan():
+            try:
+                for _ in range(200):
+                    self.q._plan()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=plan) for _ in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(timeout=10)
+        self.assertEqual(errors, [])
+        self.assertEqual(
+            set(self.q._unlocked_since.keys()), set(["short", "long", "unknown"])
+        )
+
+    def test_busy_peer_leaves_work(self):
+        self.q.lan.q.getPeers.return_value["peer2"]["free_at"] = self.now + 10**6
+        (job, s) = self.q._peek()
+        self.assertEqual(job.id, "long")
+        self.assertEqual([j.id for j, s in self.q.candidates()], ["long"])
+
+    def test_locked_jobs_excluded(self):
+        self.q.lan.q.getLocks.return_value = {"long": "peer2"}
+        self.q.addr = "z_last"
+        self.assertEqual([j.id for j in self.q._plan()], ["short"])
+
+    def test_update_peer_state_publishes_free_at(self):
+        self.q.update_peer_state("name", "IDLE", None, dict(name="profile"), 1234)
+        self.assertEqual(self.q.lan.q.syncPeer.call_args[0][0]["free_at"], 1234)
+
+
+class TestPeerStatePublication(LANQueueTest):
+    def setUp(self):
+        super().setUp()
+        self.q.lan = MagicMock()
+        self.q.lan.q.getJobs.return_value = []
+        self.q.lan.q.getLocks.return_value = {}
+        self.now = 100
+        self.q._clock = lambda: self.now
+
+    def update(self, status="IDLE", free_at=None):
+        self.q.update_peer_state("name", status, None, dict(name="profile"), free_at)
+
+    def test_unchanged_suppressed(self):
+        self.update()
+        self.update()
+        self.assertEqual(self.q.lan.q.syncPeer.call_count, 1)
+        self.assertEqual(self.q.peer_state_counts, dict(published=1, suppressed=1))
+
+    def test_change_published(self):
+        self.update()
+        self.update(status="PRINTING")
+        self.assertEqual(self.q.lan.q.syncPeer.call_count, 2)
+        self.assertEqual(self.q.lan.q.syncPeer.call_args[0][0]["status"], "PRINTING")
+
+    def test_heartbeat(self):
+        self.update()
+        self.now += LANQueue.PEER_HEARTBEAT - 1
+        self.update()
+        self.assertEqual(self.q.lan.q.syncPeer.call_count, 1)
+        self.now += 1
+        self.update()
+        self.assertEqual(self.q.lan.q.syncPeer.call_count, 2)
+
+    def test_free_at_tolerance(self):
+        self.update(free_at=1000)
+        self.update(free_at=1000 + LANQueue.FREE_AT_TOLERANCE - 1)
+        self.assertEqual(self.q.lan.q.syncPeer.call_count, 1)
+        self.update(free_at=1000 + LANQueue.FREE_AT_TOLERANCE)
+        self.assertEqual(self.q.lan.q.syncPeer.call_count, 2)
+        self.update(free_at=None)  # No longer taking jobs
+        self.assertEqual(self.q.lan.q.syncPeer.call_count, 3)
+
+    def test_republished_after_reconnect(self):
+        self.update()
+        self.q.connect()
+        self.update()
+        self.assertEqual(self.q.lan.q.syncPeer.call_count, 2)
+
+
+class TestSavedState(unittest.TestCase):
+    def setUp(self):
+        td = tempfile.TemporaryDirectory()
+        self.addCleanup(td.cleanup)
+        self.path = f"{td.name}/state.json"
+        self.timer_cls = MagicMock()
+        self.jobs = [
+            (
+                "j1",
+                (
+                    "peer2",
+                    dict(
+                        id="j1",
+                        name="job",
+                        count=1,
+                        sets=[dict(path="a.gcode", count=1, profiles=["profile"])],
+                    ),
+                ),
+            )
+        ]
+        self.locks = {"j1": "peer2"}
+
+    def make(self):
+        q = LANQueue(
+            "ns",
+            "localhost:1234",
+            logging.getLogger(),
+            Strategy.IN_ORDER,
+            MagicMock(),
+            MagicMock(),
+            dict(name="profile"),
+            lambda path, sd: path,
+            state_path=self.path,
+            timer_cls=self.timer_cls,
+        )
+        q.lan = MagicMock()
+        q.lan.q.getJobs.return_value = self.jobs
+        q.lan.q.getLocks.return_value = self.locks
+        q.lan.q.getPeers.return_value = {"peer2": dict(name="p2")}
+        return q
+
+    def save(self):
+        q = self.make()
+        q._on_update(ChangeType.JOB, None, None)
+        self.timer_cls.assert_called_with(LANQueue.SAVE_DELAY, q._save_state)
+        self.timer_cls.return_value.start.assert_called()
+        q._save_state()
+
+    def test_save_debounced(self):
+        q = self.make()
+        q._on_update(ChangeType.JOB, None, None)
+        q._on_update(ChangeType.LOCK, None, None)
+        self.assertEqual(self.timer_cls.call_count, 1)
+
+    def test_peer_changes_not_saved(self):
+        q = self.make()
+        q._on_update(ChangeType.PEER, None, None)
+        self.timer_cls.assert_not_called()
+
+    def test_not_saved_before_ready(self):
+        q = self.make()
+        q.lan.q.is_ready.return_value = False
+        q._save_state()
+        with self.assertRaises(FileNotFoundError):
+            open(self.path)
+
+    def test_load_provisional(self):
+        self.save()
+        q = self.make()
+        q.lan.q = None  # Not yet connected
+        d = q.as_dict()
+        self.assertEqual(d["provisional"], True)
+        self.assertEqual([j["id"] for j in d["jobs"]], ["j1"])
+        self.assertEqual(d["jobs"][0]["acquired_by_"], "peer2")
+        self.assertEqual(d["peers"]["peer2"]["acquired"], ["j1"])
+
+    def test_provisional_read_only(self):
+        self.locks = {}
+        self.save()
+        q = self.make()
+        q.lan.q.is_ready.return_value = False
+        self.assertEqual([j.id for j, s in q.candidates()], ["j1"])
+        self.assertFalse(q.acquire())
+        q.lan.q.acquireJob.assert_not_called()
+        self.assertEqual(q.remove_jobs(["j1"]), dict(jobs_deleted=0))
+        q.lan.q.removeJob.assert_not_called()
+        q.reset_jobs(["j1"])
+        q.lan.q.setJob.assert_not_called()
+        with self.assertRaises(ValidationError):
+            q.get_job_view("j1")
+        # Nothing is saved over the loaded state until the network is ready
+        q._save_state()
+        q.lan.q.getJobs.assert_not_called()
+
+    def test_reconciled_when_ready(self):
+        self.save()
+        q = self.make()
+        q.lan.q.is_ready.return_value = False
+        q.lan.q.getJobs.return_value = []
+        self.assertEqual(len(q._get_jobs()), 1)
+        q._on_update(ChangeType.QUEUE, False, True)
+        self.assertEqual(q._provisional, None)
+        self.assertEqual(q._get_jobs(), [])
+        self.assertEqual(q.as_dict()["provisional"], False)
+
+    def test_unreadable_state_ignored(self):
+        with open(self.path, "w") as f:
+            f.write("{not json")
+        q = self.make()
+        self.assertEqual(q._provisional, None)
+
+    def test_destroy_cancels_save(self):
+        q = self.make()
+        q._on_update(ChangeType.JOB, None, None)
+        q.destroy()
+        self.timer_cls.return_value.cancel.assert_called()
+
+
 class TestLANQueueNoConnection(LANQueueTest):
     def test_update_peer_state(self):
         self.q.update_peer_state("HI", {}, {}, {})  # No explosions? Good
@@ -79,14 +548,135 @@ class TestLANQueueConnected(LANQueueTest):
             "a": dict(fs_addr="123", profile=dict(name="abc")),
         }
 
-    def test_get_gjob_dirpath_failed_bad_peer(self):
+    def _gjob(self):
+        d = tempfile.TemporaryDirectory()
+        self.addCleanup(d.cleanup)
+        gjob = Path(d.name) / "hash.gjob"
+        with zipfile.ZipFile(gjob, "w") as zf:
+            zf.writestr("manifest.json", "{}")
+            zf.writestr("a.gcode", "a")
+            zf.writestr("b.gcode", "b")
+        self.fs.fetch.return_value = gjob
+        return Path(d.name)
+
+    def test_get_gjob_file_failed_bad_peer(self):
         with self.assertRaises(Exception):
-            self.q.get_gjob_dirpath("b", "hash")
+            self.q.get_gjob_file("b", "hash", "a.gcode")
+
+    def test_get_gjob_file(self):
+        d = self._gjob()
+        self.assertEqual(
+            self.q.get_gjob_file("a", "hash", "a.gcode"), d / "hash" / "a.gcode"
+        )
+        self.fs.fetch.assert_called_with("123", "hash")
+        self.assertEqual((d / "hash" / "a.gcode").read_text(), "a")
+        # Sets that weren't asked for aren't extracted
+        self.assertFalse((d / "hash" / "b.gcode").exists())
+
+    def test_get_gjob_file_touches_cache(self):
+        self._gjob()
+        self.q._fileshare_cache = MagicMock()
+        self.q.get_gjob_file("a", "hash", "a.gcode")
+        self.q._fileshare_cache.touch.assert_called_with("hash")
+
+    def test_get_gjob_file_waits_for_prefetch(self):
+        self._gjob()
+        self.q._prefetcher = MagicMock()
+        self.q.get_gjob_file("a", "hash", "a.gcode")
+        self.q._prefetcher.wait.assert_called_with("hash")
+
+    def test_get_blob_path(self):
+        self.q._fileshare_cache = MagicMock()
+        self.q._prefetcher = MagicMock()
+        self.fs.fetch_blob.return_value = "/blobs/s1/a.gcode"
+        self.assertEqual(
+            self.q.get_blob_path("a", "s1", "a.gcode"), "/blobs/s1/a.gcode"
+        )
+        self.fs.fetch_blob.assert_called_with("123", "s1", "a.gcode")
+        self.q._prefetcher.wait.assert_called_with("blobs/s1/a.gcode")
+        self.q._fileshare_cache.touch.assert_called_with("blobs/s1")
+
+    def test_get_blob_path_failed_bad_peer(self):
+        with self.assertRaises(ValidationError):
+            self.q.get_blob_path("b", "s1", "a.gcode")
+
+    def test_pinned_blobs(self):
+        self.q.lan.q.getJobs.return_value = [
+            (
+                "j1",
+                (
+                    "localhost:1234",
+                    dict(id="j1", sets=[dict(path="a.gcode", count=1, blob="s1")]),
+                ),
+            ),  # Hosted by us
+            (
+                "j2",
+                (
+                    "peer2",
+                    dict(id="j2", sets=[dict(path="b.gcode", count=1, blob="s2")]),
+                ),
+            ),
+        ]
+        self.q.lan.q.getLocks.return_value = {}
+        self.assertEqual(self.q.pinned_hashes(), set(["blobs/s1"]))
 
-    def test_get_gjob_dirpath(self):
-        self.fs.fetch.return_value = "/dir/"
-        self.assertEqual(self.q.get_gjob_dirpath("a", "hash"), "/dir/")
-        self.fs.fetch.assert_called_with("123", "hash", unpack=True)
+    def test_import_posts_blobs(self):
+        self.q._fileshare_cache = MagicMock()
+        self.fs.post_blobs.return_value = ["s1"]
+        j = self._jbase()
+        j.sets[0].profile_keys = "abc"
+        jid = self.q.import_job_from_view(j)
+        (manifest, filepaths) = self.fs.post_blobs.call_args[0]
+        self.assertEqual(filepaths, {"a.gcode": "a.gcode"})
+        self.q._fileshare_cache.touch.assert_called_with("blobs/s1")
+        self.fs.post.assert_not_called()
+        self.q.lan.q.setJob.assert_called_with(jid, manifest, addr=None)
+
+    def test_edit_keeps_blobs(self):
+        self.q.lan.q.getJobs.return_value = [
+            (
+                "j1",
+                (
+                    "a",
+                    dict(
+                        id="j1",
+                        name="old",
+                        count=1,
+                        sets=[
+                            dict(path="a.gcode", count=1, profiles=["abc"], blob="s1")
+                        ],
+                    ),
+                ),
+            ),
+        ]
+        self.q.lan.q.getJob.return_value = self.q.lan.q.getJobs.return_value[0][1]
+        self.q.lan.q.getLocks.return_value = {}
+        self.fs.fetch_blob.return_value = "/fs/blobs/s1/a.gcode"
+        self.q.edit_job(
+            "j1",
+            dict(
+                name="new",
+                sets=[dict(id="j1_0", path="a.gcode", count=2, profiles=["abc"])],
+            ),
+        )
+        self.fs.fetch_blob.assert_called_with("123", "s1", "a.gcode")
+        (manifest, filepaths) = self.fs.post_blobs.call_args[0]
+        self.assertEqual(manifest["name"], "new")
+        self.assertEqual(manifest["sets"][0]["blob"], "s1")
+        self.assertEqual(filepaths, {"/fs/blobs/s1/a.gcode": "/fs/blobs/s1/a.gcode"})
+
+    def test_pinned_hashes(self):
+        self.q.lan.q.getJobs.return_value = [
+            (
+                "j1",
+                ("localhost:1234", dict(id="j1", hash="a", sets=[])),
+            ),  # Hosted by us
+            ("j2", ("peer2", dict(id="j2", hash="b", sets=[]))),  # Acquired by us
+            ("j3", ("peer2", dict(id="j3", hash="c", sets=[]))),  # Acquired by peer
+            ("j4", ("peer2", dict(id="j4", hash="d", sets=[]))),
+        ]
+        self.q.lan.q.getLocks.return_value = {"j2": "localhost:1234", "j3": "peer2"}
+        self.assertEqual(self.q.pinned_hashes(), set(["a", "b"]))
 
     def _jbase(self, path="a.gcode"):
         j = JobView()
@@ -103,6 +693,7 @@ class TestLANQueueConnected(LANQueueTest):
         s.profile_keys = ""
         s.rank = 1
         s.material_keys = ""
+        s.metadata = None
         j.sets = [s]
         j.count = 1
         j.draft = False
@@ -117,19 +708,19 @@ class TestLANQueueConnected(LANQueueTest):
         self.q._path_exists = lambda p: False  # Override path check for validation
         with self.assertRaisesRegex(ValidationError, "file not found"):
             self.q.import_job_from_view(j)
-        self.fs.post.assert_not_called()
+        self.fs.post_blobs.assert_not_called()
 
     def test_validation_no_profile(self):
         with self.assertRaisesRegex(ValidationError, "no assigned profile"):
             self.q.import_job_from_view(self._jbase())
-        self.fs.post.assert_not_called()
+        self.fs.post_blobs.assert_not_called()
 
     def test_validation_no_match(self):
         j = self._jbase()
         j.sets[0].profile_keys = "def"
         with self.assertRaisesRegex(ValidationError, "no match for set"):
             self.q.import_job_from_view(j)
-        self.fs.post.assert_not_called()
+        self.fs.post_blobs.assert_not_called()
 
 
 class TestLANQueueWithJob(LANQueueTest):
@@ -3,12 +3,16 @@ import tempfile
 import shutil
 import os
 from ..storage.database import JobView, SetView
-from peerprint.filesharing import pack_job, unpack_job, packed_name
+from peerprint.filesharing import pack_job, packed_name
+from ..gjob import extract_members, read_manifest
 from pathlib import Path
 import dataclasses
 
 
 class LocalQueue(AbstractFactoryQueue):
+    # Files of imported .gjob archives are decompressed this many at a time
+    EXTRACT_WORKERS = 4
+
     def __init__(
         self,
         queries,
@@ -58,6 +62,27 @@ class LocalQueue(AbstractFactoryQueue):
             return True
         return False
 
+    def candidates(self) -> list:
+        result = []
+        for job in self.queries.getJobsAndSets(self.ns):
+            # Only the job that's acquired is decremented to get its next set
+            s = job.peek_set(self._profile, self._set_path_exists)
+            if s is not None:
+                result.append((job, s))
+        return result
+
+    def acquire_candidate(self, job, s) -> bool:
+        if self.job is not None:
+            return True
+        if self.queries.acquireJob(job):
+            self.job = self.queries.getJob(job.id)  # Refetch job to get acquired state
+            self.set = self.job.next_set(self._profile, self._set_path_exists)
+            if self.set is None:
+                self.release()
+                return False
+            return True
+        return False
+
     def release(self) -> None:
         if self.job is not None:
             self.queries.releaseJob(self.job)
@@ -111,16 +136,21 @@ class LocalQueue(AbstractFactoryQueue):
     def get_job_view(self, job_id):
         return self.queries.getJob(job_id)
 
-    def import_job_from_view(self, v, copy_fn=shutil.copytree):
+    def import_job_from_view(self, v, copy_fn=shutil.copyfile):
         manifest = v.as_dict()
 
         # If importing from a non-local queue, we must also fetch/import the files so they're available locally.
-        if hasattr(v, "get_base_dir"):
+        if hasattr(v, "peer"):
             dest_dir = f'ContinuousPrint/imports/{manifest["name"]}_{manifest["id"]}'
-            gjob_dir = v.get_base_dir()
-            copy_fn(gjob_dir, self._path_on_disk(dest_dir, False))
+            os.makedirs(self._path_on_disk(dest_dir, False), exist_ok=True)
+            for sv in v.sets:
+                copy_fn(
+                    sv.resolve(),
+                    self._path_on_disk(os.path.join(dest_dir, sv.path), False),
+                )
             for s in manifest["sets"]:
                 s["path"] = os.path.join(dest_dir, s["path"])
+                s.pop("blob", None)
 
         # TODO make transaction, move to storage/queries.py
         j = self.add_job()
@@ -150,12 +180,24 @@ class LocalQueue(AbstractFactoryQueue):
     def add_set(self, job_id, data) -> SetView:
         return self.queries.appendSet(self.ns, job_id, data)
 
+    def add_sets(self, items) -> list:
+        # Adds (job_id, data) items as with add_set(), in a single transaction
+        return self.queries.appendSets(self.ns, items)
+
     def import_job(self, gjob_path: str, draft=True) -> dict:
         out_dir = str(Path(gjob_path).stem)
         self._mkdir(out_dir)
-        manifest, filepaths = unpack_job(
-            self._path_on_disk(gjob_path, sd=False),
+        src = self._path_on_disk(gjob_path, sd=False)
+        manifest = read_manifest(src)
+        # Only files used by the job's sets are extracted from the archive.
+        # Unlike LAN .gjob jobs, they're all extracted now rather than when
+        # each set is printed, as local sets reference files in storage.
+        paths = [st["path"] for st in manifest["sets"]]
+        extract_members(
+            src,
+            paths,
             self._path_on_disk(out_dir, sd=False),
+            workers=self.EXTRACT_WORKERS,
         )
         return self.queries.importJob(self.ns, manifest, out_dir, draft)
 
@@ -1,5 +1,9 @@
 import unittest
 import logging
+import tempfile
+import zipfile
+import json
+from pathlib import Path
 from ..storage.database_test import QueuesDBTest
 from ..storage import queries
 from ..storage.lan import LANJobView
@@ -81,14 +85,44 @@ class TestLocalQueueImportFromLAN(unittest.TestCase):
             hash="foo",
             peer_="addr",
         )
-        cp = MagicMock()
-        lq.get_gjob_dirpath.return_value = "gjob_dirpath"
-        self.q.import_job_from_view(LANJobView(manifest, lq), cp)
+        lq.get_gjob_file.return_value = "gjob_file"
+        with tempfile.TemporaryDirectory() as tdir:
+            self.q._path_on_disk = lambda p, sd: str(Path(tdir) / p)
+            cp = MagicMock()
+            self.q.import_job_from_view(LANJobView(manifest, lq), cp)
+
+            wantdir = "ContinuousPrint/imports/test_job_123"
+            lq.get_gjob_file.assert_called_with("addr", "foo", "a.gcode")
+            cp.assert_called_with("gjob_file", str(Path(tdir) / wantdir / "a.gcode"))
+        _, args, _ = self.q.queries.appendSet.mock_calls[-1]
+        self.assertEqual(args[2]["path"], wantdir + "/a.gcode")
 
-        wantdir = "ContinuousPrint/imports/test_job_123"
-        cp.assert_called_with("gjob_dirpath", wantdir)
+    def testImportJobFromLANViewBlobs(self):
+        lq = MagicMock()
+        j = JobView()
+        j.id = "567"
+        j.save = MagicMock()
+        self.q.queries.newEmptyJob.return_value = j
+        manifest = dict(
+            name="test_job",
+            id="123",
+            sets=[dict(path="a.gcode", count=1, remaining=1, blob="s1")],
+            peer_="addr",
+        )
+        with tempfile.TemporaryDirectory() as tdir:
+            src = Path(tdir) / "blob.gcode"
+            src.write_text("G1")
+            lq.get_blob_path.return_value = str(src)
+            self.q._path_on_disk = lambda p, sd: str(Path(tdir) / p)
+            self.q.import_job_from_view(LANJobView(manifest, lq))
+
+            lq.get_gjob_file.assert_not_called()
+            lq.get_blob_path.assert_called_with("addr", "s1", "a.gcode")
+            wantdir = "ContinuousPrint/imports/test_job_123"
+            self.assertEqual((Path(tdir) / wantdir / "a.gcode").read_text(), "G1")
         _, args, _ = self.q.queries.appendSet.mock_calls[-1]
         self.assertEqual(args[2]["path"], wantdir + "/a.gcode")
+        self.assertNotIn("blob", args[2])
 
 
 class TestLocalQueueInOrderNoInitialJob(unittest.TestCase):
@@ -115,7 +149,32 @@ class TestLocalQueueInOrderNoInitialJob(unittest.TestCase):
         self.assertEqual(self.q.acquire(), False)
 
     def test_import_job(self):
-        self.skipTest("TODO")
+        with tempfile.TemporaryDirectory() as tdir:
+            self.q._path_on_disk = lambda p, sd: str(Path(tdir) / p)
+            self.q._mkdir = lambda p: (Path(tdir) / p).mkdir()
+            with zipfile.ZipFile(Path(tdir) / "job.gjob", "w") as zf:
+                zf.writestr(
+                    "manifest.json",
+                    json.dumps(
+                        dict(
+                            name="job",
+                            sets=[dict(path="a.gcode"), dict(path="b.gcode")],
+                        )
+                    ),
+                )
+                zf.writestr("a.gcode", "a")
+                zf.writestr("b.gcode", "b")
+                zf.writestr("unused.gcode", "c")
+            self.q.queries.importJob.return_value = "imported"
+
+            self.assertEqual(self.q.import_job("job.gjob"), "imported")
+            (ns, manifest, out_dir, draft) = self.q.queries.importJob.call_args[0]
+            self.assertEqual(out_dir, "job")
+            self.assertEqual(manifest["name"], "job")
+            self.assertEqual((Path(tdir) / "job/a.gcode").read_text(), "a")
+            self.assertEqual((Path(tdir) / "job/b.gcode").read_text(), "b")
+            # Files not referenced by any set aren't extracted
+            self.assertFalse((Path(tdir) / "job/unused.gcode").exists())
 
 
 class TestLocalQueueInOrderInitial(unittest.TestCase):
@@ -1,5 +1,8 @@
+import threading
+import time
 from typing import Optional
 from ..storage.database import Run, SetView
+from ..storage.keymask import material_mask, materials_missing, profile_bit
 from .abstract import AbstractQueue, Strategy
 import dataclasses
 
@@ -8,22 +11,59 @@ import dataclasses
 # Note that runs are implemented at this level and not lower queue levels,
 # so that history can be appropriately preserved for all queue types
 class MultiQueue(AbstractQueue):
-    def __init__(self, queries, strategy, update_cb):
+    def __init__(self, queries, strategy, update_cb, profile=None, materials_fn=None):
         super().__init__()
         self.queries = queries
         self.strategy = strategy
+        self._profile = profile
+        # Returns the material loaded in each tool (see SpoolManagerIntegration)
+        self._materials_fn = materials_fn
         self.queues = {}
+        self._lock = threading.Lock()
         self.run = None
         self.active_queue = None
         self.update_cb = update_cb
 
-    def update_peer_state(self, *args):
+    def update_peer_state(self, name, status, run, profile, active=True):
+        free_at = self.estimate_free_at() if active else None
         for q in self.queues.values():
             if hasattr(q, "update_peer_state"):
-                q.update_peer_state(*args)
-
-    def add(self, name: str, q: AbstractQueue):
-        self.queues[name] = q
+                q.update_peer_state(name, status, run, profile, free_at=free_at)
+
+    def estimate_free_at(self, now=None) -> int:
+        """Returns the (unix) time the printer is expected to finish its
+        current job, based on slicer estimates for its sets."""
+        if now is None:
+            now = time.time()
+        j = self.get_job()
+        if j is None:
+            return int(now)
+        work = j.remaining_print_time()
+        s = self.get_set()
+        if self.run is not None and s is not None:
+            # The current set's remaining count includes the print in progress
+            elapsed = now - self.run.start.timestamp()
+            work -= min(max(elapsed, 0), s.estimated_print_time() or 0)
+        return int(now + max(work, 0))
+
+    def add(self, name: str, q: AbstractQueue, order=None):
+        # Queues may be added from other threads (e.g. as LAN queues finish
+        # connecting), so self.queues is replaced rather than mutated to keep
+        # any in-progress iteration safe. If `order` (a list of queue names)
+        # is given, queues are kept sorted in that order.
+        with self._lock:
+            queues = dict(self.queues)
+            queues[name] = q
+            if order is not None:
+                queues = dict(
+                    sorted(
+                        queues.items(),
+                        key=lambda kv: order.index(kv[0])
+                        if kv[0] in order
+                        else len(order),
+                    )
+                )
+            self.queues = queues
 
     def get(self, name: str):
         return self.queues.get(name)
@@ -34,7 +74,10 @@ class MultiQueue(AbstractQueue):
             return
         if hasattr(q, "destroy"):
             q.destroy()
-        del self.queues[name]
+        with self._lock:
+            queues = dict(self.queues)
+            queues.pop(name, None)
+            self.queues = queues
 
     def get_job(self):
         if self.active_queue is not None:
@@ -74,18 +117,58 @@ class MultiQueue(AbstractQueue):
     # ---------- AbstractQueue Implementation -----------
 
     def acquire(self) -> bool:
-        if self.strategy != Strategy.IN_ORDER:
-            raise Exception("Unimplemented strategy " + self.strategy.name)
         if self.active_queue is not None:
             return True
-        for k, q in self.queues.items():
-            if q.acquire():
-                self.active_queue = q
-                self.run = self.queries.getActiveRun(
-                    self.active_queue.ns, self.get_job().name, self.get_set().path
-                )
-                return True
-        return False
+        if self.strategy == Strategy.IN_ORDER:
+            for k, q in self.queues.items():
+                if q.acquire():
+                    return self._activate(q)
+            return False
+        elif self.strategy == Strategy.LEAST_MANUAL:
+            # Try candidates cheapest first, as LAN jobs may be acquired by
+            # another printer before we get to them.
+            for (cost, q, job, s) in self._least_manual_candidates():
+                if q.acquire_candidate(job, s):
+                    return self._activate(q)
+            return False
+        raise Exception("Unimplemented strategy " + self.strategy.name)
+
+    def _activate(self, q) -> bool:
+        self.active_queue = q
+        self.run = self.queries.getActiveRun(
+            self.active_queue.ns, self.get_job().name, self.get_set().path
+        )
+        return True
+
+    def manual_cost(self, s: SetView, loaded: int, bit=None) -> tuple:
+        """Returns the cost of printing `s` next given the `loaded` material
+        mask, as (material changes, profile fit). Sets sliced specifically
+        for our profile are preferred over sets with no profile assigned.
+        `bit` is our profile's profile_bit(), if already looked up."""
+        if bit is None:
+            bit = 0 if self._profile is None else profile_bit(self._profile["name"])
+        fit = 0 if s.profile_mask() & bit else 1
+        return (materials_missing(s.material_mask(), loaded), fit)
+
+    def _least_manual_candidates(self) -> list:
+        loaded = 0
+        if self._materials_fn is not None:
+            loaded = material_mask(self._materials_fn())
+        bit = 0 if self._profile is None else profile_bit(self._profile["name"])
+        scored = []
+        # Queue and job order break ties, so this is IN_ORDER when
+        # there's nothing to choose between.
+        for qi, q in enumerate(self.queues.values()):
+            for ji, (job, s) in enumerate(q.candidates()):
+                scored.append(((self.manual_cost(s, loaded, bit), qi, ji), q, job, s))
+        scored.sort(key=lambda c: c[0])
+        return [(key[0], q, job, s) for (key, q, job, s) in scored]
+
+    def candidates(self) -> list:
+        raise Exception("Call contained queue for candidates")
+
+    def acquire_candidate(self, job, s) -> bool:
+        raise Exception("Call contained queue to acquire candidates")
 
     def release(self) -> None:
         if self.active_queue is not None:
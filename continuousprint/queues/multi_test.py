@@ -1,8 +1,9 @@
 import unittest
 import logging
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, ANY
 from .abstract import Strategy
 from .multi import MultiQueue
+from ..storage.database import SetView
 
 # logging.basicConfig(level=logging.DEBUG)
 
@@ -14,6 +15,18 @@ class TestMultiQueue(unittest.TestCase):
 
         self.q = MultiQueue(MagicMock(), Strategy.IN_ORDER, onupdate)
 
+    def test_add_ordered(self):
+        for name in ("c", "a", "b"):
+            self.q.add(name, MagicMock(), order=["a", "b", "c"])
+        self.assertEqual(list(self.q.queues.keys()), ["a", "b", "c"])
+
+    def test_add_remove_during_iteration(self):
+        self.q.add("a", MagicMock())
+        for name in self.q.queues.keys():
+            self.q.add("b", MagicMock())
+            self.q.remove("a")
+        self.assertEqual(list(self.q.queues.keys()), ["b"])
+
     def test_begin_run(self):
         self.q.active_queue = MagicMock()
         self.q.begin_run()
@@ -45,3 +58,103 @@ class TestMultiQueue(unittest.TestCase):
         self.q.end_run("result")
         self.q.queries.endRun.assert_called()
         self.q.queries.release.assert_not_called()
+
+
+class TestPeerState(unittest.TestCase):
+    def setUp(self):
+        self.q = MultiQueue(MagicMock(), Strategy.IN_ORDER, lambda: None)
+        self.lq = MagicMock()
+        self.q.add("lan", self.lq)
+
+    def test_free_when_idle(self):
+        self.assertEqual(self.q.estimate_free_at(now=100.5), 100)
+
+    def test_free_after_job(self):
+        self.q.active_queue = self.lq
+        self.lq.get_job().remaining_print_time.return_value = 50
+        self.lq.get_set().estimated_print_time.return_value = 20
+        self.assertEqual(self.q.estimate_free_at(now=100), 150)
+
+        # Time spent on the current print is subtracted, up to its estimate
+        self.q.run = MagicMock()
+        self.q.run.start.timestamp.return_value = 90
+        self.assertEqual(self.q.estimate_free_at(now=100), 140)
+        self.q.run.start.timestamp.return_value = 0
+        self.assertEqual(self.q.estimate_free_at(now=100), 130)
+
+    def test_update_peer_state(self):
+        self.q.update_peer_state("name", "IDLE", None, dict(), active=False)
+        self.lq.update_peer_state.assert_called_with(
+            "name", "IDLE", None, dict(), free_at=None
+        )
+        self.q.update_peer_state("name", "IDLE", None, dict())
+        self.assertNotEqual(self.lq.update_peer_state.call_args[1]["free_at"], None)
+
+
+def makeSet(materials="", profiles=""):
+    s = SetView()
+    s.material_keys = materials
+    s.profile_keys = profiles
+    return s
+
+
+class TestLeastManual(unittest.TestCase):
+    def setUp(self):
+        self.loaded = ["mq_m1", "mq_m2"]
+        self.q = MultiQueue(
+            MagicMock(),
+            Strategy.LEAST_MANUAL,
+            lambda: None,
+            profile=dict(name="mq_profile"),
+            materials_fn=lambda: self.loaded,
+        )
+
+    def _queue(self, name, sets):
+        q = MagicMock()
+        q.ns = name
+        q.candidates.return_value = [(MagicMock(), s) for s in sets]
+        q.acquire_candidate.return_value = True
+        self.q.add(name, q)
+        return q
+
+    def test_fewest_material_changes(self):
+        s1 = makeSet("mq_m3,mq_m3")
+        s2 = makeSet("mq_m1,mq_m3")
+        s3 = makeSet(",mq_m2")
+        q1 = self._queue("q1", [s1, s2])
+        q2 = self._queue("q2", [s3])
+        self.assertEqual(
+            [c[3] for c in self.q._least_manual_candidates()], [s3, s2, s1]
+        )
+        self.assertTrue(self.q.acquire())
+        self.assertEqual(self.q.active_queue, q2)
+        q2.acquire_candidate.assert_called_with(ANY, s3)
+        q1.acquire_candidate.assert_not_called()
+
+    def test_profile_fit(self):
+        s1 = makeSet()
+        s2 = makeSet(profiles="mq_other,mq_profile")
+        self._queue("q1", [s1, s2])
+        self.assertEqual([c[3] for c in self.q._least_manual_candidates()], [s2, s1])
+
+    def test_ties_in_order(self):
+        s1 = makeSet("mq_m1")
+        s2 = makeSet()
+        s3 = makeSet(",mq_m2")
+        self._queue("q1", [s1, s2])
+        self._queue("q2", [s3])
+        self.assertEqual(
+            [c[3] for c in self.q._least_manual_candidates()], [s1, s2, s3]
+        )
+
+    def test_acquire_falls_back(self):
+        q1 = self._queue("q1", [makeSet()])
+        q1.acquire_candidate.return_value = False  # e.g. LAN job taken by a peer
+        q2 = self._queue("q2", [makeSet("mq_m3")])
+        self.assertTrue(self.q.acquire())
+        self.assertEqual(self.q.active_queue, q2)
+
+    def test_nothing_to_acquire(self):
+        self._queue("q1", [])
+        self.assertFalse(self.q.acquire())
+        self.assertEqual(self.q.active_queue, None)
@@ -136,7 +136,8 @@ class ScriptRunner:
         # gcode file (the "job" in OctoPrint parlance).
         # Failing this verification should put the queue in a "needs action" state and prevent printing the next file.
         if self._spool_manager is not None:
-            ap = self._spool_manager.allowed_to_print()
+            path = self._printer.get_current_job().get("file", {}).get("path")
+            ap = self._spool_manager.allowed_to_print(path)
             ap = dict(
                 misconfig=ap.get("metaOrAttributesMissing", False),
                 nospool=ap.get("result", {}).get("noSpoolSelected", []),
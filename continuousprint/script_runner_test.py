@@ -101,6 +101,14 @@ class TestScriptRunner(unittest.TestCase):
         self.s._spool_manager = None
         self.assertEqual(self.s.verify_active()[0], True)
 
+    def test_verify_active_passes_current_path(self):
+        self.s._printer.get_current_job.return_value = dict(
+            file=dict(name="foo.gcode", path="dir/foo.gcode")
+        )
+        self.s._spool_manager.allowed_to_print.return_value = dict()
+        self.s.verify_active()
+        self.s._spool_manager.allowed_to_print.assert_called_with("dir/foo.gcode")
+
     def test_start_print_ok(self):
         self.s._printer.get_current_job.return_value = dict(file=dict(name="foo.gcode"))
         self.s.start_print(LI(False, "foo.gcode", LJ("job1")))
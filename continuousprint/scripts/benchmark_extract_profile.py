@@ -0,0 +1,78 @@
+"""Benchmarks profile extraction against large generated gcode files.
+
+Each file mimics PrusaSlicer output: a large header comment (embedded
+thumbnail), a body of moves padded to the requested size, and a footer config
+dump. Extraction time should not grow with file size.
+
+Usage: python3 -m continuousprint.scripts.benchmark_extract_profile [--sizes_mb 1,100,500]
+"""
+import argparse
+import os
+import tempfile
+import time
+from continuousprint.scripts.extract_profile import (
+    get_header,
+    get_footer,
+    get_profile,
+)
+
+HEADER = (
+    "; generated by PrusaSlicer 2.4.2+win64 on 2022-08-22 at 01:21:14 UTC\n"
+    + "; thumbnail begin 400x300 200000\n"
+    + ("; " + "A" * 78 + "\n") * 2500
+    + "; thumbnail end\n\n"
+)
+MOVES = "".join(
+    f"G1 X{i % 200}.{i % 10} Y{i % 180}.5 E0.0{i % 7}\n" for i in range(2000)
+)
+FOOTER = (
+    "; filament used [mm] = 1234.5\n; prusaslicer_config = begin\n"
+    + "".join(f"; setting_{i} = {'x' * 40}\n" for i in range(600))
+    + "; printer_model = MK3S\n; prusaslicer_config = end\n"
+)
+
+
+def generate(path, size):
+    chunk = MOVES.encode("utf8")
+    with open(path, "w") as f:
+        f.write(HEADER)
+    with open(path, "ab") as f:
+        remaining = size - len(HEADER) - len(FOOTER)
+        while remaining > 0:
+            f.write(chunk[:remaining])
+            remaining -= len(chunk)
+        f.write(b"\n")
+    with open(path, "a") as f:
+        f.write(FOOTER)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes_mb", default="1,100,500")
+    parser.add_argument(
+        "--dir", default=None, help="Where to write files (default: temp dir)"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as d:
+        for mb in [int(s) for s in args.sizes_mb.split(",")]:
+            path = os.path.join(d, f"bench_{mb}mb.gcode")
+            generate(path, mb * 1024 * 1024)
+            th, hdr = timed(get_header, path)
+            tf, ftr = timed(get_footer, path)
+            tp, prof = timed(get_profile, hdr, ftr)
+            print(
+                f"{mb:>5}MB: header {th:7.2f}ms ({len(hdr)} lines), "
+                f"footer {tf:7.2f}ms ({len(ftr)} lines), profile {prof!r}"
+            )
+            os.unlink(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Benchmarks the per-line cost of CPQPlugin.gatedCommJobReader.
+
+Replays a gcode file (or a generated one of tiny segments) through a fake
+OctoPrint job reader, with no gate, the previous gate implementation and the
+current one, and reports lines/sec for each.
+
+Usage: python3 -m continuousprint.scripts.benchmark_gcode_gate [--gcode path] [--skip "M400\nM84"]
+"""
+import argparse
+import logging
+import time
+import traceback
+from types import SimpleNamespace
+from continuousprint.plugin import CPQPlugin
+from continuousprint.skip_matcher import SkipMatcher
+
+
+def load_lines(path, n):
+    if path is not None:
+        with open(path) as f:
+            return [ln.rstrip("\n") for ln in f]
+    return [
+        f"G1 X{(i % 2000) / 10:.2f} Y{(i % 1700) / 10:.2f} E{i / 1000:.5f}"
+        if i % 50
+        else "M400"
+        for i in range(n)
+    ]
+
+
+def make_reader(lines):
+    it = iter(lines)
+
+    def read():
+        return (next(it, None), None, None)
+
+    return read
+
+
+def legacy_gate(self, *args, **kwargs):
+    # The gate as implemented prior to SkipMatcher, for comparison
+    result = self._jobCommReaderOrig(*args, **kwargs)
+    try:
+        if self.d.state != self.d._state_printing:
+            return result
+        while result[0] is not None:
+            if type(result[0]) != str:
+                return result
+            line = result[0].strip()
+            if line == "":
+                return result
+            cmd = result[0].split(";", 1)[0].strip().upper()
+            if cmd not in self._ignore_cmd_list:
+                break
+            result = self._jobCommReaderOrig(*args, **kwargs)
+    except Exception:
+        traceback.print_exc()
+    finally:
+        return result
+
+
+def run(lines, gate, skip):
+    ns = SimpleNamespace(
+        d=SimpleNamespace(state="printing", _state_printing="printing"),
+        _jobCommReaderOrig=make_reader(lines),
+        _skip_matcher=SkipMatcher(skip),
+        _ignore_cmd_list=set(SkipMatcher.normalize(c) for c in skip),
+        _logger=logging.getLogger("benchmark"),
+    )
+    read = ns._jobCommReaderOrig if gate is None else lambda: gate(ns)
+    n = 0
+    start = time.perf_counter()
+    while read()[0] is not None:
+        n += 1
+    return n, time.perf_counter() - start, ns._skip_matcher.counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gcode", default=None, help="gcode file to replay")
+    parser.add_argument("--lines", type=int, default=500000)
+    parser.add_argument("--skip", default="M400\nM84")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    lines = load_lines(args.gcode, args.lines)
+    skip = args.skip.split("\n")
+    for name, gate in [
+        ("no gate", None),
+        ("legacy gate", legacy_gate),
+        ("gate", CPQPlugin.gatedCommJobReader),
+    ]:
+        # Best of several runs, to reduce noise
+        n, elapsed, counts = min(
+            (run(lines, gate, skip) for _ in range(args.repeat)), key=lambda r: r[1]
+        )
+        print(f"{name:>12}: {n / elapsed:12,.0f} lines/sec ({n} lines passed)")
+    print(f"Skipped: {dict(counts)}")
+
+
+if __name__ == "__main__":
+    main()
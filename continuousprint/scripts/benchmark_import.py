@@ -0,0 +1,105 @@
+"""Measures the time taken to import the plugin, per module (like `python -X
+importtime`), on top of the modules OctoPrint has already imported by the time
+plugins are loaded.
+
+Exits nonzero if the total exceeds --budget_ms, or if any module that should
+only be loaded on first use (DEFERRED) was imported.
+
+Usage: python3 -m continuousprint.scripts.benchmark_import [--budget_ms 200] [--top 15]
+"""
+import argparse
+import subprocess
+import sys
+
+# Already imported by OctoPrint before it loads plugins, so importing them
+# costs the plugin nothing.
+PRELOADED = [
+    "octoprint.plugin",
+    "octoprint.server.util.flask",
+    "octoprint.access.permissions",
+    "octoprint.events",
+    "octoprint.filemanager",
+    "octoprint.filemanager.analysis",
+    "octoprint.filemanager.destinations",
+    "octoprint.slicing",
+    "octoprint.timelapse",
+    "octoprint.util",
+    "flask",
+    "requests",
+    "yaml",
+]
+
+# Heavy modules which must not be imported until they are first used
+DEFERRED = [
+    "asteval",
+    "peerprint.lan_queue",
+    "pysyncobj",
+    "continuousprint.scripts.extract_profile",
+]
+
+BUDGET_MS = 200
+MARKER = "--- begin continuousprint import ---"
+
+
+def measure(module="continuousprint", preload=PRELOADED):
+    """Returns [(name, self_us, cumulative_us)] for every module newly
+    imported by importing `module` after `preload`."""
+    code = "; ".join(
+        [f"import {m}" for m in preload]
+        + [f"import sys; sys.stderr.write({MARKER!r} + '\\n'); sys.stderr.flush()"]
+        + [f"import {module}"]
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    lines = proc.stderr.splitlines()
+    result = []
+    for line in lines[lines.index(MARKER) + 1 :]:
+        if not line.startswith("import time:"):
+            continue
+        (selftime, cumulative, name) = line[len("import time:") :].split("|")
+        if not selftime.strip().isdigit():
+            continue  # Header line
+        result.append((name.strip(), int(selftime), int(cumulative)))
+    return result
+
+
+def check(timings, budget_ms=BUDGET_MS, deferred=DEFERRED):
+    """Returns a list of problems with the measured `timings` (empty if OK)."""
+    problems = []
+    total_ms = sum(t[1] for t in timings) / 1000
+    if total_ms > budget_ms:
+        problems.append(f"import took {total_ms:.1f}ms (budget {budget_ms}ms)")
+    names = set(t[0] for t in timings)
+    for d in deferred:
+        if d in names:
+            problems.append(f"{d} was imported, but should be deferred to first use")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget_ms", type=float, default=BUDGET_MS)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args(argv)
+
+    timings = measure()
+    print(f"{'self (ms)':>10} {'cumul (ms)':>10}  module")
+    for (name, selftime, cumulative) in sorted(timings, key=lambda t: -t[1])[
+        : args.top
+    ]:
+        print(f"{selftime / 1000:10.1f} {cumulative / 1000:10.1f}  {name}")
+    total_ms = sum(t[1] for t in timings) / 1000
+    print(f"Total: {total_ms:.1f}ms across {len(timings)} modules")
+
+    problems = check(timings, args.budget_ms)
+    for p in problems:
+        print(f"FAIL: {p}")
+    return 1 if len(problems) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""Simulates printing a queue to completion with each queue strategy, and
+counts the manual material changes needed (see Strategy.LEAST_MANUAL).
+
+Queues are loaded from a file saved from the plugin's state API
+(/plugin/continuousprint/state/get), or are randomly generated if no file is
+given. The printer starts with the first set's materials loaded, and a change
+is counted for every tool that must be loaded with a different material
+before a set can print.
+
+Usage: python3 -m continuousprint.scripts.benchmark_scheduler [--state state.json] [--profile name]
+"""
+import argparse
+import json
+import random
+from continuousprint.queues.abstract import AbstractQueue, Strategy
+from continuousprint.queues.multi import MultiQueue
+from continuousprint.storage.database import JobView, SetView
+from continuousprint.storage.keymask import material_mask, materials_missing
+
+
+class SimQueueView:
+    def __init__(self, name):
+        self.name = name
+
+
+class SimJob(JobView):
+    def __init__(self, data, queue, jid):
+        self.id = jid
+        self.name = data.get("name", "")
+        self.count = int(data.get("count", 1))
+        self.remaining = int(data.get("remaining", self.count))
+        self.draft = data.get("draft", False)
+        self.acquired = False
+        self.queue = queue
+        self.sets = [SimSet(s, self, i) for i, s in enumerate(data.get("sets", []))]
+
+    def save(self):
+        pass
+
+    def refresh_sets(self):
+        for s in self.sets:
+            s.remaining = s.count
+            s.completed = 0
+
+
+class SimSet(SetView):
+    def __init__(self, data, job, rank):
+        self.id = f"{job.id}_{rank}"
+        self.job = job
+        self.rank = rank
+        self.sd = False
+        self.path = data.get("path", "")
+        self.count = int(data.get("count", 1))
+        self.remaining = int(data.get("remaining", self.count))
+        self.completed = int(data.get("completed", 0))
+        self.metadata = None
+        self.material_keys = ",".join(m or "" for m in data.get("materials", []))
+        self.profile_keys = ",".join(p or "" for p in data.get("profiles", []))
+
+    def save(self):
+        pass
+
+
+class SimQueue(AbstractQueue):
+    """In-memory queue which releases its job after every set, so that each
+    set is scheduled separately (like LocalQueue when printing out of order)."""
+
+    def __init__(self, name, jobs, profile):
+        super().__init__()
+        self.ns = name
+        view = SimQueueView(name)
+        self.jobs = [SimJob(j, view, f"{name}/{i}") for i, j in enumerate(jobs)]
+        self._profile = profile
+
+    def candidates(self):
+        result = []
+        for j in self.jobs:
+            s = j.peek_set(self._profile)
+            if s is not None:
+                result.append((j, s))
+        return result
+
+    def acquire_candidate(self, job, s):
+        self.job = job
+        self.set = job.next_set(self._profile)
+        return self.set is not None
+
+    def acquire(self):
+        c = self.candidates()
+        return self.acquire_candidate(*c[0]) if len(c) > 0 else False
+
+    def release(self):
+        self.job = None
+        self.set = None
+
+    def decrement(self):
+        self.set.decrement(self._profile)
+        self.release()
+        return False
+
+    def as_dict(self):
+        return dict()
+
+    def remove_jobs(self, job_ids):
+        raise NotImplementedError
+
+    def reset_jobs(self, job_ids):
+        raise NotImplementedError
+
+
+class NoRuns:
+    def getActiveRun(self, *args):
+        return None
+
+
+def simulate(queues, strategy, profile):
+    """Returns (sets printed, material changes) after printing everything in
+    `queues` (a list of (name, [job dict])) with `strategy`."""
+    loaded = []
+    mq = MultiQueue(
+        NoRuns(),
+        strategy,
+        lambda: None,
+        profile=profile,
+        materials_fn=lambda: loaded,
+    )
+    for name, jobs in queues:
+        mq.add(name, SimQueue(name, jobs, profile))
+
+    printed = 0
+    changes = 0
+    while mq.acquire():
+        s = mq.get_set()
+        want = s.materials()
+        if printed == 0:
+            loaded = list(want)
+        changes += materials_missing(material_mask(want), material_mask(loaded))
+        loaded = [
+            w if w not in (None, "") else (loaded[i] if i < len(loaded) else None)
+            for i, w in enumerate(want)
+        ] + loaded[len(want) :]
+        mq.decrement()
+        printed += 1
+    return (printed, changes)
+
+
+def load_state(path):
+    with open(path) as f:
+        state = json.load(f)
+    return [
+        (q["name"], q.get("jobs", []))
+        for q in state["queues"]
+        if not q.get("connecting", False)
+    ]
+
+
+def generate(njobs, nmaterials, ntools, seed):
+    rng = random.Random(seed)
+    materials = [f"PLA_color{i}_#{i:06x}" for i in range(nmaterials)]
+    jobs = []
+    for i in range(njobs):
+        sets = []
+        for _ in range(rng.randint(1, 3)):
+            sets.append(
+                dict(
+                    path=f"part{len(sets)}.gcode",
+                    count=rng.randint(1, 3),
+                    materials=[rng.choice(materials) for _ in range(ntools)],
+                    profiles=[],
+                )
+            )
+        jobs.append(dict(name=f"job{i}", count=1, sets=sets))
+    return [("generated", jobs)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--state", default=None, help="saved state API response")
+    parser.add_argument("--profile", default="Generic")
+    parser.add_argument("--jobs", type=int, default=50)
+    parser.add_argument("--materials", type=int, default=4)
+    parser.add_argument("--tools", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.state is not None:
+        queues = load_state(args.state)
+    else:
+        queues = generate(args.jobs, args.materials, args.tools, args.seed)
+    profile = dict(name=args.profile)
+
+    results = dict()
+    for strategy in (Strategy.IN_ORDER, Strategy.LEAST_MANUAL):
+        results[strategy] = simulate(queues, strategy, profile)
+        (printed, changes) = results[strategy]
+        print(
+            f"{strategy.name:>12}: {printed} sets printed, {changes} material changes"
+        )
+    avoided = results[Strategy.IN_ORDER][1] - results[Strategy.LEAST_MANUAL][1]
+    print(f"Material changes avoided: {avoided}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Benchmarks set filtering by printer profile and loaded materials.
+
+Compares the CSV-based checks that SetView used to do on every call against
+the profile/material bitmasks that sets compute when they're loaded or saved.
+
+Usage: python3 -m continuousprint.scripts.benchmark_set_filter [--sets 10000]
+"""
+import argparse
+import random
+import time
+from continuousprint.storage.database import Set
+from continuousprint.storage.keymask import (
+    material_mask,
+    materials_satisfied,
+    profile_bit,
+)
+
+PROFILES = [f"Profile {i}" for i in range(40)]
+MATERIALS = [f"PLA_color{i}_#{i:06x}" for i in range(20)] + [""]
+
+
+def make_sets(n, rng):
+    result = []
+    for i in range(n):
+        result.append(
+            Set(
+                profile_keys=",".join(rng.sample(PROFILES, rng.randint(0, 3))),
+                material_keys=",".join(
+                    rng.choice(MATERIALS) for _ in range(rng.randint(0, 2))
+                ),
+            )
+        )
+    return result
+
+
+def csv_printable(s, profile):
+    profs = s.profiles()
+    return len(profs) == 0 or profile["name"] in profs
+
+
+def csv_materials_match(s, cur):
+    for i, im in enumerate(s.materials()):
+        if im is None or im == "":
+            continue
+        if im != (cur[i] if i < len(cur) else None):
+            return False
+    return True
+
+
+def timeit(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sets", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    profile = dict(name=PROFILES[0])
+    cur = [MATERIALS[0], MATERIALS[1]]
+
+    # Sets compute their masks when constructed (e.g. loaded from the db)
+    start = time.perf_counter()
+    sets = make_sets(args.sets, random.Random(args.seed))
+    print(
+        f"Build {len(sets)} sets incl. masks: {(time.perf_counter() - start) * 1000:.2f}ms"
+    )
+
+    # Looked up once per scheduling pass, not per set
+    bit = profile_bit(profile["name"])
+    cur_mask = material_mask(cur)
+
+    for name, fn in [
+        ("profile (csv)", lambda: sum(csv_printable(s, profile) for s in sets)),
+        ("profile (mask)", lambda: sum(s.matches_profile(bit) for s in sets)),
+        ("materials (csv)", lambda: sum(csv_materials_match(s, cur) for s in sets)),
+        (
+            "materials (mask)",
+            lambda: sum(materials_satisfied(s.material_mask(), cur_mask) for s in sets),
+        ),
+    ]:
+        elapsed, matched = timeit(fn, args.repeat)
+        print(
+            f"{name:>18}: {elapsed * 1000:8.2f}ms per pass over {len(sets)} sets ({matched} matched)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,13 @@
+import argparse
+import hashlib
+import json
+import math
+import mmap
+import multiprocessing
 import re
 import sys
 import os
+import time
 from continuousprint.data import PRINTER_PROFILES
 
 
@@ -18,6 +25,79 @@ CANDIDATES = [
 ]
 
 
+def _build_index(candidates):
+    # Maps each token to the indices of the candidates containing it, along
+    # with a smoothed inverse document frequency weight for the token.
+    index = dict()
+    for i, c in enumerate(candidates):
+        for tok in c:
+            index.setdefault(tok, []).append(i)
+    n = len(candidates)
+    idf = dict(
+        (tok, math.log((1 + n) / (1 + len(ids))) + 1) for tok, ids in index.items()
+    )
+    return index, idf
+
+
+TOKEN_INDEX, TOKEN_IDF = _build_index(CANDIDATES)
+
+
+def _find(lines, pattern):
+    # Returns the first capture group of the first line matching `pattern`
+    r = re.compile(pattern)
+    for line in lines:
+        m = r.match(line)
+        if m is not None:
+            return m[1].strip()
+    return None
+
+
+def _floats(s):
+    if s is None:
+        return []
+    result = []
+    for v in s.split(","):
+        try:
+            result.append(float(v))
+        except ValueError:
+            pass
+    return result
+
+
+def _float(s):
+    v = _floats(s)
+    return v[0] if len(v) > 0 else None
+
+
+DURATION_UNITS = dict(d=86400, h=3600, m=60, s=1)
+
+
+def _duration(s):
+    # Parses e.g. "1d 2h 3m 4s" or "1 hours 2 minutes" into seconds
+    if s is None:
+        return None
+    parts = re.findall(r"(\d+(?:\.\d+)?)\s*([dhms])", s.lower())
+    if len(parts) == 0:
+        return None
+    return sum(float(v) * DURATION_UNITS[u] for v, u in parts)
+
+
+def _metadata(
+    estimatedPrintTime=None,
+    filamentLengths=None,
+    layerHeight=None,
+    nozzleDiameters=None,
+):
+    # Keys follow those used for Set.metadata by the frontend (see
+    # continuousprint_queue.js _extractMetadata)
+    return dict(
+        estimatedPrintTime=estimatedPrintTime,
+        filamentLengths=list(filamentLengths or []),
+        layerHeight=layerHeight,
+        nozzleDiameters=list(nozzleDiameters or []),
+    )
+
+
 class KiriMotoProcessor:
     @classmethod
     def match(self, hdr, ftr):
@@ -33,6 +113,15 @@ class KiriMotoProcessor:
                 return re.match("; Target: (.*)", line)[1]
         return ""
 
+    @classmethod
+    def get_metadata(self, hdr, ftr) -> dict:
+        fila = _float(_find(ftr, r"; --- filament used: ([\d.]+) mm ---"))
+        return _metadata(
+            estimatedPrintTime=_float(_find(ftr, r"; --- print time: ([\d.]+)s ---")),
+            filamentLengths=[fila] if fila is not None else [],
+            layerHeight=_float(_find(hdr, r"; sliceHeight = (.*)")),
+        )
+
 
 class PrusaSlicerProcessor:
     @classmethod
@@ -49,6 +138,17 @@ class PrusaSlicerProcessor:
                 return re.match("; printer_model = (.*)", line)[1]
         return ""
 
+    @classmethod
+    def get_metadata(self, hdr, ftr) -> dict:
+        return _metadata(
+            estimatedPrintTime=_duration(
+                _find(ftr, r"; estimated printing time \(normal mode\) = (.*)")
+            ),
+            filamentLengths=_floats(_find(ftr, r"; filament used \[mm\] = (.*)")),
+            layerHeight=_float(_find(ftr, r"; layer_height = (.*)")),
+            nozzleDiameters=_floats(_find(ftr, r"; nozzle_diameter = (.*)")),
+        )
+
 
 class Simplify3DProcessor:
     @classmethod
@@ -62,87 +162,336 @@ class Simplify3DProcessor:
     def get_profile(self, hdr, ftr) -> str:
         for line in hdr:
             m = re.match(";   profileName,(.*)", line)
-            print(line, "->", m)
             if m is not None:
                 return m[1]
         return ""
 
+    @classmethod
+    def get_metadata(self, hdr, ftr) -> dict:
+        fila = _float(_find(ftr, r";\s+Filament length: ([\d.]+) mm"))
+        return _metadata(
+            estimatedPrintTime=_duration(_find(ftr, r";\s+Build time: (.*)")),
+            filamentLengths=[fila] if fila is not None else [],
+            layerHeight=_float(_find(hdr, r";\s+layerHeight,(.*)")),
+            nozzleDiameters=_floats(_find(hdr, r";\s+extruderDiameter,(.*)")),
+        )
+
+
+class CuraProcessor:
+    @classmethod
+    def match(self, hdr, ftr):
+        for line in hdr:
+            if line.startswith(";Generated with Cura"):
+                return True
+        return False
+
+    @classmethod
+    def get_profile(self, hdr, ftr) -> str:
+        # Only written for some gcode flavors (e.g. Griffin)
+        return _find(hdr, ";TARGET_MACHINE.NAME:(.*)") or ""
+
+    @classmethod
+    def get_metadata(self, hdr, ftr) -> dict:
+        # Written in meters per extruder, e.g. "1.23456m, 0m"
+        meters = _floats((_find(hdr, r";Filament used: (.*)") or "").replace("m", ""))
+        return _metadata(
+            estimatedPrintTime=_float(_find(hdr, r";TIME:(.*)")),
+            filamentLengths=[m * 1000 for m in meters],
+            layerHeight=_float(_find(hdr, r";Layer height: (.*)")),
+        )
+
+
+def token_string_match(profstr, tfidf=False, report=None):
+    """Returns the printer profile sharing the most tokens with `profstr`, or
+    None if no tokens are shared. Ties go to the earliest profile.
 
-def token_string_match(profstr):
+    With tfidf=True, tokens are weighted by how rare they are across all
+    profiles, so generic tokens (e.g. a manufacturer name) count for less.
+    If `report` is given, the top scores are written to it.
+    """
     # Remove non-alpha characters from profile string
     # Convert all into bag-of-words
     p = set(_strip_nonalpha(profstr).split())
 
-    scores = [len(p.intersection(c)) for c in CANDIDATES]
-    sys.stderr.write(f"Scoring '{profstr}':\n")
-    desc = sorted(zip(PROFILES, scores), key=lambda x: x[1], reverse=True)
-    for p, s in desc[:4]:
-        if s == 0:
-            continue
-        sys.stderr.write(f"- {p}: {s}\n")
-    sys.stderr.write("- ...\n")
-    max_score = max(scores)
-    if max_score < 1:
+    scores = dict()
+    for tok in p:
+        w = TOKEN_IDF[tok] if tfidf and tok in TOKEN_IDF else 1
+        for i in TOKEN_INDEX.get(tok, []):
+            scores[i] = scores.get(i, 0) + w
+    desc = sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+
+    if report is not None:
+        report.write(f"Scoring '{profstr}':\n")
+        for i, sc in desc[:4]:
+            report.write(f"- {PROFILES[i]}: {sc:g}\n")
+        report.write("- ...\n")
+
+    if len(desc) == 0:
         return None
-    max_index = scores.index(max_score)
-    return PROFILES[max_index]
+    return PROFILES[desc[0][0]]
 
 
 PROCESSORS = [
-    (cls.__name__, cls.match, cls.get_profile)
-    for cls in [KiriMotoProcessor, PrusaSlicerProcessor, Simplify3DProcessor]
+    KiriMotoProcessor,
+    PrusaSlicerProcessor,
+    Simplify3DProcessor,
+    CuraProcessor,
 ]
 
-gcode_move_re = re.compile("^G[012] .*")
-gcode_multiline_re = re.compile("\nG[012] .*", re.M)
+# Scanning is bounded so that extraction takes the same time regardless of
+# file size. Headers can be large (embedded thumbnails), as can footers
+# (PrusaSlicer dumps its full config there).
+HEADER_BYTES = 1024 * 1024
+FOOTER_BYTES = 256 * 1024
+MOVE_PREFIXES = (b"G0 ", b"G1 ", b"G2 ")
+gcode_move_re = re.compile(rb"^G[012] ", re.M)
+
+
+def _open_mmap(f):
+    if os.fstat(f.fileno()).st_size == 0:
+        return None  # Empty files can't be mapped
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
 
-def get_header(path: str):
-    hdr = []
-    with open(path) as f:
-        for line in f:
-            if line.strip() == "":
-                continue
-            if gcode_move_re.match(line):
-                return hdr
-            hdr.append(line)
-    return hdr
+def _decode_lines(b: bytes):
+    # Budgets may cut through a multibyte character; replace rather than fail
+    return b.decode("utf8", errors="replace").splitlines(keepends=True)
 
 
-def get_footer(path: str):
-    # Adapted from https://stackoverflow.com/a/54278929
-    # Skip back until we start seeing gcode
-    hdr = []
-    JUMP = 200  # Num bytes to jump back and search for gcode
+def get_header(path: str, budget: int = HEADER_BYTES):
+    """Returns the non-empty lines preceding the first G0/G1/G2 move, looking
+    at no more than `budget` bytes from the start of the file."""
     with open(path, "rb") as f:
-        try:  # catch OSError in case of a one line file
-            f.seek(-JUMP, os.SEEK_END)
-            while not gcode_multiline_re.match(f.read(JUMP).decode("utf8")):
-                f.seek(-2 * JUMP, os.SEEK_CUR)
-            f.seek(-JUMP, os.SEEK_END)
-            for line in f:
-                ln = line.decode("utf8")
-                if ln.startswith(";"):
-                    hdr.append(ln)
-        except OSError:
-            pass  # give up
-    return hdr
-
-
-def get_profile(hdr: list, ftr: list):
-    for name, match, getprof in PROCESSORS:
-        if match(hdr, ftr):
-            sys.stderr.write(f"File matched with {name}\n")
-            profstr = getprof(hdr, ftr)
-            return token_string_match(profstr)
+        mm = _open_mmap(f)
+        if mm is None:
+            return []
+        with mm:
+            end = min(budget, len(mm))
+            m = gcode_move_re.search(mm, 0, end)
+            if m is not None:
+                end = m.start()
+            elif end < len(mm):
+                end = mm.rfind(b"\n", 0, end) + 1  # Drop any partial line
+            lines = _decode_lines(mm[:end])
+    return [ln for ln in lines if ln.strip() != ""]
 
 
-if __name__ == "__main__":
+def get_footer(path: str, budget: int = FOOTER_BYTES):
+    """Returns the comment lines following the last G0/G1/G2 move, looking at
+    no more than `budget` bytes from the end of the file."""
+    with open(path, "rb") as f:
+        mm = _open_mmap(f)
+        if mm is None:
+            return []
+        with mm:
+            start = max(0, len(mm) - budget)
+            last = max(mm.rfind(b"\n" + p, max(start - 1, 0)) for p in MOVE_PREFIXES)
+            if last != -1:
+                start = mm.find(b"\n", last + 1) + 1
+                if start == 0:
+                    return []  # Move is on the last line
+            elif start == 0:
+                if mm[:3] not in MOVE_PREFIXES:
+                    return []  # No gcode in the file at all
+                start = mm.find(b"\n") + 1
+                if start == 0:
+                    return []
+            else:
+                # No moves within the budget; use whatever full lines we have
+                start = mm.find(b"\n", start - 1) + 1
+            lines = _decode_lines(mm[start:])
+    return [ln for ln in lines if ln.startswith(";")]
+
+
+def get_processor(hdr: list, ftr: list, report=None):
+    for proc in PROCESSORS:
+        if proc.match(hdr, ftr):
+            if report is not None:
+                report.write(f"File matched with {proc.__name__}\n")
+            return proc
+    return None
+
+
+def get_profile(hdr: list, ftr: list, tfidf=False, report=None):
+    proc = get_processor(hdr, ftr, report)
+    if proc is not None:
+        return token_string_match(proc.get_profile(hdr, ftr), tfidf, report)
+
+
+def extract(path: str, tfidf=False, report=None) -> dict:
+    """Extracts the printer profile, slicer and slicer-estimated metadata from
+    a single bounded read of the file's header and footer."""
+    hdr = get_header(path)
+    ftr = get_footer(path)
+    proc = get_processor(hdr, ftr, report)
+    if proc is None:
+        return dict(profile="", slicer=None, metadata=_metadata())
+    prof = token_string_match(proc.get_profile(hdr, ftr), tfidf, report)
+    return dict(
+        profile=prof if prof is not None else "",
+        slicer=proc.__name__,
+        metadata=proc.get_metadata(hdr, ftr),
+    )
+
+
+def serve(conn):
+    """Worker loop for continuousprint.analysis; receives gcode paths over `conn`
+    and replies with (True, extract() result) or (False, error message) for
+    each. A path of None stops the worker.
+
+    Running this in a long-lived process means printer profiles are only loaded
+    once, rather than once per analyzed file."""
+    while True:
+        try:
+            path = conn.recv()
+        except EOFError:
+            return
+        if path is None:
+            return
+        try:
+            conn.send((True, extract(path)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+
+
+GCODE_EXTENSIONS = ("gcode", "gco", "g")
+
+
+def _sha1(path: str) -> str:
+    # Same as OctoPrint's file metadata "hash", which keys the analysis cache
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _batch_one(args):
+    path, tfidf = args
+    result = dict(path=path)
+    try:
+        start = time.perf_counter()
+        result["hash"] = _sha1(path)
+        hashed = time.perf_counter()
+        result.update(extract(path, tfidf=tfidf))
+        done = time.perf_counter()
+        result["timings"] = dict(
+            hash_ms=round((hashed - start) * 1000, 3),
+            extract_ms=round((done - hashed) * 1000, 3),
+        )
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def _batch_paths(paths):
+    # Expands directories into the gcode files within them; "-" reads paths
+    # from stdin, one per line.
+    for p in paths:
+        if p == "-":
+            for line in sys.stdin:
+                if line.strip() != "":
+                    yield line.rstrip("\n")
+        elif os.path.isdir(p):
+            for root, dirs, files in os.walk(p):
+                dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+                for f in sorted(files):
+                    if (
+                        not f.startswith(".")
+                        and f.split(".")[-1].lower() in GCODE_EXTENSIONS
+                    ):
+                        yield os.path.join(root, f)
+        else:
+            yield p
+
+
+def batch(paths, workers=None, tfidf=False, out=sys.stdout):
+    """Extracts all `paths` (see _batch_paths) in a pool of worker processes,
+    writing one JSON result per line to `out` as each completes."""
+    n = 0
+    with multiprocessing.Pool(workers) as pool:
+        for result in pool.imap_unordered(
+            _batch_one, ((p, tfidf) for p in _batch_paths(paths)), chunksize=4
+        ):
+            out.write(json.dumps(result) + "\n")
+            n += 1
+    out.flush()
+    return n
+
+
+def import_results(lines, db_path):
+    """Loads batch() output into the analysis cache DB at `db_path` (normally
+    analysis.sqlite3 in the plugin's data folder), so that matching files are
+    not analyzed again when added to OctoPrint."""
+    from continuousprint.storage.database import init_analysis
+    from continuousprint.storage.queries import setAnalysis
+
+    init_analysis(db_path)
+    n = 0
+    for line in lines:
+        if line.strip() == "":
+            continue
+        r = json.loads(line)
+        if r.get("error") is not None or r.get("hash") is None:
+            continue
+        setAnalysis(
+            r["hash"],
+            dict(profile=r["profile"], slicer=r["slicer"], metadata=r["metadata"]),
+        )
+        n += 1
+    return n
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Infer printer profiles (and slicer estimates) from gcode files"
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        help="Gcode files or directories; '-' reads paths from stdin",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Output NDJSON results for all paths instead of a single profile",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Worker processes (default: CPUs)"
+    )
+    parser.add_argument(
+        "--tfidf", action="store_true", help="Weight profile tokens by rarity"
+    )
+    parser.add_argument(
+        "--import_to",
+        metavar="DB",
+        help="Import --batch output (from paths, or stdin) into this analysis DB",
+    )
+    args = parser.parse_args(argv)
+
+    if args.import_to is not None:
+        if len(args.paths) == 0 or args.paths == ["-"]:
+            n = import_results(sys.stdin, args.import_to)
+        else:
+            n = 0
+            for p in args.paths:
+                with open(p) as f:
+                    n += import_results(f, args.import_to)
+        sys.stderr.write(f"Imported {n} results into {args.import_to}\n")
+        return
+
+    if args.batch or len(args.paths) != 1 or not os.path.isfile(args.paths[0]):
+        n = batch(args.paths, args.workers, args.tfidf)
+        sys.stderr.write(f"Processed {n} files\n")
+        return
+
     sys.stderr.write("=== Continuous Print Profile Inference ===\n")
-    hdr = get_header(sys.argv[1])
-    ftr = get_footer(sys.argv[1])
-    prof = get_profile(hdr, ftr)
-    if prof is not None:
-        sys.stdout.write(prof)
+    sys.stdout.write(
+        extract(args.paths[0], tfidf=args.tfidf, report=sys.stderr)["profile"]
+    )
     sys.stdout.flush()
     sys.stderr.write("\n=== End Inference ===\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+"""Runs a LAN queue with many peers in one process, all on loopback, to measure
+how it behaves under load without needing real printers.
+
+Each peer is a real LANQueue (with pysyncobj replication and a fileshare HTTP
+server on 127.0.0.1) driven by a simulated printer, which acquires jobs,
+fetches their files, "prints" each set for --print_s seconds, decrements and
+releases, and publishes peer state on every tick like the plugin's driver.
+Jobs are posted round-robin across peers at --post_rate jobs per second.
+
+Reports:
+* replication latency: time from posting a job until each other peer sees it
+* acquisition conflicts: acquires that lost a race for a job's lock
+* duplicate prints: set prints beyond what the job asked for
+* CPU time per peer, from its replication, fileshare and printer threads
+  (Linux and python 3.8+ only; read from /proc)
+
+Exits nonzero if any set was printed more times than its job asked for.
+
+Usage: python3 -m continuousprint.scripts.loadtest_lan [--peers 5] [--duration 30] [--post_rate 1]
+"""
+import argparse
+import http.server
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from continuousprint.blobshare import BlobFileshare
+from continuousprint.queues.abstract import Strategy
+from continuousprint.queues.lan import LANQueue
+from continuousprint.storage.database import JobView, SetView
+from peerprint.lan_queue import LANPrintQueueBase
+
+PROFILE = "loadtest"
+
+
+class LoadQueueView:
+    name = "loadtest"
+
+
+class Stats:
+    """Measurements shared by all peers (they run in the same process)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.posted = dict()  # job name -> (monotonic time posted, poster addr)
+        self.expected = dict()  # job name -> prints expected per set
+        self.seen = dict()  # job name -> set of peers that have seen it
+        self.latencies = []
+        self.prints = Counter()  # (job name, set rank) -> prints
+        self.counts = Counter()
+
+    def on_posted(self, name, expected, peer):
+        with self.lock:
+            self.posted[name] = (time.monotonic(), peer)
+            self.expected[name] = expected
+
+    def on_seen(self, name, peer):
+        now = time.monotonic()
+        with self.lock:
+            (t, poster) = self.posted.get(name, (None, None))
+            seen = self.seen.setdefault(name, set())
+            if t is None or peer in seen or peer == poster:
+                return
+            seen.add(peer)
+            self.latencies.append(now - t)
+
+    def duplicates(self) -> int:
+        with self.lock:
+            return sum(
+                max(0, n - self.expected.get(name, n))
+                for (name, _), n in self.prints.items()
+            )
+
+
+class InstrumentedLANQueue(LANQueue):
+    def __init__(self, stats, *args, **kwargs):
+        self._stats = stats
+        super().__init__(*args, **kwargs)
+
+    def _on_update(self, changetype, prev, nxt):
+        from peerprint.lan_queue import ChangeType
+
+        if changetype == ChangeType.JOB and isinstance(nxt, dict):
+            self._stats.on_seen(nxt.get("name"), self.addr)
+        return super()._on_update(changetype, prev, nxt)
+
+    def acquire_candidate(self, job, s):
+        ok = super().acquire_candidate(job, s)
+        with self._stats.lock:
+            self._stats.counts["acquires"] += 1
+            if not ok:
+                self._stats.counts["conflicts"] += 1
+        return ok
+
+
+class SimPrinter:
+    """Drives a LANQueue like the plugin's Driver would, without a printer."""
+
+    def __init__(self, name, lq, stats, print_s, tick_s, logger):
+        self.name = name
+        self.lq = lq
+        self._stats = stats
+        self._print_s = print_s
+        self._tick_s = tick_s
+        self._logger = logger
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.thread.join()
+
+    def _publish(self, status):
+        self.lq.update_peer_state(
+            self.name, status, None, dict(name=PROFILE), free_at=None
+        )
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._publish("IDLE")
+            try:
+                if not self.lq.acquire():
+                    self._stop.wait(self._tick_s)
+                    continue
+                self._print_job()
+            except Exception:
+                self._logger.exception("Simulated printer failed")
+                self.lq.release()
+                self._stop.wait(self._tick_s)
+
+    def _print_job(self):
+        while not self._stop.is_set():
+            j = self.lq.get_job()
+            s = self.lq.get_set()
+            s.resolve()  # Fetch the file, as starting a print would
+            deadline = time.monotonic() + self._print_s
+            while time.monotonic() < deadline and not self._stop.is_set():
+                self._publish("PRINTING")
+                self._stop.wait(min(self._tick_s, deadline - time.monotonic()))
+            if self._stop.is_set():
+                self.lq.release()
+                return
+            with self._stats.lock:
+                self._stats.prints[(j.name, s.rank)] += 1
+            if not self.lq.decrement():
+                return
+
+
+def _thread_cpu_s(native_id) -> float:
+    # utime + stime of a thread in this process, or None if unavailable
+    try:
+        with open(f"/proc/self/task/{native_id}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _peer_cpu_s(threads) -> float:
+    total = 0
+    for t in threads:
+        native_id = getattr(t, "native_id", None)  # python 3.8+
+        cpu = None if native_id is None else _thread_cpu_s(native_id)
+        if cpu is None:
+            return None
+        total += cpu
+    return total
+
+
+def make_job(name, path, sets, count):
+    j = JobView()
+    j.id = None
+    j.name = name
+    j.queue = LoadQueueView()
+    j.count = count
+    j.remaining = count
+    j.draft = False
+    j.created = int(time.time())
+    j.acquired = False
+    j.sets = []
+    for rank in range(sets):
+        s = SetView()
+        s.id = rank
+        s.rank = rank
+        s.path = path
+        s.sd = False
+        s.count = 1
+        s.remaining = 1
+        s.completed = 0
+        s.metadata = None
+        s.profile_keys = PROFILE
+        s.material_keys = ""
+        j.sets.append(s)
+    return j
+
+
+class Network:
+    def __init__(self, args, basedir, stats):
+        self.args = args
+        self.basedir = Path(basedir)
+        self.stats = stats
+        self.peers = []  # (lq, fileshare, printer, [threads])
+        self._rng = random.Random(args.seed)
+
+    def _random_bytes(self, n):
+        # Random.randbytes() needs python 3.9+, and older getrandbits() rejects 0
+        if n == 0:
+            return b""
+        return self._rng.getrandbits(8 * n).to_bytes(n, "little")
+
+    def start(self):
+        addrs = [f"127.0.0.1:{self.args.base_port + i}" for i in range(self.args.peers)]
+        for i, addr in enumerate(addrs):
+            before = set(threading.enumerate())
+            logger = logging.getLogger(f"peer{i}")
+            fs = BlobFileshare("127.0.0.1:0", str(self.basedir / f"peer{i}"), logger)
+            fs.connect()
+            lq = InstrumentedLANQueue(
+                self.stats,
+                "loadtest",
+                addr,
+                logger,
+                Strategy.IN_ORDER,
+                lambda q: None,
+                fs,
+                dict(name=PROFILE),
+                lambda path, sd: path,
+            )
+            # Peers are given each other's addresses directly rather than
+            # relying on UDP discovery, which can't tell in-process peers apart,
+            # so we build the replicated queue that discovery would otherwise
+            # create once it completes (see LANPrintQueue._on_startup_complete).
+            lq.lan.q = LANPrintQueueBase(lq.lan.ns, addr, lq.lan.update_cb, logger)
+            lq.lan.q.connect([a for a in addrs if a != addr])
+            printer = SimPrinter(
+                f"peer{i}", lq, self.stats, self.args.print_s, self.args.tick_s, logger
+            )
+            threads = list(set(threading.enumerate()) - before)
+            self.peers.append((lq, fs, printer, threads))
+
+    def wait_ready(self, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if all(lq.is_ready() for (lq, _, _, _) in self.peers):
+                return True
+            time.sleep(0.1)
+        return False
+
+    def start_printers(self):
+        for (_, _, printer, threads) in self.peers:
+            printer.start()
+            threads.append(printer.thread)
+
+    def post(self, n):
+        (lq, fs, _, _) = self.peers[n % len(self.peers)]
+        name = f"job{n}"
+        path = Path(fs.basedir).parent / f"{name}.gcode"
+        path.write_bytes(
+            f"; {name}\n".encode() + self._random_bytes(self.args.file_kb * 1024)
+        )
+        self.stats.on_posted(name, self.args.count, lq.addr)
+        lq.import_job_from_view(
+            make_job(name, str(path), self.args.sets, self.args.count)
+        )
+
+    def cpu(self):
+        return [_peer_cpu_s(threads) for (_, _, _, threads) in self.peers]
+
+    def stop(self):
+        for (lq, fs, printer, _) in self.peers:
+            printer.stop()
+        for (lq, fs, printer, _) in self.peers:
+            lq.lan.q.destroy()
+            fs.destroy()
+
+
+def _pct(values, p):
+    if len(values) == 0:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def run(args):
+    stats = Stats()
+    with tempfile.TemporaryDirectory() as basedir:
+        net = Network(args, basedir, stats)
+        net.start()
+        try:
+            if not net.wait_ready(args.ready_timeout):
+                print(f"Peers not ready after {args.ready_timeout}s; aborting")
+                return 1
+            net.start_printers()
+            time.sleep(args.tick_s * 2)  # Let peers publish their profiles
+            cpu_start = net.cpu()
+
+            start = time.monotonic()
+            posted = 0
+            while time.monotonic() < start + args.duration:
+                due = int((time.monotonic() - start) * args.post_rate) + 1
+                while posted < due:
+                    try:
+                        net.post(posted)
+                    except Exception as e:
+                        stats.counts["post_failures"] += 1
+                        logging.getLogger("loadtest").warning(f"Post failed: {e}")
+                    posted += 1
+                time.sleep(min(0.05, 1 / max(args.post_rate, 1)))
+            elapsed = time.monotonic() - start
+            cpu_end = net.cpu()
+            published = Counter()
+            for (lq, _, _, _) in net.peers:
+                published.update(lq.peer_state_counts)
+        finally:
+            net.stop()
+
+    npeers = args.peers
+    missed = sum(npeers - 1 - len(stats.seen.get(n, ())) for n in stats.posted)
+    lat = stats.latencies
+    print(f"{npeers} peers, {posted} jobs posted over {elapsed:.1f}s")
+    print(
+        f"Replication latency: p50 {_pct(lat, 50) * 1000:.1f}ms, "
+        f"p95 {_pct(lat, 95) * 1000:.1f}ms, max {max(lat, default=float('nan')) * 1000:.1f}ms "
+        f"({len(lat)} deliveries, {missed} not delivered)"
+    )
+    acq = stats.counts["acquires"]
+    conflicts = stats.counts["conflicts"]
+    print(
+        f"Acquisitions: {acq - conflicts} succeeded, {conflicts} conflicts "
+        f"({conflicts / max(acq, 1) * 100:.1f}%)"
+    )
+    print(
+        f"Prints: {sum(stats.prints.values())} sets printed, {stats.duplicates()} duplicates"
+    )
+    print(
+        f"Peer state: {published['published']} published, {published['suppressed']} suppressed"
+    )
+    if stats.counts["post_failures"] > 0:
+        print(f"Post failures: {stats.counts['post_failures']}")
+    for i, (a, b) in enumerate(zip(cpu_start, cpu_end)):
+        if a is None or b is None:
+            print(f"peer{i} CPU: unavailable")
+        else:
+            print(f"peer{i} CPU: {b - a:.2f}s ({(b - a) / elapsed * 100:.1f}%)")
+    return 1 if stats.duplicates() > 0 else 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--peers", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--post_rate", type=float, default=1, help="jobs/second")
+    parser.add_argument("--sets", type=int, default=2, help="sets per job")
+    parser.add_argument("--count", type=int, default=1, help="job count")
+    parser.add_argument("--file_kb", type=int, default=64)
+    parser.add_argument("--print_s", type=float, default=2, help="seconds per set")
+    parser.add_argument("--tick_s", type=float, default=0.5)
+    parser.add_argument("--base_port", type=int, default=17000)
+    parser.add_argument("--ready_timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+    if not args.verbose:
+        # Fileshare servers otherwise log every request to stderr
+        http.server.SimpleHTTPRequestHandler.log_message = lambda *args: None
+    return run(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,6 +1,20 @@
 import unittest
+import io
+import json
+import os
 import tempfile
-from .extract_profile import get_profile, get_header, get_footer
+from .extract_profile import (
+    get_profile,
+    get_header,
+    get_footer,
+    extract,
+    batch,
+    import_results,
+    token_string_match,
+    _strip_nonalpha,
+    PROFILES,
+    CANDIDATES,
+)
 
 
 class TestProfileInference(unittest.TestCase):
@@ -38,6 +52,139 @@ class TestProfileInference(unittest.TestCase):
                 self.assertEqual(result, want)
 
 
+class TestTokenStringMatch(unittest.TestCase):
+    def testMatchesBruteForce(self):
+        # The inverted index must give the same answers as scoring every
+        # candidate, including tie breaks
+        def brute_force(profstr):
+            p = set(_strip_nonalpha(profstr).split())
+            scores = [len(p.intersection(c)) for c in CANDIDATES]
+            if max(scores) < 1:
+                return None
+            return PROFILES[scores.index(max(scores))]
+
+        for p in PROFILES + ["Mini Prusa", "Delta V2", "Creality.CR-30", "MK3S"]:
+            with self.subTest(profstr=p):
+                self.assertEqual(token_string_match(p), brute_force(p))
+
+    def testNoMatch(self):
+        self.assertEqual(token_string_match(""), None)
+        self.assertEqual(token_string_match("orangesauce"), None)
+
+    def testTfIdf(self):
+        # "Prusa" is shared by many profiles, so with count-based scoring the
+        # first Prusa profile wins the tie.
+        self.assertEqual(token_string_match("Prusa Leapfrog"), "Prusa Mini")
+        self.assertEqual(
+            token_string_match("Prusa Leapfrog", tfidf=True), "Leapfrog CreatrHS"
+        )
+
+    def testReport(self):
+        report = io.StringIO()
+        token_string_match("Prusa Mini", report=report)
+        self.assertTrue(report.getvalue().startswith("Scoring 'Prusa Mini':\n"))
+        self.assertIn("- Prusa Mini: 2\n", report.getvalue())
+
+
+class TestMetadata(unittest.TestCase):
+    def extract(self, content):
+        with tempfile.NamedTemporaryFile(suffix=".gcode") as ntf:
+            with open(ntf.name, "w") as f:
+                f.write(content)
+            return extract(ntf.name)
+
+    def testUnknownSlicer(self):
+        got = self.extract("; something\nG0 X1\n")
+        self.assertEqual(got["profile"], "")
+        self.assertEqual(got["slicer"], None)
+        self.assertEqual(got["metadata"]["estimatedPrintTime"], None)
+
+    def testDefaultsNotShared(self):
+        a = self.extract("; something\n")
+        a["metadata"]["filamentLengths"].append(1)
+        b = self.extract("; something\n")
+        self.assertEqual(b["metadata"]["filamentLengths"], [])
+
+    def testPrusaSlicer(self):
+        got = self.extract(
+            "; generated by PrusaSlicer 2.4.2+win64 on 2022-08-22 at 01:21:14 UTC\n"
+            "G1 X1\n"
+            "; filament used [mm] = 1234.5, 10\n"
+            "; estimated printing time (normal mode) = 1d 2h 3m 4s\n"
+            "; layer_height = 0.2\n"
+            "; nozzle_diameter = 0.4,0.6\n"
+            "; printer_model = MK3S\n"
+        )
+        self.assertEqual(got["profile"], "Prusa i3 MK3S+")
+        self.assertEqual(got["slicer"], "PrusaSlicerProcessor")
+        self.assertEqual(
+            got["metadata"],
+            dict(
+                estimatedPrintTime=93784,
+                filamentLengths=[1234.5, 10],
+                layerHeight=0.2,
+                nozzleDiameters=[0.4, 0.6],
+            ),
+        )
+
+    def testKiriMoto(self):
+        got = self.extract(
+            "; Generated by Kiri:Moto\n; Target: Mini Prusa\n; sliceHeight = 0.25\n"
+            "G1 X1\n"
+            "; --- filament used: 1234.56 mm ---\n"
+            "; --- print time: 3600s ---\n"
+        )
+        self.assertEqual(
+            got["metadata"],
+            dict(
+                estimatedPrintTime=3600,
+                filamentLengths=[1234.56],
+                layerHeight=0.25,
+                nozzleDiameters=[],
+            ),
+        )
+
+    def testSimplify3D(self):
+        got = self.extract(
+            "; G-Code generated by Simplify3D(R) Version 4.1.2\n"
+            ";   profileName,Prusa Research Original Prusa i3 MK3\n"
+            ";   layerHeight,0.15\n"
+            ";   extruderDiameter,0.4\n"
+            "G1 X1\n"
+            "; Build Summary\n"
+            ";   Build time: 1 hours 2 minutes\n"
+            ";   Filament length: 4567.8 mm (4.57 m)\n"
+        )
+        self.assertEqual(got["profile"], "Prusa i3 MK3S+")
+        self.assertEqual(
+            got["metadata"],
+            dict(
+                estimatedPrintTime=3720,
+                filamentLengths=[4567.8],
+                layerHeight=0.15,
+                nozzleDiameters=[0.4],
+            ),
+        )
+
+    def testCura(self):
+        got = self.extract(
+            ";FLAVOR:Marlin\n;TIME:6666\n;Filament used: 1.5m, 0m\n"
+            ";Layer height: 0.12\n;Generated with Cura_SteamEngine 5.0.0\n"
+            "G1 X1\n"
+        )
+        self.assertEqual(got["slicer"], "CuraProcessor")
+        self.assertEqual(got["profile"], "")
+        self.assertEqual(
+            got["metadata"],
+            dict(
+                estimatedPrintTime=6666,
+                filamentLengths=[1500, 0],
+                layerHeight=0.12,
+                nozzleDiameters=[],
+            ),
+        )
+
+
 class TestFileParsing(unittest.TestCase):
     def testGetHeader(self):
         with tempfile.NamedTemporaryFile() as ntf:
@@ -60,3 +207,84 @@ class TestFileParsing(unittest.TestCase):
                     f.write(f"G0 X{i}\n")
                 f.write("; Line 1\n; Line 2\n")
             self.assertEqual(get_footer(ntf.name), ["; Line 1\n", "; Line 2\n"])
+
+    def testEmptyFile(self):
+        with tempfile.NamedTemporaryFile() as ntf:
+            self.assertEqual(get_header(ntf.name), [])
+            self.assertEqual(get_footer(ntf.name), [])
+
+    def testGetHeaderBudget(self):
+        with tempfile.NamedTemporaryFile() as ntf:
+            with open(ntf.name, "w") as f:
+                f.write("; Line 1\n; Line 2\n; Line 3\nG0 X5\n")
+            # Partial lines at the end of the budget are dropped
+            self.assertEqual(get_header(ntf.name, budget=12), ["; Line 1\n"])
+
+    def testGetFooterBudget(self):
+        with tempfile.NamedTemporaryFile() as ntf:
+            with open(ntf.name, "w") as f:
+                f.write("G0 X1\n; Line 1\n; Line 2\n; Line 3\n")
+            # No moves within the budget; partial lines are dropped
+            self.assertEqual(get_footer(ntf.name, budget=12), ["; Line 3\n"])
+            # Moves at the very start of the file are found
+            self.assertEqual(
+                get_footer(ntf.name), ["; Line 1\n", "; Line 2\n", "; Line 3\n"]
+            )
+
+    def testGetFooterSplitMultibyte(self):
+        with tempfile.NamedTemporaryFile() as ntf:
+            with open(ntf.name, "w", encoding="utf8") as f:
+                f.write("; ÄÖÜ\n; printer_model = MK3S\n")
+            want = "; printer_model = MK3S\n"
+            # Budgets landing inside the multibyte characters must not fail
+            for budget in range(len(want), os.path.getsize(ntf.name)):
+                with self.subTest(budget=budget):
+                    self.assertEqual(get_footer(ntf.name, budget=budget)[-1], want)
+                    get_header(ntf.name, budget=budget)
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        td = tempfile.TemporaryDirectory()
+        self.addCleanup(td.cleanup)
+        self.d = td.name
+        for f in ["a.gcode", "sub/b.gco", "c.stl", ".d.gcode"]:
+            os.makedirs(os.path.dirname(os.path.join(self.d, f)), exist_ok=True)
+            with open(os.path.join(self.d, f), "w") as fh:
+                fh.write("; Generated by Kiri:Moto\n; Target: Mini Prusa\nG0 X1\n")
+
+    def batch(self, paths):
+        out = io.StringIO()
+        batch(paths, workers=1, out=out)
+        return sorted(
+            [json.loads(ln) for ln in out.getvalue().splitlines()],
+            key=lambda r: r["path"],
+        )
+
+    def testBatchDirectory(self):
+        got = self.batch([self.d])
+        self.assertEqual(
+            [r["path"] for r in got],
+            [os.path.join(self.d, "a.gcode"), os.path.join(self.d, "sub/b.gco")],
+        )
+        for r in got:
+            self.assertEqual(r["profile"], "Prusa Mini")
+            self.assertEqual(r["slicer"], "KiriMotoProcessor")
+            self.assertEqual(r["hash"], "ce4358a5c1a6766015eeb0e4974c674586d7a0e9")
+            self.assertIn("extract_ms", r["timings"])
+
+    def testBatchMissingFile(self):
+        got = self.batch([os.path.join(self.d, "nope.gcode")])
+        self.assertIn("FileNotFoundError", got[0]["error"])
+
+    def testImportResults(self):
+        from ..storage.queries import getAnalysis
+
+        lines = [json.dumps(r) for r in self.batch([self.d, "nope.gcode"])]
+        with tempfile.NamedTemporaryFile() as db:
+            # Errors are skipped; the two identical files share a cache entry
+            self.assertEqual(import_results(lines, db.name), 2)
+            self.assertEqual(
+                getAnalysis("ce4358a5c1a6766015eeb0e4974c674586d7a0e9")["profile"],
+                "Prusa Mini",
+            )
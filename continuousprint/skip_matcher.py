@@ -0,0 +1,40 @@
+import string
+from collections import Counter
+
+
+class SkipMatcher:
+    """Matches gcode lines against a list of commands to skip (see
+    Keys.SKIP_GCODE_COMMANDS).
+
+    This runs for every line sent to the printer, so callers should first
+    check that a line's first character is in `firsts` - most lines can be
+    rejected that way without the full (case insensitive, comment-stripped)
+    comparison done by match().
+    """
+
+    def __init__(self, cmds):
+        self.cmds = frozenset(self.normalize(c) for c in cmds)
+        # Lines may have leading whitespace
+        firsts = set(string.whitespace)
+        for c in self.cmds:
+            if c == "":
+                firsts.add(";")  # Comment-only lines
+            else:
+                firsts.update((c[0], c[0].lower()))
+        self.firsts = frozenset(firsts)
+        self.counts = Counter()
+
+    @staticmethod
+    def normalize(line: str) -> str:
+        return line.split(";", 1)[0].strip().upper()
+
+    def match(self, line: str):
+        """Returns the matched (normalized) command if `line` should be
+        skipped, otherwise None."""
+        if line[:1] not in self.firsts or line.strip() == "":
+            return None
+        cmd = self.normalize(line)
+        if cmd not in self.cmds:
+            return None
+        self.counts[cmd] += 1
+        return cmd
@@ -0,0 +1,42 @@
+import unittest
+from .skip_matcher import SkipMatcher
+
+
+class TestSkipMatcher(unittest.TestCase):
+    def setUp(self):
+        self.m = SkipMatcher(["M117 Hello ; comment", "g28", "M84"])
+
+    def test_match(self):
+        for line, want in [
+            ("G1 X5", None),
+            ("M117 Hello", "M117 HELLO"),
+            ("m117 hello ; different comment", "M117 HELLO"),
+            ("   G28  ", "G28"),
+            ("G28 X", None),
+            ("M84", "M84"),
+            ("M8", None),
+            ("", None),
+            ("   ", None),
+            ("; just a comment", None),
+        ]:
+            with self.subTest(line=line):
+                self.assertEqual(self.m.match(line), want)
+
+    def test_counts(self):
+        for line in ["G28", "g28", "M84", "G1 X0"]:
+            self.m.match(line)
+        self.assertEqual(self.m.counts, {"G28": 2, "M84": 1})
+
+    def test_empty_command_matches_comments(self):
+        # A blank entry in the skip list matches comment-only lines, but never
+        # whitespace lines
+        m = SkipMatcher(["G28", ""])
+        self.assertEqual(m.match("; comment"), "")
+        self.assertEqual(m.match("  "), None)
+        self.assertEqual(m.match("G1 X0"), None)
+
+    def test_firsts(self):
+        # Any line that could match starts with one of `firsts`
+        for c in "MmGg \t;":
+            self.assertEqual(c in self.m.firsts, c != ";")
+        self.assertNotIn("X", self.m.firsts)
@@ -0,0 +1,31 @@
+import subprocess
+import sys
+import unittest
+from .scripts.benchmark_import import check, DEFERRED, PRELOADED
+
+
+class TestStartupImports(unittest.TestCase):
+    def test_check(self):
+        self.assertEqual(check([("a", 1000, 1000)], budget_ms=2, deferred=["b"]), [])
+        self.assertEqual(
+            len(check([("a", 3000, 3000), ("b", 1, 1)], budget_ms=2, deferred=["b"])),
+            2,
+        )
+
+    def test_heavy_imports_deferred(self):
+        # Importing the plugin happens while OctoPrint boots; heavy
+        # dependencies should be loaded on first use instead. Import time
+        # itself varies too much by machine to test here; see
+        # scripts/benchmark_import.py.
+        code = "; ".join(
+            [f"import {m}" for m in PRELOADED]
+            + [
+                "import sys",
+                "import continuousprint",
+                f"print([m for m in {DEFERRED!r} if m in sys.modules])",
+            ]
+        )
+        out = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        ).stdout
+        self.assertEqual(out.strip(), "[]")
@@ -39,10 +39,16 @@ function CPQueue(data, api, files, profile, materials, stats_dimensions=CP_STATS
     self.details = ko.observable("");
     self.fullDetails = ko.observable("");
     self.showStats = ko.observable(true);
-    self.ready = ko.observable(data.name === 'local' || Object.keys(data.peers).length > 0);
+    self.ready = ko.observable(data.name === 'local' || (Object.keys(data.peers).length > 0 && !data.provisional));
     if (self.addr !== null && data.peers !== undefined) {
       let pkeys = Object.keys(data.peers);
-      if (pkeys.length === 0) {
+      if (data.connecting) {
+        self.details(`(connecting...)`);
+        self.fullDetails('Joining the network queue');
+      } else if (data.provisional) {
+        self.details(`(reconnecting...)`);
+        self.fullDetails('Showing jobs as of the last restart until the network queue is ready');
+      } else if (pkeys.length === 0) {
         self.details(`(connecting...)`);
         self.fullDetails('Searching for other printers with this queue\non the local network - this could take up to a minute');
       } else {
@@ -286,6 +292,16 @@ function CPQueue(data, api, files, profile, materials, stats_dimensions=CP_STATS
         for (let tool of Object.values(fila)) {
           meta.filamentLengths.push(tool.length);
         }
+
+        // Fall back to slicer estimates extracted by CPQ analysis, which
+        // usually completes well before OctoPrint's own analysis
+        let cpq = (f.continuousprint || {}).metadata || {};
+        if (meta.estimatedPrintTime === undefined || meta.estimatedPrintTime === null) {
+          meta.estimatedPrintTime = (cpq.estimatedPrintTime !== undefined) ? cpq.estimatedPrintTime : null;
+        }
+        if (meta.filamentLengths.length === 0) {
+          meta.filamentLengths = cpq.filamentLengths || [];
+        }
       }
       return JSON.stringify(meta);
     }
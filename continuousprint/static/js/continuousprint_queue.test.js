@@ -159,6 +159,15 @@ test('addFile (profile inference disabled)', () => {
   }, expect.any(Function));
 });
 
+test('addFile uses CPQ analysis metadata if OctoPrint analysis missing', () => {
+  let v = init(njobs=0);
+  v.files.elementByPath = (p) => { return {continuousprint: {metadata: {estimatedPrintTime: 123, filamentLengths: [456]}}}};
+  v.addFile({name: "foo", path: "foo.gcode", origin: "local"});
+  expect(v.api.add).toHaveBeenCalledWith(v.api.SET, expect.objectContaining({
+     "metadata": "{\"estimatedPrintTime\":123,\"filamentLengths\":[456]}",
+  }), expect.any(Function));
+});
+
 test('addFile (profile inference enabled)', () => {
   let v = init(njobs=0);
   v.addFile({name: "foo", path: "foo.gcode", origin: "local", continuousprint: {profile: "testprof"}}, true);
@@ -173,3 +182,12 @@ test('addFile (profile inference enabled)', () => {
      "metadata": "{\"estimatedPrintTime\":null,\"filamentLengths\":[]}",
   }, expect.any(Function));
 });
+
+test('provisional LAN queue is shown but not ready', () => {
+  let v = new VM({name:"LAN", addr: "0.0.0.0:0", jobs:items(1), provisional: true, peers:{
+    "peer": {name: "peer", profile: {name: "profile"}, status: "IDLE", active_set: null},
+  }}, mockapi(), mockfiles(), mockprofile(), mockmaterials());
+  expect(v.jobs().length).toEqual(1);
+  expect(v.ready()).toEqual(false);
+  expect(v.details()).toEqual("(reconnecting...)");
+});
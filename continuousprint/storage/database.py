@@ -16,15 +16,16 @@ from peewee import (
 )
 from playhouse.migrate import SqliteMigrator, migrate
 
-from ..data import CustomEvents, PREPROCESSORS
+from ..data import CustomEvents
+from .keymask import profile_mask, profile_bit, material_mask
 from collections import defaultdict
 import datetime
+import json
 from enum import IntEnum, auto
 import sys
 import logging
 import inspect
 import os
-import yaml
 import time
 
 
@@ -40,6 +41,7 @@ class DB:
     # Adding foreign_keys pragma is necessary for ON DELETE behavior
     queues = SqliteDatabase(None, pragmas={"foreign_keys": 1})
     automation = SqliteDatabase(None, pragmas={"foreign_keys": 1})
+    analysis = SqliteDatabase(None)
 
 
 CURRENT_SCHEMA_VERSION = "0.0.4"
@@ -81,6 +83,27 @@ class EventHook(Model):
         database = DB.automation
 
 
+class AnalysisResult(Model):
+    # Keyed by sha1 of file content, same as OctoPrint's file metadata "hash"
+    hash = CharField(unique=True)
+    created = DateTimeField(default=datetime.datetime.now)
+    result = TextField()  # JSON
+
+    class Meta:
+        database = DB.analysis
+
+
+class ScanEntry(Model):
+    # Files seen by the analysis backlog scan; path is relative to LOCAL storage
+    path = CharField(unique=True)
+    mtime = FloatField()
+    size = IntegerField()
+    analyzed = BooleanField(default=False)
+
+    class Meta:
+        database = DB.analysis
+
+
 class StorageDetails(Model):
     schemaVersion = CharField(unique=True)
 
@@ -135,21 +158,53 @@ class JobView:
         else:
             return nxt
 
+    def peek_set(self, profile, custom_filter=None):
+        """Returns the set that next_set() would, without decrementing the
+        job (and so without saving it) to get there."""
+        if self.draft or self.queue.name == ARCHIVE_QUEUE or self.remaining == 0:
+            return None
+
+        nxt, any_printable = self._next_set(profile, custom_filter)
+        if nxt is not None or not any_printable or self.remaining <= 1:
+            return nxt
+        # Decrementing would refresh every set back to its full count
+        bit = profile_bit(profile["name"])
+        for s in sorted(self.sets, key=lambda s: s.rank):
+            if custom_filter is not None and not custom_filter(s):
+                continue
+            if s.count > 0 and s.matches_profile(bit):
+                return s
+        return None
+
     def _next_set(self, profile, custom_filter):
         # Return value: (set: SetView, any_printable: bool)
         # Second argument is whether there's any printable sets
         # for the given profile/filter. If this is False then
         # decrementing the set/job won't do anything WRT set availability
         any_printable = False
+        bit = profile_bit(profile["name"])
         for s in sorted(self.sets, key=lambda s: s.rank):
             if custom_filter is not None and not custom_filter(s):
                 continue
-            printable = s.is_printable(profile)
+            printable = s.matches_profile(bit)
             any_printable = any_printable or printable
             if s.remaining > 0 and printable:
                 return (s, True)
         return (None, any_printable)
 
+    def remaining_print_time(self, default=0) -> float:
+        """Estimated seconds to print all remaining work in the job. Sets
+        without an estimate count as `default` seconds per print."""
+        per_run = 0
+        this_run = 0
+        for s in self.sets:
+            est = s.estimated_print_time()
+            if est is None:
+                est = default
+            per_run += est * s.count
+            this_run += est * s.remaining
+        return this_run + per_run * max(self.remaining - 1, 0)
+
     @classmethod
     def from_dict(self, data: dict):
         raise NotImplementedError
@@ -215,11 +270,48 @@ class SetView:
     def profiles(self):
         return self._csv2list(self.profile_keys)
 
+    # Bitmasks of profile_keys and material_keys (see keymask.py), computed
+    # when the view is built or saved rather than on every check.
+    _profile_mask = None
+    _material_mask = None
+
+    def _update_masks(self):
+        self._profile_mask = profile_mask(self._csv2list(self.profile_keys or ""))
+        self._material_mask = material_mask(self._csv2list(self.material_keys or ""))
+
+    def profile_mask(self) -> int:
+        if self._profile_mask is None:
+            self._update_masks()
+        return self._profile_mask
+
+    def material_mask(self) -> int:
+        if self._material_mask is None:
+            self._update_masks()
+        return self._material_mask
+
+    def estimated_print_time(self):
+        """Slicer/analysis estimate of seconds per print, if known"""
+        meta = self.metadata
+        if type(meta) == str:
+            try:
+                meta = json.loads(meta)
+            except ValueError:
+                return None
+        if type(meta) != dict:
+            return None
+        est = meta.get("estimatedPrintTime")
+        return float(est) if type(est) in (int, float) else None
+
     def is_printable(self, profile):
-        profs = self.profiles()
-        if len(profs) == 0 or profile["name"] in profs:
-            return True
-        return False
+        return self.matches_profile(profile_bit(profile["name"]))
+
+    def matches_profile(self, bit) -> bool:
+        # is_printable() for a profile_bit() looked up once by the caller, as
+        # scheduling checks many sets against the same profile.
+        mask = self._profile_mask
+        if mask is None:
+            mask = self.profile_mask()
+        return not mask or (mask & bit) != 0
 
     def decrement(self, profile):
         self.remaining = max(0, self.remaining - 1)
@@ -297,6 +389,15 @@ class Set(Model, SetView):
     class Meta:
         database = DB.queues
 
+    def __init__(self, *args, **kwargs):
+        # Also called by peewee for each row loaded
+        super().__init__(*args, **kwargs)
+        self._update_masks()
+
+    def save(self, *args, **kwargs):
+        self._update_masks()
+        return super().save(*args, **kwargs)
+
     @classmethod
     def from_dict(self, s):
         for listform, csvform in [
@@ -358,6 +459,7 @@ def file_exists(path: str) -> bool:
 
 MODELS = [Queue, Job, Set, Run, StorageDetails]
 AUTOMATION = [Script, EventHook, Preprocessor]
+ANALYSIS = [AnalysisResult, ScanEntry]
 
 
 def populate_queues():
@@ -374,13 +476,17 @@ def populate_automation():
     fin = Script.create(name=FINISHING_SCRIPT, body="@pause")
     EventHook.create(name=CustomEvents.PRINT_SUCCESS.event, script=bc, rank=0)
     EventHook.create(name=CustomEvents.FINISH.event, script=fin, rank=0)
+    from ..data import PREPROCESSORS
+
     for pp in PREPROCESSORS.values():
         Preprocessor.create(name=pp["name"], body=pp["body"])
 
 
-def init_db(automation_db, queues_db, logger=None):
+def init_db(automation_db, queues_db, analysis_db=None, logger=None):
     init_automation(automation_db, logger)
     init_queues(queues_db, logger)
+    if analysis_db is not None:
+        init_analysis(analysis_db, logger)
 
 
 def init_automation(db_path, logger=None):
@@ -395,6 +501,16 @@ def init_automation(db_path, logger=None):
         populate_automation()
 
 
+def init_analysis(db_path, logger=None):
+    # The analysis DB is purely a cache; it has no schema versioning and can be
+    # deleted at any time.
+    db = DB.analysis
+    db.init(None)
+    db.init(db_path)
+    db.connect()
+    db.create_tables(ANALYSIS, safe=True)
+
+
 def migrateQueuesV2ToV3(details, logger):
     # Constraint removal isn't allowed in sqlite, so we have
     # to recreate the table and move the entries over.
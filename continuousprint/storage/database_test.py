@@ -7,6 +7,7 @@ from .database import (
     init_db,
     init_queues,
     init_automation,
+    init_analysis,
     Queue,
     migrateQueuesV2ToV3,
     Job,
@@ -20,6 +21,7 @@ from .database import (
     STLResolveError,
 )
 from ..data import CustomEvents
+from .keymask import profile_bit
 import tempfile
 
 # logging.basicConfig(level=logging.DEBUG)
@@ -40,6 +42,13 @@ class AutomationDBTest(unittest.TestCase):
         init_automation(self.tmpAutomation.name)
 
 
+class AnalysisDBTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpAnalysis = tempfile.NamedTemporaryFile(delete=True)
+        self.addCleanup(self.tmpAnalysis.close)
+        init_analysis(self.tmpAnalysis.name)
+
+
 class DBTest(QueuesDBTest, AutomationDBTest):
     def setUp(self):
         AutomationDBTest.setUp(self)
@@ -222,6 +231,21 @@ class TestJobWithSet(QueuesDBTest):
         self.s.save()
         self.assertEqual(self.j.next_set(dict(name="baz")), None)
 
+    def testPeekSetDoesNotDecrement(self):
+        self.s.remaining = 0
+        self.s.save()
+        self.assertEqual(self.j.peek_set(dict(name="baz")), self.s)
+        self.assertEqual(Job.get(id=self.j.id).remaining, 5)
+        self.assertEqual(self.j.next_set(dict(name="baz")), self.s)
+        self.assertEqual(Job.get(id=self.j.id).remaining, 4)
+
+    def testPeekSetLastRun(self):
+        self.j.remaining = 1
+        self.s.remaining = 0
+        self.s.save()
+        self.assertEqual(self.j.peek_set(dict(name="baz")), None)
+        self.assertEqual(self.j.next_set(dict(name="baz")), None)
+
     def testDecrementUnstartedSet(self):
         self.j.decrement()
         self.assertEqual(self.j.remaining, 4)
@@ -254,6 +278,32 @@ class TestJobWithSet(QueuesDBTest):
         self.j.decrement()
         self.assertEqual(self.j.remaining, 0)
 
+    def testEstimatedPrintTime(self):
+        for meta, want in [
+            (None, None),
+            ("", None),
+            ("not json", None),
+            ('{"estimatedPrintTime": null}', None),
+            ('{"estimatedPrintTime": 60}', 60),
+            ('{"estimatedPrintTime": 12.5}', 12.5),
+        ]:
+            self.s.metadata = meta
+            self.assertEqual(self.s.estimated_print_time(), want)
+
+    def testRemainingPrintTime(self):
+        self.s.metadata = '{"estimatedPrintTime": 10}'
+        self.s.remaining = 2
+        self.s.save()
+        j = Job.get(id=self.j.id)
+        self.assertEqual(j.remaining_print_time(), 2 * 10 + 4 * 5 * 10)
+        j.remaining = 1
+        self.assertEqual(j.remaining_print_time(), 2 * 10)
+        self.s.metadata = None
+        self.s.save()
+        j = Job.get(id=self.j.id)
+        self.assertEqual(j.remaining_print_time(), 0)
+        self.assertEqual(j.remaining_print_time(default=1), 2 + 4 * 5)
+
     def testFromDict(self):
         Set.create(
             path="a",
@@ -393,3 +443,28 @@ class TestSet(QueuesDBTest):
     def test_materials_many(self):
         self.s.material_keys = "asdf,ghjk,zxcv"
         self.assertEqual(self.s.materials(), ["asdf", "ghjk", "zxcv"])
+
+    def test_is_printable(self):
+        self.assertTrue(self.s.is_printable(dict(name="p1")))
+        self.assertTrue(self.s.is_printable(dict(name="p2")))
+        self.assertFalse(self.s.is_printable(dict(name="p3")))
+        self.s.profile_keys = ""
+        self.s.save()
+        self.assertTrue(self.s.is_printable(dict(name="p3")))
+
+    def test_masks_updated_on_save(self):
+        self.assertFalse(self.s.is_printable(dict(name="p3")))
+        self.s.profile_keys = "p3"
+        self.s.save()
+        self.assertTrue(self.s.is_printable(dict(name="p3")))
+
+        m = self.s.material_mask()
+        self.s.material_keys = "m2,m1"
+        self.s.save()
+        self.assertNotEqual(self.s.material_mask(), m)
+
+    def test_masks_computed_on_load(self):
+        s = Set.get(id=self.s.id)
+        self.assertNotEqual(s.__dict__.get("_profile_mask"), None)
+        self.assertTrue(s.matches_profile(profile_bit("p1")))
+        self.assertFalse(s.matches_profile(profile_bit("p3")))
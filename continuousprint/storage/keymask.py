@@ -0,0 +1,65 @@
+from threading import Lock
+
+
+class KeyInterner:
+    """Assigns small integer IDs to string keys (e.g. printer profile names) so
+    that sets of keys can be represented as integer bitmasks.
+
+    IDs are only meaningful within a single process and are never persisted.
+    """
+
+    def __init__(self):
+        self._ids = dict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def bit(self, key, create=True) -> int:
+        i = self._ids.get(key)
+        if i is None:
+            if not create:
+                return 0
+            with self._lock:
+                i = self._ids.setdefault(key, len(self._ids))
+        return 1 << i
+
+    def mask(self, keys) -> int:
+        m = 0
+        for k in keys:
+            m |= self.bit(k)
+        return m
+
+
+PROFILES = KeyInterner()
+
+# Material constraints are positional (one per tool), so materials are
+# interned as (tool index, material key) pairs.
+MATERIALS = KeyInterner()
+
+
+def profile_mask(profiles) -> int:
+    return PROFILES.mask(profiles)
+
+
+def profile_bit(name) -> int:
+    # Interned so that the bit stays valid for sets whose masks are computed
+    # after the lookup; a profile no set names still matches nothing.
+    return PROFILES.bit(name)
+
+
+def material_mask(materials) -> int:
+    # None and "" both mean "any material" for that tool
+    return MATERIALS.mask(
+        [(i, m) for i, m in enumerate(materials) if m is not None and m != ""]
+    )
+
+
+def materials_satisfied(required: int, loaded: int) -> bool:
+    return required & loaded == required
+
+
+def materials_missing(required: int, loaded: int) -> int:
+    # Each tool contributes at most one bit to `required`, so this is the
+    # number of tools needing a manual material change.
+    return bin(required & ~loaded).count("1")
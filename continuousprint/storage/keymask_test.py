@@ -0,0 +1,65 @@
+import unittest
+from .keymask import (
+    KeyInterner,
+    material_mask,
+    materials_missing,
+    materials_satisfied,
+    profile_bit,
+    profile_mask,
+)
+
+
+class TestKeyInterner(unittest.TestCase):
+    def test_stable_bits(self):
+        ki = KeyInterner()
+        self.assertEqual(ki.bit("a"), 1)
+        self.assertEqual(ki.bit("b"), 2)
+        self.assertEqual(ki.bit("a"), 1)
+        self.assertEqual(len(ki), 2)
+
+    def test_no_create(self):
+        ki = KeyInterner()
+        self.assertEqual(ki.bit("a", create=False), 0)
+        self.assertEqual(len(ki), 0)
+
+    def test_mask(self):
+        ki = KeyInterner()
+        self.assertEqual(ki.mask([]), 0)
+        self.assertEqual(ki.mask(["a", "b", "a"]), 3)
+
+
+class TestMasks(unittest.TestCase):
+    def test_profile(self):
+        m = profile_mask(["keymask_p1", "keymask_p2"])
+        self.assertNotEqual(m & profile_bit("keymask_p1"), 0)
+        self.assertEqual(m & profile_bit("keymask_unknown"), 0)
+
+    def test_materials_positional(self):
+        loaded = material_mask(["keymask_m1", "keymask_m2"])
+        self.assertTrue(materials_satisfied(material_mask(["keymask_m1"]), loaded))
+        self.assertTrue(
+            materials_satisfied(material_mask([None, "keymask_m2"]), loaded)
+        )
+        self.assertTrue(materials_satisfied(material_mask(["", "keymask_m2"]), loaded))
+        self.assertFalse(
+            materials_satisfied(material_mask(["keymask_m2", "keymask_m1"]), loaded)
+        )
+
+    def test_no_constraints(self):
+        self.assertTrue(materials_satisfied(material_mask([]), 0))
+        self.assertTrue(materials_satisfied(material_mask([None, ""]), 0))
+        self.assertFalse(materials_satisfied(material_mask(["keymask_m1"]), 0))
+
+    def test_missing(self):
+        loaded = material_mask(["keymask_m1", "keymask_m2"])
+        self.assertEqual(materials_missing(material_mask([]), loaded), 0)
+        self.assertEqual(materials_missing(material_mask(["keymask_m1"]), loaded), 0)
+        self.assertEqual(
+            materials_missing(material_mask(["keymask_m2", "keymask_m2"]), loaded), 1
+        )
+        self.assertEqual(
+            materials_missing(
+                material_mask(["keymask_m2", "keymask_m1", "keymask_m3"]), loaded
+            ),
+            3,
+        )
@@ -27,9 +27,6 @@ class LANJobView(JobView):
         self.peer = manifest["peer_"]
         self.hash = manifest.get("hash")
 
-    def get_base_dir(self):
-        return self.queue.lq.get_gjob_dirpath(self.peer, self.hash)
-
     def remap_set_paths(self):
         # Replace all relative/local set paths with fully resolved paths
         for s in self.sets:
@@ -67,17 +64,40 @@ class LANSetView(SetView):
         self.remaining = getint(data, "remaining", default=self.count)
         self.completed = getint(data, "completed")
         self.metadata = data.get("metadata")
+        # Content hash of the set's file; None for jobs packed as a .gjob
+        self.blob = data.get("blob")
         self.material_keys = ",".join(data.get("materials", []))
         self.profile_keys = ",".join(data.get("profiles", []))
         self._resolved = None
 
+        # Precompute compatibility masks; these views are rebuilt on every
+        # manifest change so the masks never go stale.
+        self._update_masks()
+
     def resolve(self, override=None) -> str:
         if self._resolved is None:
             try:
-                self._resolved = str(Path(self.job.get_base_dir()) / self.path)
+                if self.blob is not None:
+                    self._resolved = str(
+                        self.job.queue.lq.get_blob_path(
+                            self.job.peer, self.blob, self.path
+                        )
+                    )
+                else:
+                    self._resolved = str(
+                        self.job.queue.lq.get_gjob_file(
+                            self.job.peer, self.job.hash, self.path
+                        )
+                    )
             except HTTPError as e:
                 raise LANResolveError(f"Failed to resolve {self.path}") from e
         return super().resolve(override)
 
+    def as_dict(self):
+        d = super().as_dict()
+        if self.blob is not None:
+            d["blob"] = self.blob
+        return d
+
     def save(self):
         self.job.save()
@@ -23,23 +23,32 @@ class LANViewTest(unittest.TestCase):
         self.s = self.j.sets[0]
 
     def test_resolve_file(self):
-        self.lq.get_gjob_dirpath.return_value = "/path/to/"
+        self.j.hash = "hash"
+        self.lq.get_gjob_file.return_value = "/path/to/a.gcode"
         self.assertEqual(self.s.resolve(), "/path/to/a.gcode")
+        self.lq.get_gjob_file.assert_called_with("asdf:6789", "hash", "a.gcode")
+
+    def test_resolve_blob(self):
+        self.s.blob = "sha"
+        self.lq.get_blob_path.return_value = "/blobs/sha/a.gcode"
+        self.assertEqual(self.s.resolve(), "/blobs/sha/a.gcode")
+        self.lq.get_blob_path.assert_called_with("asdf:6789", "sha", "a.gcode")
+        self.lq.get_gjob_file.assert_not_called()
 
     def test_resolve_stl(self):
         # Ensure STL checking from the parent class is still triggered
         self.j.sets[0].path = "a.stl"
-        self.lq.get_gjob_dirpath.return_value = "/path/to/"
+        self.lq.get_gjob_file.return_value = "/path/to/a.stl"
         with self.assertRaises(STLResolveError):
             self.s.resolve()
 
     def test_remap_set_paths(self):
-        self.lq.get_gjob_dirpath.return_value = "/path/to/"
+        self.lq.get_gjob_file.return_value = "/path/to/a.gcode"
         self.j.remap_set_paths()
         self.assertEqual(self.s.path, "/path/to/a.gcode")
 
     def test_resolve_http_error(self):
-        self.lq.get_gjob_dirpath.side_effect = HTTPError
+        self.lq.get_gjob_file.side_effect = HTTPError
         with self.assertRaises(LANResolveError):
             self.s.resolve()
 
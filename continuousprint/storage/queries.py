@@ -1,9 +1,10 @@
-from peewee import IntegrityError, JOIN, fn
+from peewee import IntegrityError, JOIN, fn, chunked
 from typing import Optional
 from datetime import datetime
 import re
 import time
 import base64
+import json
 
 from pathlib import Path
 from .database import (
@@ -17,6 +18,8 @@ from .database import (
     EventHook,
     Preprocessor,
     Script,
+    AnalysisResult,
+    ScanEntry,
 )
 from ..data import CustomEvents
 
@@ -348,6 +351,12 @@ def appendSet(queue: str, jid, data: dict, rank=_rankEnd):
     return dict(job_id=j.id, set_=s.as_dict())
 
 
+def appendSets(queue: str, items: list):
+    # Appends each (jid, data) item as with appendSet(), in one transaction
+    with DB.queues.atomic():
+        return [appendSet(queue, jid, data) for (jid, data) in items]
+
+
 def remove(queue_ids: list = [], job_ids: list = [], set_ids: list = []):
     result = {}
     with DB.queues.atomic():
@@ -510,3 +519,44 @@ def getAutomationForEvent(evt: CustomEvents) -> list:
             .order_by(EventHook.rank)
         )
     ]
+
+
+def getAnalysis(content_hash: str) -> Optional[dict]:
+    r = AnalysisResult.get_or_none(AnalysisResult.hash == content_hash)
+    if r is None:
+        return None
+    result = json.loads(r.result)
+    if not result.get("profile"):
+        return None  # Stored before unmatched results stopped being cached
+    return result
+
+
+def setAnalysis(content_hash: str, result: dict):
+    # Files that matched no profile may match once the profile list is
+    # updated, so only successful matches are cached.
+    if not result.get("profile"):
+        AnalysisResult.delete().where(AnalysisResult.hash == content_hash).execute()
+        return
+    AnalysisResult.replace(hash=content_hash, result=json.dumps(result)).execute()
+
+
+def getScanIndex() -> dict:
+    return dict(
+        (e.path, (e.mtime, e.size, e.analyzed)) for e in ScanEntry.select().execute()
+    )
+
+
+def updateScanIndex(changed: list, removed: list):
+    # changed is a list of (path, mtime, size) tuples, which are (re)marked as
+    # needing analysis
+    with DB.analysis.atomic():
+        for batch in chunked(changed, 100):
+            ScanEntry.replace_many(
+                [dict(path=p, mtime=m, size=sz, analyzed=False) for p, m, sz in batch]
+            ).execute()
+        for batch in chunked(removed, 100):
+            ScanEntry.delete().where(ScanEntry.path.in_(batch)).execute()
+
+
+def markAnalyzed(path: str):
+    ScanEntry.update(analyzed=True).where(ScanEntry.path == path).execute()
@@ -7,6 +7,7 @@ import datetime
 import tempfile
 import os
 import time
+import json
 
 # logging.basicConfig(level=logging.DEBUG)
 
@@ -20,8 +21,9 @@ from .database import (
     EventHook,
     Script,
     Preprocessor,
+    AnalysisResult,
 )
-from .database_test import QueuesDBTest, AutomationDBTest
+from .database_test import QueuesDBTest, AutomationDBTest, AnalysisDBTest
 from ..storage import queries as q
 
 PROFILE = dict(name="profile")
@@ -81,6 +83,28 @@ class TestEmptyQueue(QueuesDBTest):
             dict(job_id=2, set_=ANY),
         )
 
+    def testAppendSets(self):
+        got = q.appendSets(
+            DEFAULT_QUEUE,
+            [
+                ("", dict(path="a.gcode", sd=False, count=1)),
+                ("", dict(path="b.gcode", sd=False, count=1)),
+            ],
+        )
+        self.assertEqual([g["job_id"] for g in got], [1, 2])
+        self.assertEqual(len(q.getJobsAndSets(DEFAULT_QUEUE)), 2)
+
+    def testAppendSetsRollsBack(self):
+        with self.assertRaises(KeyError):
+            q.appendSets(
+                DEFAULT_QUEUE,
+                [
+                    ("", dict(path="a.gcode", sd=False, count=1)),
+                    ("", dict(sd=False, count=1)),  # No path
+                ],
+            )
+        self.assertEqual(len(q.getJobsAndSets(DEFAULT_QUEUE)), 0)
+
     def testNewEmptyJob(self):
         q.newEmptyJob(DEFAULT_QUEUE)
         self.assertEqual(len(q.getJobsAndSets(DEFAULT_QUEUE)), 1)
@@ -211,7 +235,7 @@ class TestSingleItemQueue(QueuesDBTest):
                 j.count = max(before[1], 1)
                 j.save()
 
-                s.decrement(dict(name=PROFILE))
+                s.decrement(PROFILE)
 
                 s = Set.get(id=s.id)
                 j = Job.get(id=j.id)
@@ -308,7 +332,7 @@ class TestMultiItemQueue(QueuesDBTest):
     def testGetNextJobAfterDecrement(self):
         j = q.getNextJobInQueue(DEFAULT_QUEUE, PROFILE)
         s = j.sets[0]
-        s.decrement(dict(name=PROFILE))
+        s.decrement(PROFILE)
         j2 = q.getNextJobInQueue(DEFAULT_QUEUE, PROFILE)
         self.assertEqual(j2.id, j.id)
         self.assertEqual(j2.sets[0].remaining, 0)
@@ -434,3 +458,41 @@ class TestAutomation(AutomationDBTest):
             [a[0] for a in q.getAutomationForEvent(CustomEvents.PRINT_SUCCESS)],
             ["gcode2", "gcode1"],
         )
+
+
+class TestAnalysis(AnalysisDBTest):
+    def test_get_missing(self):
+        self.assertEqual(q.getAnalysis("abc"), None)
+
+    def test_set_get(self):
+        q.setAnalysis("abc", dict(profile="foo"))
+        self.assertEqual(q.getAnalysis("abc"), dict(profile="foo"))
+
+    def test_set_overwrites(self):
+        q.setAnalysis("abc", dict(profile="foo"))
+        q.setAnalysis("abc", dict(profile="bar"))
+        self.assertEqual(q.getAnalysis("abc"), dict(profile="bar"))
+
+    def test_set_no_profile_not_cached(self):
+        q.setAnalysis("abc", dict(profile="foo"))
+        q.setAnalysis("abc", dict(profile=None))
+        self.assertEqual(q.getAnalysis("abc"), None)
+        q.setAnalysis("def", dict(profile=""))
+        self.assertEqual(q.getAnalysis("def"), None)
+
+    def test_get_ignores_cached_no_profile(self):
+        AnalysisResult.create(hash="abc", result=json.dumps(dict(profile=None)))
+        self.assertEqual(q.getAnalysis("abc"), None)
+
+    def test_scan_index(self):
+        self.assertEqual(q.getScanIndex(), dict())
+        q.updateScanIndex([("a.gcode", 1.5, 10), ("b.gcode", 2.0, 20)], [])
+        q.markAnalyzed("a.gcode")
+        self.assertEqual(
+            q.getScanIndex(),
+            {"a.gcode": (1.5, 10, True), "b.gcode": (2.0, 20, False)},
+        )
+
+        # Changed files need analysis again; removed files are dropped
+        q.updateScanIndex([("a.gcode", 3.0, 11)], ["b.gcode"])
+        self.assertEqual(q.getScanIndex(), {"a.gcode": (3.0, 11, False)})
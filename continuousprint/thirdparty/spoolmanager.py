@@ -1,5 +1,6 @@
 from octoprint.server import app
 import json
+import time
 
 
 class SpoolManagerException(Exception):
@@ -7,11 +8,33 @@ class SpoolManagerException(Exception):
 
 
 class SpoolManagerIntegration:
-    def __init__(self, impl, logger):
+    # Cached values are invalidated by SpoolManager's spool (de)selection events
+    # (see CPQPlugin.on_event), but also expire after this long in case an event
+    # is missed or spools are edited through some other means.
+    CACHE_TTL_SEC = 60.0
+    MAX_ALLOWED_ENTRIES = 32
+
+    def __init__(self, impl, logger, ttl=CACHE_TTL_SEC):
         self._logger = logger
         self._impl = impl
+        self._ttl = ttl
+        self._materials = None
+        self._materials_ts = 0
+        self._allowed = dict()
+
+    def invalidate(self):
+        self._materials = None
+        self._allowed = dict()
+
+    def _fresh(self, ts, now):
+        return now < ts + self._ttl
+
+    def get_materials(self, now=None):
+        if now is None:
+            now = time.time()
+        if self._materials is not None and self._fresh(self._materials_ts, now):
+            return list(self._materials)
 
-    def get_materials(self):
         try:
             materials = self._impl.api_getSelectedSpoolInformations()
             materials = [
@@ -20,23 +43,46 @@ class SpoolManagerIntegration:
                 else None
                 for m in materials
             ]
-            return materials
         except Exception as e:
             self._logger.warning(
                 f"Skipping material assignment due to SpoolManager error: {e}"
             )
             return []
 
-    def allowed_to_print(self):
+        self._materials = materials
+        self._materials_ts = now
+        return list(materials)
+
+    def allowed_to_print(self, path=None, now=None):
+        # The verdict only changes when the file or the selected spools change
+        # (or when filament is consumed, see start_print_confirmed) so we memoize
+        # it when the caller tells us which file is being checked.
+        if now is None:
+            now = time.time()
+        key = None
+        if path is not None:
+            key = (path, tuple(self.get_materials(now)))
+            cached = self._allowed.get(key)
+            if cached is not None and self._fresh(cached[0], now):
+                return cached[1]
+
         with app.app_context():
             r = self._impl.allowed_to_print()
         if r.status_code != 200:
             raise SpoolManagerException(
                 f"SpoolManager allowed_to_print() error: {r.data}"
             )
-        return json.loads(r.data)
+        result = json.loads(r.data)
+
+        if key is not None:
+            if len(self._allowed) >= self.MAX_ALLOWED_ENTRIES:
+                self._allowed = dict()
+            self._allowed[key] = (now, result)
+        return result
 
     def start_print_confirmed(self):
+        # Starting a print consumes filament, so prior verdicts may no longer hold.
+        self._allowed = dict()
         with app.app_context():
             r = self._impl.start_print_confirmed()
         if r.status_code != 200:
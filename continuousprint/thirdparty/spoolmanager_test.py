@@ -22,6 +22,82 @@ class TestSpoolManagerIntegration(unittest.TestCase):
         self.s._impl.api_getSelectedSpoolInformations.side_effect = Exception("testing")
         self.assertEqual(self.s.get_materials(), [])
 
+    def test_get_materials_cached(self):
+        self.s._impl.api_getSelectedSpoolInformations.return_value = [
+            dict(material="PLA", colorName="red", color="FF0000"),
+        ]
+        self.assertEqual(self.s.get_materials(now=0), ["PLA_red_FF0000"])
+        self.assertEqual(self.s.get_materials(now=1), ["PLA_red_FF0000"])
+        self.s._impl.api_getSelectedSpoolInformations.assert_called_once()
+
+    def test_get_materials_ttl_expired(self):
+        self.s._impl.api_getSelectedSpoolInformations.return_value = []
+        self.s.get_materials(now=0)
+        self.s.get_materials(now=SpoolManagerIntegration.CACHE_TTL_SEC + 1)
+        self.assertEqual(self.s._impl.api_getSelectedSpoolInformations.call_count, 2)
+
+    def test_get_materials_invalidated(self):
+        self.s._impl.api_getSelectedSpoolInformations.return_value = []
+        self.s.get_materials(now=0)
+        self.s.invalidate()
+        self.s.get_materials(now=1)
+        self.assertEqual(self.s._impl.api_getSelectedSpoolInformations.call_count, 2)
+
+    def test_get_materials_exception_not_cached(self):
+        self.s._impl.api_getSelectedSpoolInformations.side_effect = [
+            Exception("testing"),
+            [dict(material="PLA", colorName="red", color="FF0000")],
+        ]
+        self.assertEqual(self.s.get_materials(now=0), [])
+        self.assertEqual(self.s.get_materials(now=1), ["PLA_red_FF0000"])
+
+    def test_allowed_to_print_memoized(self):
+        self.s._impl.api_getSelectedSpoolInformations.return_value = []
+        self.s._impl.allowed_to_print.return_value = MagicMock(
+            status_code=200, data="123"
+        )
+        self.assertEqual(self.s.allowed_to_print("a.gcode", now=0), 123)
+        self.assertEqual(self.s.allowed_to_print("a.gcode", now=1), 123)
+        self.s._impl.allowed_to_print.assert_called_once()
+
+        # Different file is a different verdict
+        self.s.allowed_to_print("b.gcode", now=1)
+        self.assertEqual(self.s._impl.allowed_to_print.call_count, 2)
+
+    def test_allowed_to_print_spools_changed(self):
+        self.s._impl.api_getSelectedSpoolInformations.return_value = []
+        self.s._impl.allowed_to_print.return_value = MagicMock(
+            status_code=200, data="123"
+        )
+        self.s.allowed_to_print("a.gcode", now=0)
+        self.s._impl.api_getSelectedSpoolInformations.return_value = [
+            dict(material="PLA", colorName="red", color="FF0000"),
+        ]
+        self.s.invalidate()
+        self.s.allowed_to_print("a.gcode", now=1)
+        self.assertEqual(self.s._impl.allowed_to_print.call_count, 2)
+
+    def test_allowed_to_print_no_path_not_memoized(self):
+        self.s._impl.allowed_to_print.return_value = MagicMock(
+            status_code=200, data="123"
+        )
+        self.s.allowed_to_print()
+        self.s.allowed_to_print()
+        self.assertEqual(self.s._impl.allowed_to_print.call_count, 2)
+
+    def test_start_print_confirmed_clears_verdicts(self):
+        self.s._impl.api_getSelectedSpoolInformations.return_value = []
+        self.s._impl.allowed_to_print.return_value = MagicMock(
+            status_code=200, data="123"
+        )
+        self.s._impl.start_print_confirmed.return_value = MagicMock(
+            status_code=200, data="123"
+        )
+        self.s.allowed_to_print("a.gcode", now=0)
+        self.s.start_print_confirmed()
+        self.s.allowed_to_print("a.gcode", now=1)
+        self.assertEqual(self.s._impl.allowed_to_print.call_count, 2)
+
     def test_allowed_to_print(self):
         self.s._impl.allowed_to_print.return_value = MagicMock(
             status_code=200, data="123"
@@ -0,0 +1,121 @@
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+
+class UploadBatcher:
+    """Collects uploaded files to be added to the queue, so that a burst of
+    uploads (e.g. a folder of gcode files) is added in one transaction with a
+    single UI update rather than one per file.
+
+    Files that still need analysis (to infer their printer profile) are held
+    until on_analyzed() is called for them. The number held is capped, and
+    files waiting longer than `awaiting_timeout` seconds are added without
+    an inferred profile rather than waiting forever.
+    """
+
+    def __init__(
+        self,
+        needs_analysis,
+        add_sets,
+        logger,
+        window=2.0,
+        max_awaiting=100,
+        awaiting_timeout=300.0,
+        timer_cls=threading.Timer,
+        clock=time.monotonic,
+        on_error=None,
+    ):
+        self._needs_analysis = needs_analysis  # (path, sd) -> bool
+        self._add_sets = add_sets  # list of dict(path, sd, draft, profiles)
+        self._logger = logger
+        self._on_error = on_error  # (msg), called when a batch can't be added
+        self.window = window
+        self.max_awaiting = max_awaiting
+        self.awaiting_timeout = awaiting_timeout
+        self._timer_cls = timer_cls
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._timer = None
+        self._ready = []
+        self._awaiting = OrderedDict()  # path -> (item, deadline)
+        self._pending = set()  # (path, sd) of all ready and awaiting items
+
+    def add(self, path, sd, draft=True, profiles=[]):
+        item = dict(path=path, sd=sd, draft=draft, profiles=list(profiles))
+        needs_analysis = self._needs_analysis(path, sd)
+        with self._lock:
+            if (path, sd) in self._pending:
+                return  # Re-upload of a file that's not yet been added
+            self._pending.add((path, sd))
+            if needs_analysis:
+                self._logger.debug(f"Delaying add of {path} until analysis completes")
+                self._awaiting[path] = (item, self._clock() + self.awaiting_timeout)
+                while len(self._awaiting) > self.max_awaiting:
+                    (p, (old, _)) = self._awaiting.popitem(last=False)
+                    self._logger.warning(
+                        f"Too many uploads awaiting analysis; adding {p} without waiting"
+                    )
+                    self._ready.append(old)
+            else:
+                self._ready.append(item)
+            self._arm()
+
+    def on_analyzed(self, path, profile):
+        with self._lock:
+            pend = self._awaiting.pop(path, None)
+            if pend is None:
+                return
+            (item, _) = pend
+            if len(item["profiles"]) == 0 and profile not in (None, ""):
+                item["profiles"] = [profile]
+            self._ready.append(item)
+            self._arm()
+
+    def pending(self):
+        with self._lock:
+            return len(self._ready) + len(self._awaiting)
+
+    def _arm(self):
+        # Must hold self._lock. Waits for more uploads (or analyses) to
+        # arrive before adding anything.
+        if self._timer is not None:
+            return
+        self._timer = self._timer_cls(self.window, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            self._timer = None
+            now = self._clock()
+            for path, (item, deadline) in list(self._awaiting.items()):
+                if deadline > now:
+                    break  # Deadlines are in insertion order
+                self._logger.warning(
+                    f"Timed out waiting for analysis of {path}; adding without inferred profile"
+                )
+                del self._awaiting[path]
+                self._ready.append(item)
+            batch = self._ready
+            self._ready = []
+            for item in batch:
+                self._pending.discard((item["path"], item["sd"]))
+            if len(self._awaiting) > 0:
+                self._arm()  # Check again for expired items
+
+        if len(batch) == 0:
+            return
+        try:
+            self._add_sets(batch)
+        except Exception:
+            msg = (
+                f"Failed to add {len(batch)} uploaded file(s) to the queue: "
+                + ", ".join(item["path"] for item in batch)
+            )
+            if self._on_error is not None:
+                self._on_error(msg)
+            else:
+                self._logger.error(msg)
+                self._logger.error(traceback.format_exc())
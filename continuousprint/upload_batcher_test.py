@@ -0,0 +1,106 @@
+import unittest
+import logging
+from unittest.mock import MagicMock
+from .upload_batcher import UploadBatcher
+
+# logging.basicConfig(level=logging.DEBUG)
+
+
+class TestUploadBatcher(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.needs_analysis = MagicMock(return_value=False)
+        self.add_sets = MagicMock()
+        self.timer = MagicMock()
+        self.b = UploadBatcher(
+            self.needs_analysis,
+            self.add_sets,
+            logging.getLogger(),
+            max_awaiting=2,
+            awaiting_timeout=10,
+            timer_cls=self.timer,
+            clock=lambda: self.now,
+        )
+
+    def added(self):
+        return [[i["path"] for i in c[0][0]] for c in self.add_sets.call_args_list]
+
+    def test_batches_uploads(self):
+        self.b.add("a.gcode", False)
+        self.b.add("b.gcode", False)
+        self.timer.assert_called_once_with(self.b.window, self.b.flush)
+        self.add_sets.assert_not_called()
+        self.b.flush()
+        self.assertEqual(self.added(), [["a.gcode", "b.gcode"]])
+        self.assertEqual(self.b.pending(), 0)
+
+    def test_flush_nothing(self):
+        self.b.flush()
+        self.add_sets.assert_not_called()
+
+    def test_waits_for_analysis(self):
+        self.needs_analysis.return_value = True
+        self.b.add("a.gcode", False)
+        self.b.add("a.gcode", False)  # Duplicate ignored
+        self.b.flush()
+        self.add_sets.assert_not_called()
+        self.b.on_analyzed("a.gcode", "prof")
+        self.b.on_analyzed("b.gcode", "prof")  # Not pending, ignored
+        self.b.flush()
+        self.add_sets.assert_called_once_with(
+            [dict(path="a.gcode", sd=False, draft=True, profiles=["prof"])]
+        )
+
+    def test_explicit_profiles_kept(self):
+        self.needs_analysis.return_value = True
+        self.b.add("a.gcode", False, profiles=["mine"])
+        self.b.on_analyzed("a.gcode", "prof")
+        self.b.flush()
+        self.assertEqual(self.add_sets.call_args[0][0][0]["profiles"], ["mine"])
+
+    def test_awaiting_capped(self):
+        self.needs_analysis.return_value = True
+        for p in ("a.gcode", "b.gcode", "c.gcode"):
+            self.b.add(p, False)
+        self.b.flush()
+        self.assertEqual(self.added(), [["a.gcode"]])  # Oldest added without waiting
+        self.assertEqual(self.b.pending(), 2)
+
+    def test_awaiting_expires(self):
+        self.needs_analysis.return_value = True
+        self.b.add("a.gcode", False)
+        self.now = 5
+        self.b.add("b.gcode", False)
+        self.now = 11
+        self.b.flush()
+        self.assertEqual(self.added(), [["a.gcode"]])
+        self.assertEqual(self.b.pending(), 1)
+
+    def test_add_sets_error_logged(self):
+        self.add_sets.side_effect = Exception("testing - ignore this")
+        self.b.add("a.gcode", False)
+        self.b.flush()  # Does not raise
+        self.assertEqual(self.b.pending(), 0)
+
+    def test_add_sets_error_reported(self):
+        self.b._on_error = MagicMock()
+        self.add_sets.side_effect = Exception("testing - ignore this")
+        self.b.add("a.gcode", False)
+        self.b.flush()
+        self.b._on_error.assert_called_once()
+        self.assertIn("a.gcode", self.b._on_error.call_args[0][0])
+
+    def test_duplicate_uploads_ignored(self):
+        self.b.add("a.gcode", False)
+        self.b.add("a.gcode", True)  # Different file, on SD
+        self.needs_analysis.return_value = True
+        self.b.add("a.gcode", False)  # Already ready; not held for analysis
+        self.b.flush()
+        self.assertEqual(self.added(), [["a.gcode", "a.gcode"]])
+        self.assertEqual(self.b.pending(), 0)
+
+        # Once added, a later upload of the same file is added again
+        self.needs_analysis.return_value = False
+        self.b.add("a.gcode", False)
+        self.b.flush()
+        self.assertEqual(self.added()[-1], ["a.gcode"])